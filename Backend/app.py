@@ -1,32 +1,67 @@
-from flask import Flask, request, jsonify
-import requests
-import firebase_config  # initializes firebase_admin
-import firebase_admin.auth as firebase_auth
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
-import assemblyai as aai
-import base64
-import tempfile
 import os
-import re
-import json as pyjson
 from dotenv import load_dotenv
-from firebase_admin import firestore
-import google.generativeai as genai
 import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from transcription import (transcribe_chunks, stream_transcription, sse_event, transcribe_stream,
+                           UploadError, UploadTooLarge, AudioTooSlow, MAX_UPLOAD_BYTES)
+import providers
+import repository
+import summaries
+import metrics
+import http_cache
+import resilience
+from metrics import span
+from middleware import verify_firebase_token, internal_only, is_caller, forbidden, key_refresh_stats
+from jobs import job_queue, QueueFull, FINISHED_STATES
+from llm_cache import response_cache, make_key, normalize_text, normalize_symptoms, ANALYZE_PROMPT_VERSION, PREDICT_PROMPT_VERSION
+from symptom_extractor import extractor, extraction_stats, LOCAL_EXTRACTION_ENABLED
+from symptom_index import symptom_index
+from model_output import parse_prediction, parse_symptom_list, ParseError, AilmentStream
+from singleflight import single_flight, flight_key
+from audio_preprocess import preprocess_stats
+from http_cache import cache_for, report_cache, http_stats, IMMUTABLE_MAX_AGE
+from resilience import ProviderUnavailable
+from scheduling import slot_engine, SlotError, SlotUnavailable, URGENCY_WINDOWS
 
 # Load environment variables first
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
+# Flask runs after_request hooks in reverse registration order, so metrics goes
+# first to time the whole response, including compression in http_cache
+metrics.init_app(app)
 CORS(app)
+http_cache.init_app(app)
+resilience.init_app(app)
 
 FIREBASE_API_KEY = os.getenv('FIREBASE_API_KEY')  # found in Project Settings > Web API key
 
-# Google API Key
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
+# Gemini, AssemblyAI and Firebase Admin are configured by providers on first use
+if providers.WARMUP_ENABLED:
+    providers.warm_up()
+
+GEMINI_MODEL = "gemini-1.5-flash"  # or "gemini-1.5-pro" for better accuracy
+
+UNABLE_TO_ANALYZE = {
+    "possibleAilments": [],
+    "recommendations": ["Unable to analyze symptoms. Please consult a healthcare professional."],
+    "urgency": "medium",
+    "shouldSeeDoctor": True
+}
+
+# Runs the Firestore profile read alongside transcription in the voice pipeline
+_pipeline_pool = ThreadPoolExecutor(max_workers=int(os.getenv('PIPELINE_WORKERS', '8')), thread_name_prefix='pipeline')
 
-# Configure AssemblyAI
-aai.settings.api_key = os.getenv('ASSEMBLYAI_API_KEY')  # Set API key for AssemblyAI
+def provider_unavailable(e, body=None):
+    # 503 with a Retry-After matching the open circuit, so clients back off instead of hammering
+    response = jsonify(body or {'error': str(e)})
+    response.headers['Retry-After'] = str(resilience.retry_after(e))
+    return response, 503
 
 @app.route('/api/auth/login', methods=['POST'])
 def login():
@@ -35,16 +70,8 @@ def login():
     password = data.get('password')
 
     try:
-        # Firebase Auth REST API URL
-        url = f"https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword?key={FIREBASE_API_KEY}"
-        payload = {
-            "email": email,
-            "password": password,
-            "returnSecureToken": True
-        }
-
-        response = requests.post(url, json=payload)
-        result = response.json()
+        # Firebase Auth REST API
+        result = providers.sign_in_with_password(FIREBASE_API_KEY, email, password)
 
         if "idToken" in result:
             return jsonify({
@@ -55,10 +82,13 @@ def login():
         else:
             return jsonify({"message": result.get("error", {}).get("message", "Login failed")}), 401
 
+    except ProviderUnavailable as e:
+        return provider_unavailable(e, {"message": "Sign-in is temporarily unavailable", "error": str(e)})
     except Exception as e:
         return jsonify({"message": "Internal Server Error", "error": str(e)}), 500
 
 @app.route('/api/transcribe', methods=['POST'])
+@verify_firebase_token
 def transcribe_audio():
 
     try:
@@ -66,79 +96,160 @@ def transcribe_audio():
         if not data or 'audio_chunks' not in data or not data['audio_chunks']:
             return jsonify({'error': 'No audio data provided'}), 400
 
-        # Use the first chunk (assuming only one for now)
-        audio_b64 = data['audio_chunks'][0]
-        audio_data = base64.b64decode(audio_b64.split(',')[1])
-
-        # Write to a temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_file:
-            tmp_file.write(audio_data)
-            audio_file_path = tmp_file.name
-
-        # Call the transcription function
-        transcriber = aai.Transcriber()
-        transcript = transcriber.transcribe(audio_file_path)
+        text = transcribe_chunks(data['audio_chunks'])
+        return jsonify({'text': text})
 
-        # Cleanup
-        os.unlink(audio_file_path)
+    except AudioTooSlow as e:
+        return jsonify({'error': str(e)}), 422
+    except ProviderUnavailable as e:
+        return provider_unavailable(e)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
-        if transcript.status == aai.TranscriptStatus.error:
-            return jsonify({'error': transcript.error}), 500
+@app.route('/api/transcribe/upload', methods=['POST'])
+@verify_firebase_token
+def transcribe_audio_upload():
+    # Raw audio/* (or octet-stream) body, or multipart/form-data with an "audio" file field
+    if request.content_length is not None and request.content_length > MAX_UPLOAD_BYTES:
+        return jsonify({'error': f'Audio upload exceeds {MAX_UPLOAD_BYTES} bytes'}), 413
 
-        return jsonify({'text': transcript.text})
+    try:
+        if request.mimetype == 'multipart/form-data':
+            audio = request.files.get('audio')
+            if audio is None:
+                return jsonify({'error': 'No audio data provided'}), 400
+            text = transcribe_stream(audio.stream)
+        elif request.mimetype.startswith('audio/') or request.mimetype == 'application/octet-stream':
+            text = transcribe_stream(request.stream)
+        else:
+            return jsonify({'error': 'Send audio/* or multipart/form-data'}), 415
+        return jsonify({'text': text})
 
+    except UploadTooLarge as e:
+        return jsonify({'error': str(e)}), 413
+    except AudioTooSlow as e:
+        return jsonify({'error': str(e)}), 422
+    except UploadError as e:
+        return jsonify({'error': str(e)}), 400
+    except ProviderUnavailable as e:
+        return provider_unavailable(e)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/transcribe/stream', methods=['POST'])
+@verify_firebase_token
+def transcribe_audio_stream():
+    data = request.json
+    if not data or 'audio_chunks' not in data or not data['audio_chunks']:
+        return jsonify({'error': 'No audio data provided'}), 400
+
+    events = stream_transcription(data['audio_chunks'], segmented=bool(data.get('segmented')))
+    return Response(stream_with_context(events), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+# Static per deployment, so it is built once and browsers may keep it for FIREBASE_CONFIG_MAX_AGE
+FIREBASE_WEB_CONFIG = {
+    "apiKey": os.getenv("FIREBASE_API_KEY"),
+    "projectId": os.getenv("FIREBASE_PROJECT_ID"),
+    "authDomain": os.getenv("FIREBASE_AUTH_DOMAIN"),
+    "storageBucket": os.getenv("FIREBASE_STORAGE_BUCKET"),
+    "messagingSenderId": os.getenv("FIREBASE_MESSAGING_SENDER_ID"),
+    "appId": os.getenv("FIREBASE_APP_ID")
+}
+
 @app.route('/firebase-config', methods=['GET'])
+@cache_for(int(os.getenv('FIREBASE_CONFIG_MAX_AGE', '86400')), public=True)
 def get_firebase_config():
-    config = {
-        "apiKey": os.getenv("FIREBASE_API_KEY"),
-        "projectId": os.getenv("FIREBASE_PROJECT_ID"),
-        "authDomain": os.getenv("FIREBASE_AUTH_DOMAIN"),
-        "storageBucket": os.getenv("FIREBASE_STORAGE_BUCKET"),
-        "messagingSenderId": os.getenv("FIREBASE_MESSAGING_SENDER_ID"),
-        "appId": os.getenv("FIREBASE_APP_ID")
-    }
-    return jsonify(config)
+    return jsonify(FIREBASE_WEB_CONFIG)
 
-@app.route('/api/analyze-symptoms', methods=['POST'])
-def analyze_symptoms():
-    try:
-        data = request.get_json()
-        transcript = data.get('transcript', '')
-        if not transcript:
-            return jsonify({'error': 'No transcript provided'}), 400
+@app.route('/metrics', methods=['GET'])
+@internal_only
+def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/cache-stats', methods=['GET'])
+@internal_only
+def get_cache_stats():
+    return jsonify({**response_cache.stats(), 'symptomExtraction': extraction_stats.stats(),
+                    'singleFlight': single_flight.stats(), 'reportCache': report_cache.stats(),
+                    'http': http_stats.stats()})
 
-        model = genai.GenerativeModel("gemini-1.5-flash")  # or "gemini-1.5-pro" for better accuracy
+def extract_symptoms(transcript):
+    extraction = None
+    if LOCAL_EXTRACTION_ENABLED:
+        with span('symptoms.local_extract'):
+            extraction = extractor.extract(transcript)
+        extraction_stats.record(extraction.confident)
+        if extraction.confident:
+            return extraction.symptoms
 
-        prompt = ("You are a medical assistant.\n"
+    cache_key = make_key(GEMINI_MODEL, ANALYZE_PROMPT_VERSION, transcript=normalize_text(transcript))
+    cached = response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    model = providers.get_model(GEMINI_MODEL)
+
+    prompt = ("You are a medical assistant.\n"
 "Extract all **medical symptoms** mentioned in the following transcript.\n"
 "Include both direct symptoms (e.g., 'fever', 'cough') and indirect or less obvious symptoms (e.g., 'loss of appetite', 'loss of smell or taste').\n"
 "Also include any **pain descriptions**, such as headaches, stomach pain, chest tightness, or any mention of discomfort, even if described vividly (e.g., 'my head feels like it's being hit with a hammer').\n"
 "Return the result strictly as a JSON array of strings, e.g., [\"fever\", \"cough\", \"loss of smell\", \"severe headache\"].\n\n"
 f"Transcript:\n{transcript}"
-        )
+    )
 
-        response = model.generate_content(prompt)
-        symptoms = []
-        
-        if response and hasattr(response, 'text'):
-            # Try to extract the JSON array from the model's response
-            text = response.text
-            # Find the first JSON array in the text
-            match = re.search(r'\[.*?\]', text, re.DOTALL)
-            if match:
-                try:
-                    symptoms = pyjson.loads(match.group(0))
-                except Exception:
-                    symptoms = []
-        
-        return jsonify({'symptoms': symptoms})
+    try:
+        with span('gemini.generate_content'):
+            response = resilience.gemini.call(
+                lambda: model.generate_content(prompt, generation_config=providers.json_generation_config()))
+    except ProviderUnavailable as e:
+        # The lexicon match is a partial answer, but better than none while Gemini is down
+        resilience.gemini.record_fallback()
+        logger.warning("%s; using local symptom extraction", e)
+        return extraction.symptoms if extraction is not None else extractor.extract(transcript).symptoms
+    symptoms = []
+
+    if response and hasattr(response, 'text'):
+        try:
+            with span('parse_model_output'):
+                symptoms = parse_symptom_list(response.text)
+            response_cache.set(cache_key, symptoms)
+        except ParseError:
+            logger.warning("Unparseable symptom list from model: %.200r", response.text)
+
+    return symptoms
+
+@app.route('/api/analyze-symptoms', methods=['POST'])
+@verify_firebase_token
+def analyze_symptoms():
+    try:
+        data = request.get_json()
+        transcript = data.get('transcript', '')
+        if not transcript:
+            return jsonify({'error': 'No transcript provided'}), 400
+
+        return jsonify({'symptoms': extract_symptoms(transcript)})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def is_symptom_list(symptoms):
+    # Checked before canonicalization: lookups are memoized, so every item must be a hashable string
+    return isinstance(symptoms, list) and all(isinstance(symptom, str) for symptom in symptoms)
+
+SYMPTOM_LIST_ERROR = 'symptoms must be a list of strings'
+
+def symptom_fields(symptoms):
+    # Raw strings are kept as reported; the canonical IDs are what dedup and history queries compare
+    symptom_ids, canonical = symptom_index.canonicalize(symptoms)
+    return {
+        'symptoms': symptoms,
+        'symptomIds': symptom_ids,
+        'canonicalSymptoms': canonical,
+        'lexiconVersion': symptom_index.version
+    }
+
 @app.route('/api/save-symptoms', methods=['POST'])
+@verify_firebase_token
 def save_symptoms():
     try:
         data = request.get_json()
@@ -149,61 +260,42 @@ def save_symptoms():
         
         if not user_id:
             return jsonify({'error': 'User ID required'}), 400
+        if not is_symptom_list(symptoms):
+            return jsonify({'error': SYMPTOM_LIST_ERROR}), 400
+        if not is_caller(user_id):
+            return forbidden()
 
-        # Save to Firestore with user association
-        db = firestore.client()
-        doc_ref = db.collection('userSymptoms').add({
+        # Save to Firestore with user association; the summary is updated in the same batch
+        symptom_ref = repository.symptom_ref()
+        symptom_data = {
             'userId': user_id,
             'transcript': transcript,
-            'symptoms': symptoms,
+            **symptom_fields(symptoms),
             'audioUrl': audio_url,
-            'created': firestore.SERVER_TIMESTAMP,
+            'created': repository.server_timestamp(),
             'status': 'symptoms_identified'
-        })
+        }
+        summary = repository.get_summary(user_id)
+        batch = repository.batch()
+        batch.set(symptom_ref, symptom_data)
+        summaries.stage(batch, user_id, summaries.symptom_recorded(summary, user_id, symptom_ref.id, symptom_data))
+        repository.commit(batch)
 
         return jsonify({
             'message': 'Symptoms saved successfully',
-            'symptomId': doc_ref[1].id
+            'symptomId': symptom_ref.id
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/predict-ailment', methods=['POST'])
-def predict_ailment():
-    try:
-        data = request.get_json()
-        user_id = data.get('userId')
-        symptoms = data.get('symptoms', [])
-        symptom_id = data.get('symptomId')
-        
-        if not user_id or not symptoms:
-            return jsonify({'error': 'User ID and symptoms required'}), 400
+PREDICTION_VERSION = f"{GEMINI_MODEL}/{PREDICT_PROMPT_VERSION}"  # stored with each prediction so re-scoring can skip current ones
+FALLBACK_PREDICTION_VERSION = 'fallback'
 
-        # Get user's medical information
-        db = firestore.client()
-        user_doc = db.collection('users').document(user_id).get()
-        medical_info = {}
-        if user_doc.exists:
-            medical_info = user_doc.to_dict()
-
-        # Prepare medical context
-        medical_context = ""
-        if medical_info:
-            if medical_info.get('allergies'):
-                medical_context += f"Allergies: {medical_info['allergies']}\n"
-            if medical_info.get('medications'):
-                medical_context += f"Current Medications: {medical_info['medications']}\n"
-            if medical_info.get('conditions'):
-                medical_context += f"Chronic Conditions: {medical_info['conditions']}\n"
+def prediction_version(prediction):
+    # Fallbacks served while the model was unavailable or unparseable must stay eligible for re-scoring
+    return FALLBACK_PREDICTION_VERSION if prediction == UNABLE_TO_ANALYZE else PREDICTION_VERSION
 
-        # Use Gemini to predict ailment
-        model = genai.GenerativeModel("gemini-1.5-flash")
-        
-        prompt = ("You are a knowledgeable and careful medical assistant.\n"
-"Analyze the following list of symptoms and medical context to predict possible ailments.\n"
-"Consider both direct and indirect symptoms, chronic conditions, recent medical events, and lifestyle indicators.\n"
-"Be accurate, use common medical reasoning, and provide output strictly as a JSON object in the following structure:\n"
-"{\n"
+PREDICTION_SCHEMA = ("{\n"
 '  "possibleAilments": [\n'
 '    {\n'
 '      "name": "Name of the possible ailment",\n'
@@ -217,87 +309,306 @@ def predict_ailment():
 '  ],\n'
 '  "urgency": "high" | "medium" | "low",  // Based on severity of symptoms or risk\n'
 '  "shouldSeeDoctor": true | false       // True if medical attention is advisable soon\n'
-"}\n\n"
+"}\n"
+)
+
+def build_medical_context(medical_info):
+    medical_context = ""
+    if medical_info:
+        if medical_info.get('allergies'):
+            medical_context += f"Allergies: {medical_info['allergies']}\n"
+        if medical_info.get('medications'):
+            medical_context += f"Current Medications: {medical_info['medications']}\n"
+        if medical_info.get('conditions'):
+            medical_context += f"Chronic Conditions: {medical_info['conditions']}\n"
+    return medical_context
+
+def build_predict_prompt(symptoms, medical_info):
+    """Return (cache key, prompt) for a prediction request."""
+    # Prepare medical context
+    medical_context = build_medical_context(medical_info)
+
+    cache_key = make_key(
+        GEMINI_MODEL, PREDICT_PROMPT_VERSION,
+        symptoms=normalize_symptoms(symptoms),
+        allergies=medical_info.get('allergies'),
+        medications=medical_info.get('medications'),
+        conditions=medical_info.get('conditions')
+    )
+    prompt = ("You are a knowledgeable and careful medical assistant.\n"
+"Analyze the following list of symptoms and medical context to predict possible ailments.\n"
+"Consider both direct and indirect symptoms, chronic conditions, recent medical events, and lifestyle indicators.\n"
+"Be accurate, use common medical reasoning, and provide output strictly as a JSON object in the following structure:\n"
+f"{PREDICTION_SCHEMA}\n"
 f"Symptoms: {', '.join(symptoms)}\n"
 f"Medical Context:\n{medical_context}"
-        )
+    )
+    return cache_key, prompt
+
+def build_batch_predict_prompt(cases):
+    """Prompt for several independent (symptoms, medical_info) cases answered in one response."""
+    sections = []
+    for number, (symptoms, medical_info) in enumerate(cases, 1):
+        sections.append(f"Case {number}:\n"
+                        f"Symptoms: {', '.join(symptoms)}\n"
+                        f"Medical Context:\n{build_medical_context(medical_info) or 'None'}\n")
+    return ("You are a knowledgeable and careful medical assistant.\n"
+"For each of the independent cases below, analyze the list of symptoms and medical context to predict possible ailments.\n"
+"Consider both direct and indirect symptoms, chronic conditions, recent medical events, and lifestyle indicators.\n"
+"Judge every case on its own; do not let one case influence another.\n"
+"Be accurate, use common medical reasoning, and provide output strictly as a JSON object of the form\n"
+'{"results": [{"case": <case number>, ...prediction...}, ...]}\n'
+"with exactly one entry per case, where each prediction has the following structure:\n"
+f"{PREDICTION_SCHEMA}\n"
++ "\n".join(sections)
+    )
+
+def predict_from_profile(symptoms, medical_info):
+    cache_key, prompt = build_predict_prompt(symptoms, medical_info)
+    prediction = response_cache.get(cache_key)
+    if prediction is None:
+        # Use Gemini to predict ailment
+        model = providers.get_model(GEMINI_MODEL)
 
-        response = model.generate_content(prompt)
+        try:
+            with span('gemini.generate_content'):
+                response = resilience.gemini.call(
+                    lambda: model.generate_content(prompt, generation_config=providers.json_generation_config()))
+        except ProviderUnavailable as e:
+            resilience.gemini.record_fallback()
+            logger.warning("%s; returning fallback prediction", e)
+            return dict(UNABLE_TO_ANALYZE)
         prediction = {}
         
         if response and hasattr(response, 'text'):
-            text = response.text
-            # Find JSON object in the response
-            match = re.search(r'\{.*\}', text, re.DOTALL)
-            if match:
-                try:
-                    prediction = pyjson.loads(match.group(0))
-                except Exception:
-                    prediction = {
-                        "possibleAilments": [],
-                        "recommendations": ["Unable to analyze symptoms. Please consult a healthcare professional."],
-                        "urgency": "medium",
-                        "shouldSeeDoctor": True
-                    }
-            else:
-                prediction = {
-                    "possibleAilments": [],
-                    "recommendations": ["Unable to analyze symptoms. Please consult a healthcare professional."],
-                    "urgency": "medium",
-                    "shouldSeeDoctor": True
-                }
-
-        # Update the symptom record with prediction
-        if symptom_id:
-            db.collection('userSymptoms').document(symptom_id).update({
-                'prediction': prediction,
-                'status': 'ailment_predicted',
-                'predictedAt': firestore.SERVER_TIMESTAMP
-            })
-
-        return jsonify(prediction)
+            try:
+                with span('parse_model_output'):
+                    prediction = parse_prediction(response.text)
+                response_cache.set(cache_key, prediction)
+            except ParseError:
+                logger.warning("Unparseable prediction from model: %.200r", response.text)
+                prediction = dict(UNABLE_TO_ANALYZE)
+
+    return prediction
+
+def prediction_flight_key(user_id, symptoms, symptom_id):
+    return flight_key('predict-ailment', user_id, symptom_id, normalize_symptoms(symptoms))
+
+def predict_ailment_for(user_id, symptoms, symptom_id=None):
+    # Double-clicks and client retries share one model call and one write,
+    # including with a request on the streaming route
+    key = prediction_flight_key(user_id, symptoms, symptom_id)
+    prediction, _ = single_flight.do(key, lambda: _predict_ailment_for(user_id, symptoms, symptom_id))
+    return prediction
+
+class NotOwner(Exception):
+    pass
+
+def load_prediction_context(user_id, symptom_id):
+    """Return (medical_info, summary); the summary is only needed when a symptom record is updated.
+
+    Raises NotOwner when ``symptom_id`` belongs to another user.
+    """
+    if not symptom_id:
+        return repository.get_user(user_id) or {}, None
+    medical_info, summary, symptom_data = repository.get_many(
+        repository.user_ref(user_id), repository.summary_ref(user_id), repository.symptom_ref(symptom_id))
+    if symptom_data is not None and symptom_data.get('userId') != user_id:
+        raise NotOwner(symptom_id)
+    return medical_info or {}, summary
+
+def owns_symptom(user_id, symptom_data):
+    return symptom_data is None or symptom_data.get('userId') == user_id
+
+def record_prediction(user_id, symptom_id, prediction, summary):
+    batch = repository.batch()
+    batch.update(repository.symptom_ref(symptom_id), {
+        'prediction': prediction,
+        'predictionVersion': prediction_version(prediction),
+        'status': 'ailment_predicted',
+        'predictedAt': repository.server_timestamp()
+    })
+    summaries.stage(batch, user_id, summaries.prediction_recorded(summary, user_id, symptom_id, prediction))
+    repository.commit(batch)
+
+def _predict_ailment_for(user_id, symptoms, symptom_id):
+    # Get user's medical information
+    medical_info, summary = load_prediction_context(user_id, symptom_id)
+
+    prediction = predict_from_profile(symptoms, medical_info)
+
+    # Update the symptom record with prediction
+    if symptom_id:
+        record_prediction(user_id, symptom_id, prediction, summary)
+
+    return prediction
+
+@app.route('/api/predict-ailment', methods=['POST'])
+@verify_firebase_token
+def predict_ailment():
+    try:
+        data = request.get_json()
+        user_id = data.get('userId')
+        symptoms = data.get('symptoms', [])
+        symptom_id = data.get('symptomId')
+        
+        if not user_id or not symptoms:
+            return jsonify({'error': 'User ID and symptoms required'}), 400
+        if not is_symptom_list(symptoms):
+            return jsonify({'error': SYMPTOM_LIST_ERROR}), 400
+        if not is_caller(user_id):
+            return forbidden()
+
+        return jsonify(predict_ailment_for(user_id, symptoms, symptom_id))
+    except NotOwner:
+        return forbidden()
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def _stream_chunk_text(chunk):
+    try:
+        return chunk.text
+    except ValueError:
+        # Chunks without text parts (e.g. safety metadata) raise on .text
+        return ''
+
+def _stream_prediction(user_id, symptoms, symptom_id, medical_info, summary):
+    """Yield an ``ailment`` event per completed possibleAilments entry; returns the prediction."""
+    cache_key, prompt = build_predict_prompt(symptoms, medical_info)
+    prediction = response_cache.get(cache_key)
+    if prediction is not None:
+        for ailment in prediction.get('possibleAilments', []):
+            yield sse_event('ailment', ailment)
+    else:
+        model = providers.get_model(GEMINI_MODEL)
+        parser = AilmentStream()
+        parts = []
+        try:
+            with span('gemini.generate_content_stream'):
+                for chunk in resilience.gemini.stream(lambda: model.generate_content(
+                        prompt, stream=True, generation_config=providers.json_generation_config())):
+                    text = _stream_chunk_text(chunk)
+                    parts.append(text)
+                    for ailment in parser.feed(text):
+                        yield sse_event('ailment', ailment)
+        except ProviderUnavailable as e:
+            resilience.gemini.record_fallback()
+            logger.warning("%s; returning fallback prediction", e)
+            parts = None
+        if parts is None:
+            prediction = dict(UNABLE_TO_ANALYZE)
+        else:
+            text = ''.join(parts)
+            try:
+                prediction = parse_prediction(text)
+                response_cache.set(cache_key, prediction)
+            except ParseError:
+                logger.warning("Unparseable streamed prediction from model: %.200r", text)
+                prediction = dict(UNABLE_TO_ANALYZE)
+
+    # One write once the full prediction is known
+    if symptom_id:
+        record_prediction(user_id, symptom_id, prediction, summary)
+    return prediction
+
+def stream_prediction_events(user_id, symptoms, symptom_id, medical_info, summary):
+    """Yield SSE events: one ``ailment`` per completed possibleAilments entry, then ``prediction``.
+
+    Shares predict_ailment_for's single-flight key: a duplicate request, streamed
+    or not, waits for the first one's prediction instead of calling the model again.
+    """
+    try:
+        key = prediction_flight_key(user_id, symptoms, symptom_id)
+        prediction, shared = yield from single_flight.stream(
+            key, lambda: _stream_prediction(user_id, symptoms, symptom_id, medical_info, summary))
+        if shared:
+            for ailment in prediction.get('possibleAilments', []):
+                yield sse_event('ailment', ailment)
+        yield sse_event('prediction', prediction)
+    except Exception as e:
+        logger.exception("Streaming prediction failed for user %s", user_id)
+        yield sse_event('error', {'error': str(e)})
+
+@app.route('/api/predict-ailment/stream', methods=['POST'])
+@verify_firebase_token
+def predict_ailment_stream():
+    data = request.get_json() or {}
+    user_id = data.get('userId')
+    symptoms = data.get('symptoms', [])
+    if not user_id or not symptoms:
+        return jsonify({'error': 'User ID and symptoms required'}), 400
+    if not is_symptom_list(symptoms):
+        return jsonify({'error': SYMPTOM_LIST_ERROR}), 400
+    if not is_caller(user_id):
+        return forbidden()
+
+    # Loaded before the stream starts, so a foreign symptom record is refused with a status code
+    try:
+        medical_info, summary = load_prediction_context(user_id, data.get('symptomId'))
+    except NotOwner:
+        return forbidden()
+    events = stream_prediction_events(user_id, symptoms, data.get('symptomId'), medical_info, summary)
+    return Response(stream_with_context(events), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+MAX_PAGE_SIZE = 50
+HEALTH_REPORT_SUMMARY_FIELDS = ('transcript', 'symptoms', 'prediction', 'created', 'status')
+APPOINTMENT_FIELDS = ('appointmentId', 'patientInfo', 'symptoms', 'aiAnalysis', 'preferredDate',
+                      'preferredTime', 'clinicianId', 'clinicianName', 'slotStart', 'slotEnd',
+                      'urgency', 'notes', 'status', 'createdAt')
+
+def parse_page_args(default_size, allowed_fields):
+    # ?limit=<n>&start_after=<token>&fields=a,b
+    try:
+        page_size = int(request.args.get('limit', default_size))
+    except ValueError:
+        raise ValueError('limit must be an integer')
+    if not 1 <= page_size <= MAX_PAGE_SIZE:
+        raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+
+    fields = None
+    if request.args.get('fields'):
+        fields = [f.strip() for f in request.args['fields'].split(',') if f.strip()]
+        unknown = [f for f in fields if f not in allowed_fields]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+
+    return page_size, request.args.get('start_after'), fields
+
+def project(item, fields):
+    if not fields:
+        return item
+    return {key: value for key, value in item.items() if key == 'id' or key in fields}
+
 @app.route('/api/health-reports/<user_id>', methods=['GET'])
+@verify_firebase_token
 def get_health_reports(user_id):
     try:
-        print(f"Starting get_health_reports for user: {user_id}")
-        
         if not user_id:
             return jsonify({'error': 'User ID required'}), 400
+        if not is_caller(user_id):
+            return forbidden()
+
+        try:
+            page_size, page_token, fields = parse_page_args(10, HEALTH_REPORT_SUMMARY_FIELDS)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
-        db = firestore.client()
-        print("Firestore client initialized successfully")
-        
         # Get user's symptom history with predictions
         try:
-            print("Attempting to query userSymptoms collection...")
-            # First try to query with ordering by created field
-            try:
-                symptoms_query = db.collection('userSymptoms').where('userId', '==', user_id).order_by('created', direction=firestore.Query.DESCENDING).limit(10)
-                symptoms_docs = symptoms_query.stream()
-                print("Query with ordering successful")
-            except Exception as order_error:
-                # If ordering fails, try without ordering
-                print(f"Ordering failed, trying without order: {str(order_error)}")
-                symptoms_query = db.collection('userSymptoms').where('userId', '==', user_id).limit(10)
-                symptoms_docs = symptoms_query.stream()
-                print("Query without ordering successful")
+            symptoms_docs, next_page_token = repository.fetch_page(
+                repository.symptoms_query(user_id), repository.USER_SYMPTOMS,
+                page_size, page_token, fields
+            )
+        except repository.InvalidPageToken as e:
+            return jsonify({'error': str(e)}), 400
         except Exception as e:
-            print(f"Error querying symptoms: {str(e)}")
-            print(f"Error type: {type(e)}")
-            import traceback
-            print(f"Full traceback: {traceback.format_exc()}")
+            logger.exception("Error querying symptoms for user %s", user_id)
             return jsonify({'error': f'Error querying symptoms: {str(e)}'}), 500
         
         health_reports = []
         try:
-            print("Processing symptom documents...")
-            doc_count = 0
             for doc in symptoms_docs:
-                doc_count += 1
-                print(f"Processing document {doc_count}: {doc.id}")
                 data = doc.to_dict()
                 created_ts = data.get('created')
                 
@@ -312,61 +623,130 @@ def get_health_reports(user_id):
                         # Try to convert to string
                         created_str = str(created_ts)
                 
-                health_reports.append({
+                health_reports.append(project({
                     'id': doc.id,
                     'transcript': data.get('transcript', ''),
                     'symptoms': data.get('symptoms', []),
                     'prediction': data.get('prediction', {}),
                     'created': created_str,
                     'status': data.get('status', '')
-                })
-                print(f"Successfully processed document {doc.id}")
-            
-            print(f"Total documents processed: {doc_count}")
+                }, fields))
         except Exception as e:
-            print(f"Error processing symptom data: {str(e)}")
-            print(f"Error type: {type(e)}")
-            import traceback
-            print(f"Full traceback: {traceback.format_exc()}")
+            logger.exception("Error processing symptom data for user %s", user_id)
             return jsonify({'error': f'Error processing symptom data: {str(e)}'}), 500
 
-        print(f"Returning {len(health_reports)} health reports")
-        return jsonify({'healthReports': health_reports})
+        return jsonify({'healthReports': health_reports, 'nextPageToken': next_page_token})
     except Exception as e:
-        print(f"Unexpected error in get_health_reports: {str(e)}")
-        print(f"Error type: {type(e)}")
-        import traceback
-        print(f"Full traceback: {traceback.format_exc()}")
+        logger.exception("Unexpected error in get_health_reports")
         return jsonify({'error': f'Unexpected error in get_health_reports: {str(e)}'}), 500
 
+def serialize_health_report(report_id, report_data):
+    report_data['id'] = report_id
+
+    # Convert timestamp fields to ISO 8601 strings for JSON serialization
+    if report_data.get('reportGeneratedAt') and hasattr(report_data['reportGeneratedAt'], 'isoformat'):
+        report_data['reportGeneratedAt'] = report_data['reportGeneratedAt'].isoformat()
+
+    if 'symptomAnalysis' in report_data and report_data.get('symptomAnalysis', {}).get('recordedAt') and hasattr(report_data['symptomAnalysis']['recordedAt'], 'isoformat'):
+        report_data['symptomAnalysis']['recordedAt'] = report_data['symptomAnalysis']['recordedAt'].isoformat()
+
+    return report_data
+
+def load_health_reports(report_ids):
+    """Return {report_id: serialized report} for the reports that exist, reading only uncached ones."""
+    found = {}
+    uncached = []
+    for report_id in report_ids:
+        report = report_cache.get(report_id)
+        if report is None:
+            uncached.append(report_id)
+        else:
+            found[report_id] = report
+    if uncached:
+        reports = repository.get_many(*[repository.health_report_ref(report_id) for report_id in uncached])
+        for report_id, report_data in zip(uncached, reports):
+            if report_data is not None:
+                found[report_id] = serialize_health_report(report_id, report_data)
+                report_cache.set(report_id, found[report_id])
+    return found
+
 @app.route('/api/health-reports/detailed/<report_id>', methods=['GET'])
+@verify_firebase_token
+@cache_for(IMMUTABLE_MAX_AGE, immutable=True)
 def get_detailed_health_report(report_id):
     try:
         if not report_id:
             return jsonify({'error': 'Report ID required'}), 400
 
-        db = firestore.client()
-        
         # Get the detailed health report
-        report_doc = db.collection('healthReports').document(report_id).get()
-        if not report_doc.exists:
+        report = load_health_reports([report_id]).get(report_id)
+        if report is None:
             return jsonify({'error': 'Health report not found'}), 404
-            
-        report_data = report_doc.to_dict()
-        report_data['id'] = report_id
+        if not is_caller(report.get('userId')):
+            return forbidden()
 
-        # Convert timestamp fields to ISO 8601 strings for JSON serialization
-        if report_data.get('reportGeneratedAt') and hasattr(report_data['reportGeneratedAt'], 'isoformat'):
-            report_data['reportGeneratedAt'] = report_data['reportGeneratedAt'].isoformat()
+        return jsonify({'healthReport': report})
+    except Exception as e:
+        return jsonify({'error': f'Error retrieving health report: {str(e)}'}), 500
 
-        if 'symptomAnalysis' in report_data and report_data.get('symptomAnalysis', {}).get('recordedAt') and hasattr(report_data['symptomAnalysis']['recordedAt'], 'isoformat'):
-            report_data['symptomAnalysis']['recordedAt'] = report_data['symptomAnalysis']['recordedAt'].isoformat()
+@app.route('/api/health-reports/detailed', methods=['POST'])
+@verify_firebase_token
+def get_detailed_health_reports():
+    try:
+        data = request.get_json()
+        report_ids = list(dict.fromkeys(data.get('reportIds') or []))
+        if not report_ids:
+            return jsonify({'error': 'Report IDs required'}), 400
+        if len(report_ids) > MAX_PAGE_SIZE:
+            return jsonify({'error': f'At most {MAX_PAGE_SIZE} report IDs per request'}), 400
 
-        return jsonify({'healthReport': report_data})
+        found = load_health_reports(report_ids)
+        if not all(is_caller(report.get('userId')) for report in found.values()):
+            return forbidden()
+        missing = [report_id for report_id in report_ids if report_id not in found]
+
+        return jsonify({'healthReports': found, 'missing': missing})
     except Exception as e:
-        return jsonify({'error': f'Error retrieving health report: {str(e)}'}), 500
+        return jsonify({'error': f'Error retrieving health reports: {str(e)}'}), 500
+
+def build_health_report(user_id, symptom_id, symptom_data, user_info, medical_info):
+    # Get the highest confidence ailment
+    highest_confidence_ailment = None
+    if symptom_data.get('prediction') and symptom_data['prediction'].get('possibleAilments'):
+        ailments = symptom_data['prediction']['possibleAilments']
+        if ailments:
+            # Sort by confidence (high > medium > low)
+            confidence_order = {'high': 3, 'medium': 2, 'low': 1}
+            highest_confidence_ailment = max(ailments, key=lambda x: confidence_order.get(x.get('confidence', 'low'), 0))
+
+    return {
+        'userId': user_id,
+        'symptomId': symptom_id,
+        'patientInfo': {
+            'name': user_info.get('name', 'Unknown'),
+            'age': user_info.get('age', 'Unknown'),
+            'gender': user_info.get('gender', 'Unknown'),
+            'email': user_info.get('email', 'Unknown')
+        },
+        'medicalInfo': {
+            'bloodType': medical_info.get('bloodType', 'Unknown'),
+            'allergies': medical_info.get('allergies', 'None'),
+            'medications': medical_info.get('medications', 'None'),
+            'conditions': medical_info.get('conditions', 'None')
+        },
+        'symptomAnalysis': {
+            'transcript': symptom_data.get('transcript', ''),
+            'symptoms': symptom_data.get('symptoms', []),
+            'recordedAt': symptom_data.get('created')
+        },
+        'aiAnalysis': symptom_data.get('prediction', {}),
+        'highestConfidenceAilment': highest_confidence_ailment,
+        'reportGeneratedAt': repository.server_timestamp(),
+        'reportId': f"HR_{user_id}_{int(time.time())}"
+    }
 
 @app.route('/api/generate-health-report', methods=['POST'])
+@verify_firebase_token
 def generate_health_report():
     try:
         data = request.get_json()
@@ -375,103 +755,76 @@ def generate_health_report():
         
         if not user_id or not symptom_id:
             return jsonify({'error': 'User ID and Symptom ID required'}), 400
+        if not is_caller(user_id):
+            return forbidden()
+
+        key = flight_key('generate-health-report', user_id, symptom_id)
+        (body, status), _ = single_flight.do(key, lambda: generate_health_report_for(user_id, symptom_id))
+        return jsonify(body), status
 
-        db = firestore.client()
-        
-        # Get the symptom record
-        try:
-            symptom_doc = db.collection('userSymptoms').document(symptom_id).get()
-            if not symptom_doc.exists:
-                return jsonify({'error': 'Symptom record not found'}), 404
-                
-            symptom_data = symptom_doc.to_dict()
-        except Exception as e:
-            return jsonify({'error': f'Error accessing symptom record: {str(e)}'}), 500
-        
-        # Get user information
-        try:
-            user_doc = db.collection('users').document(user_id).get()
-            user_info = {}
-            if user_doc.exists:
-                user_info = user_doc.to_dict()
-        except Exception as e:
-            return jsonify({'error': f'Error accessing user record: {str(e)}'}), 500
-            
-        # Get medical information
-        try:
-            medical_doc = db.collection('medicalInformation').document(user_id).get()
-            medical_info = {}
-            if medical_doc.exists:
-                medical_info = medical_doc.to_dict()
-        except Exception as e:
-            return jsonify({'error': f'Error accessing medical information: {str(e)}'}), 500
-        
-        # Get the highest confidence ailment
-        highest_confidence_ailment = None
-        if symptom_data.get('prediction') and symptom_data['prediction'].get('possibleAilments'):
-            ailments = symptom_data['prediction']['possibleAilments']
-            if ailments:
-                # Sort by confidence (high > medium > low)
-                confidence_order = {'high': 3, 'medium': 2, 'low': 1}
-                highest_confidence_ailment = max(ailments, key=lambda x: confidence_order.get(x.get('confidence', 'low'), 0))
-        
-        # Generate comprehensive health report
-        try:
-            report_data = {
-                'userId': user_id,
-                'symptomId': symptom_id,
-                'patientInfo': {
-                    'name': user_info.get('name', 'Unknown'),
-                    'age': user_info.get('age', 'Unknown'),
-                    'gender': user_info.get('gender', 'Unknown'),
-                    'email': user_info.get('email', 'Unknown')
-                },
-                'medicalInfo': {
-                    'bloodType': medical_info.get('bloodType', 'Unknown'),
-                    'allergies': medical_info.get('allergies', 'None'),
-                    'medications': medical_info.get('medications', 'None'),
-                    'conditions': medical_info.get('conditions', 'None')
-                },
-                'symptomAnalysis': {
-                    'transcript': symptom_data.get('transcript', ''),
-                    'symptoms': symptom_data.get('symptoms', []),
-                    'recordedAt': symptom_data.get('created')
-                },
-                'aiAnalysis': symptom_data.get('prediction', {}),
-                'highestConfidenceAilment': highest_confidence_ailment,
-                'reportGeneratedAt': firestore.SERVER_TIMESTAMP,
-                'reportId': f"HR_{user_id}_{int(time.time())}"
-            }
-        except Exception as e:
-            return jsonify({'error': f'Error creating report data: {str(e)}'}), 500
-        
-        # Save the health report
-        try:
-            # Use symptomId as the document ID for healthReports
-            report_ref = db.collection('healthReports').document(symptom_id)
-            existing_report = report_ref.get()
-            if existing_report.exists:
-                print(f"Health report for symptomId {symptom_id} already exists. Returning existing report.")
-                return jsonify({
-                    'message': 'Health report already exists',
-                    'reportId': symptom_id,
-                    'existing': True
-                })
-            print(f"Creating new health report for symptomId {symptom_id}")
-            report_ref.set(report_data)
-        except Exception as e:
-            return jsonify({'error': f'Error saving health report: {str(e)}'}), 500
-        
-        return jsonify({
-            'message': 'Health report generated successfully',
-            'reportId': symptom_id,
-            'existing': False
-        })
-        
     except Exception as e:
         return jsonify({'error': f'Unexpected error in generate_health_report: {str(e)}'}), 500
 
+def generate_health_report_for(user_id, symptom_id):
+    """Create the report for a symptom record; returns (response body, status code)."""
+    # Fetch the symptom record, user, medical information and any existing report together
+    try:
+        symptom_data, user_info, medical_info, existing_report, summary = repository.get_many(
+            repository.symptom_ref(symptom_id),
+            repository.user_ref(user_id),
+            repository.medical_info_ref(user_id),
+            repository.health_report_ref(symptom_id),
+            repository.summary_ref(user_id)
+        )
+    except Exception as e:
+        return {'error': f'Error accessing health records: {str(e)}'}, 500
+
+    if symptom_data is None:
+        return {'error': 'Symptom record not found'}, 404
+    if not owns_symptom(user_id, symptom_data):
+        return {'error': 'You can only access your own records'}, 403
+    if existing_report is not None:
+        return {
+            'message': 'Health report already exists',
+            'reportId': symptom_id,
+            'existing': True
+        }, 200
+    user_info = user_info or {}
+    medical_info = medical_info or {}
+    
+    # Generate comprehensive health report
+    try:
+        report_data = build_health_report(user_id, symptom_id, symptom_data, user_info, medical_info)
+    except Exception as e:
+        return {'error': f'Error creating report data: {str(e)}'}, 500
+    
+    # Save the health report
+    try:
+        # Use symptomId as the document ID for healthReports; create() fails if a
+        # request in another worker already wrote it, so only one report is ever stored
+        # and the summary is only counted once
+        batch = repository.batch()
+        summaries.stage(batch, user_id, summaries.report_created(summary, user_id, symptom_id, symptom_data))
+        created = repository.create_health_report(symptom_id, report_data, batch)
+    except Exception as e:
+        return {'error': f'Error saving health report: {str(e)}'}, 500
+    report_cache.delete(symptom_id)
+
+    if not created:
+        return {
+            'message': 'Health report already exists',
+            'reportId': symptom_id,
+            'existing': True
+        }, 200
+    
+    return {
+        'message': 'Health report generated successfully',
+        'reportId': symptom_id,
+        'existing': False
+    }, 200
+
 @app.route('/api/book-appointment', methods=['POST'])
+@verify_firebase_token
 def book_appointment():
     try:
         data = request.get_json()
@@ -479,32 +832,43 @@ def book_appointment():
         symptom_id = data.get('symptomId')
         preferred_date = data.get('preferredDate')
         preferred_time = data.get('preferredTime')
-        urgency = data.get('urgency', 'medium')
+        urgency = data.get('urgency')
         notes = data.get('notes', '')
         
         if not user_id or not symptom_id:
             return jsonify({'error': 'User ID and Symptom ID required'}), 400
+        if not is_caller(user_id):
+            return forbidden()
 
-        db = firestore.client()
-        
-        # Get user information
-        try:
-            user_doc = db.collection('users').document(user_id).get()
-            user_info = {}
-            if user_doc.exists:
-                user_info = user_doc.to_dict()
-        except Exception as e:
-            return jsonify({'error': f'Error accessing user record: {str(e)}'}), 500
-            
-        # Get symptom information
+        # Get user, symptom and summary documents in one round trip
         try:
-            symptom_doc = db.collection('userSymptoms').document(symptom_id).get()
-            if not symptom_doc.exists:
-                return jsonify({'error': 'Symptom record not found'}), 404
-                
-            symptom_data = symptom_doc.to_dict()
+            user_info, symptom_data, summary = repository.get_many(
+                repository.user_ref(user_id),
+                repository.symptom_ref(symptom_id),
+                repository.summary_ref(user_id)
+            )
         except Exception as e:
-            return jsonify({'error': f'Error accessing symptom record: {str(e)}'}), 500
+            return jsonify({'error': f'Error accessing user or symptom record: {str(e)}'}), 500
+
+        if symptom_data is None:
+            return jsonify({'error': 'Symptom record not found'}), 404
+        if not owns_symptom(user_id, symptom_data):
+            return forbidden()
+        user_info = user_info or {}
+        urgency = urgency or (symptom_data.get('prediction') or {}).get('urgency') or 'medium'
+
+        # A clinician slot (from /api/appointments/availability) is confirmed on booking;
+        # without one the appointment is a pending request for the preferred date and time
+        slot = None
+        if data.get('clinicianId') or data.get('slotStart'):
+            try:
+                slot = slot_engine.prepare(data.get('clinicianId'), data.get('slotStart'),
+                                           summaries.upcoming_appointments(summary))
+            except SlotUnavailable as e:
+                return jsonify({'error': str(e)}), 409
+            except SlotError as e:
+                return jsonify({'error': str(e)}), 400
+            preferred_date, preferred_time = slot['date'], slot['slotStart'][11:]
         
         # Create appointment record
         try:
@@ -523,43 +887,107 @@ def book_appointment():
                 'urgency': urgency,
                 'notes': notes,
                 'status': 'pending',
-                'createdAt': firestore.SERVER_TIMESTAMP,
+                'createdAt': repository.server_timestamp(),
                 'appointmentId': f"APT_{user_id}_{int(time.time())}"
             }
+            if slot:
+                appointment_data.update({
+                    'clinicianId': slot['clinicianId'],
+                    'clinicianName': slot['clinicianName'],
+                    'slotStart': slot['slotStart'],
+                    'slotEnd': slot['slotEnd'],
+                    'status': 'confirmed'
+                })
         except Exception as e:
             return jsonify({'error': f'Error creating appointment data: {str(e)}'}), 500
         
-        # Save the appointment
+        # Save the appointment together with the summary update
         try:
-            appointment_ref = db.collection('appointments').add(appointment_data)
+            appointment_ref = repository.appointment_ref()
+            appointment_id = appointment_ref.id
+            batch = repository.batch()
+            batch.set(appointment_ref, appointment_data)
+            summaries.stage(batch, user_id,
+                            summaries.appointment_booked(summary, user_id, appointment_id, appointment_data))
+            if slot:
+                # Creating the slot document fails if it is taken, and the whole batch with it
+                booked = repository.create_slot_booking(slot['key'], {
+                    'clinicianId': slot['clinicianId'],
+                    'date': slot['date'],
+                    'minute': slot['minute'],
+                    'appointmentId': appointment_id,
+                    'userId': user_id,
+                    'createdAt': repository.server_timestamp()
+                }, batch)
+                slot_engine.mark_booked(slot['clinicianId'], slot['date'], slot['minute'], conflict=not booked)
+                if not booked:
+                    return jsonify({'error': 'That slot has just been booked; please choose another'}), 409
+            else:
+                repository.commit(batch)
         except Exception as e:
             return jsonify({'error': f'Error saving appointment: {str(e)}'}), 500
         
         return jsonify({
             'message': 'Appointment booked successfully',
-            'appointmentId': appointment_ref[1].id,
-            'appointmentData': appointment_data
+            'appointmentId': appointment_id
         })
         
     except Exception as e:
         return jsonify({'error': f'Unexpected error in book_appointment: {str(e)}'}), 500
 
+@app.route('/api/appointments/availability', methods=['GET'])
+@verify_firebase_token
+def get_availability():
+    try:
+        try:
+            limit = int(request.args.get('limit', '10'))
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+        if not 1 <= limit <= MAX_PAGE_SIZE:
+            return jsonify({'error': f'limit must be between 1 and {MAX_PAGE_SIZE}'}), 400
+
+        # Urgency comes from the symptom record's AI analysis unless given explicitly
+        urgency = request.args.get('urgency')
+        symptom_id = request.args.get('symptomId')
+        if symptom_id and not urgency:
+            symptom_data = repository.get_symptom(symptom_id)
+            if symptom_data is None:
+                return jsonify({'error': 'Symptom record not found'}), 404
+            if not owns_symptom(request.user.get('uid'), symptom_data):
+                return forbidden()
+            urgency = (symptom_data.get('prediction') or {}).get('urgency')
+        if urgency not in URGENCY_WINDOWS:
+            urgency = 'medium'
+
+        with span('slots.search'):
+            slots = slot_engine.search(urgency, limit, request.args.get('specialty'))
+        return jsonify({'urgency': urgency, 'timezone': slot_engine.timezone, 'slots': slots})
+    except Exception as e:
+        return jsonify({'error': f'Error searching availability: {str(e)}'}), 500
+
 @app.route('/api/appointments/<user_id>', methods=['GET'])
+@verify_firebase_token
 def get_user_appointments(user_id):
     try:
         if not user_id:
             return jsonify({'error': 'User ID required'}), 400
+        if not is_caller(user_id):
+            return forbidden()
 
-        db = firestore.client()
-        
-        # Get user's appointments
-        appointments_query = db.collection('appointments').where('userId', '==', user_id).order_by('createdAt', direction=firestore.Query.DESCENDING)
-        appointments_docs = appointments_query.stream()
+        try:
+            page_size, page_token, fields = parse_page_args(50, APPOINTMENT_FIELDS)
+            # Get user's appointments
+            appointments_docs, next_page_token = repository.fetch_page(
+                repository.appointments_query(user_id), repository.APPOINTMENTS,
+                page_size, page_token, fields
+            )
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
         appointments = []
         for doc in appointments_docs:
             data = doc.to_dict()
-            appointments.append({
+            appointments.append(project({
                 'id': doc.id,
                 'appointmentId': data.get('appointmentId'),
                 'patientInfo': data.get('patientInfo', {}),
@@ -567,16 +995,245 @@ def get_user_appointments(user_id):
                 'aiAnalysis': data.get('aiAnalysis', {}),
                 'preferredDate': data.get('preferredDate'),
                 'preferredTime': data.get('preferredTime'),
+                'clinicianId': data.get('clinicianId'),
+                'clinicianName': data.get('clinicianName'),
+                'slotStart': data.get('slotStart'),
+                'slotEnd': data.get('slotEnd'),
                 'urgency': data.get('urgency'),
                 'notes': data.get('notes'),
                 'status': data.get('status'),
                 'createdAt': data.get('createdAt')
-            })
+            }, fields))
 
-        return jsonify({'appointments': appointments})
+        return jsonify({'appointments': appointments, 'nextPageToken': next_page_token})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/users/<user_id>/summary', methods=['GET'])
+@verify_firebase_token
+def get_user_summary(user_id):
+    if not is_caller(user_id):
+        return forbidden()
+    try:
+        summary = repository.get_summary(user_id)
+        if summary is None:
+            # Users whose history predates the summary document get it built on first read
+            summaries.rebuild(user_id)
+            summary = repository.get_summary(user_id)
+        return jsonify({'summary': summaries.serialize(summary)})
+    except Exception as e:
+        logger.exception("Error loading summary for user %s", user_id)
+        return jsonify({'error': f'Error loading user summary: {str(e)}'}), 500
+
+def run_voice_pipeline(user_id, audio_chunks=None, transcript='', audio_url=''):
+    profile_future = _pipeline_pool.submit(
+        repository.get_many, repository.user_ref(user_id), repository.medical_info_ref(user_id),
+        repository.summary_ref(user_id))
+
+    if not transcript:
+        transcript = transcribe_chunks(audio_chunks)
+    symptoms = extract_symptoms(transcript) if transcript else []
+    user_info, medical_info, summary = profile_future.result()
+    user_info, medical_info = user_info or {}, medical_info or {}
+
+    symptom_ref = repository.symptom_ref()
+    symptom_data = {
+        'userId': user_id,
+        'transcript': transcript,
+        **symptom_fields(symptoms),
+        'audioUrl': audio_url,
+        'created': repository.server_timestamp(),
+        'status': 'symptoms_identified'
+    }
+
+    # Symptom record and health report are written together in one batch
+    batch = repository.batch()
+    prediction = {}
+    report_id = None
+    if symptoms:
+        prediction = predict_from_profile(symptoms, user_info)
+        symptom_data.update({
+            'prediction': prediction,
+            'predictionVersion': prediction_version(prediction),
+            'status': 'ailment_predicted',
+            'predictedAt': repository.server_timestamp()
+        })
+        report_id = symptom_ref.id
+        report_data = build_health_report(user_id, report_id, symptom_data, user_info, medical_info)
+        batch.create(repository.health_report_ref(report_id), report_data)
+    batch.set(symptom_ref, symptom_data)
+    summaries.stage(batch, user_id, summaries.symptom_recorded(summary, user_id, symptom_ref.id, symptom_data,
+                                                               has_report=bool(report_id)))
+    repository.commit(batch)
+    if report_id:
+        report_cache.delete(report_id)
+
+    return {
+        'transcript': transcript,
+        'symptoms': symptoms,
+        'symptomId': symptom_ref.id,
+        'prediction': prediction,
+        'reportId': report_id
+    }
+
+@app.route('/api/voice-consultation', methods=['POST'])
+@verify_firebase_token
+def voice_consultation():
+    try:
+        data = request.get_json()
+        user_id = data.get('userId')
+        if not user_id:
+            return jsonify({'error': 'User ID required'}), 400
+        if not is_caller(user_id):
+            return forbidden()
+        if not data.get('audio_chunks') and not data.get('transcript'):
+            return jsonify({'error': 'No audio data or transcript provided'}), 400
+
+        return jsonify(run_voice_pipeline(
+            user_id,
+            audio_chunks=data.get('audio_chunks'),
+            transcript=data.get('transcript', ''),
+            audio_url=data.get('audioUrl', '')
+        ))
+    except AudioTooSlow as e:
+        return jsonify({'error': str(e)}), 422
+    except ProviderUnavailable as e:
+        return provider_unavailable(e)
+    except Exception as e:
+        return jsonify({'error': f'Unexpected error in voice_consultation: {str(e)}'}), 500
+
+job_queue.register_stage('transcribe', transcribe_chunks, concurrency=int(os.getenv('JOB_TRANSCRIBE_CONCURRENCY', '2')))
+job_queue.register_stage('analyze-symptoms', extract_symptoms, concurrency=int(os.getenv('JOB_ANALYZE_CONCURRENCY', '4')))
+job_queue.register_stage('predict-ailment', predict_ailment_for, concurrency=int(os.getenv('JOB_PREDICT_CONCURRENCY', '4')))
+
+def enqueue_job(stage, *args):
+    try:
+        job_id = job_queue.submit(stage, *args, owner=request.user['uid'])
+    except QueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    return jsonify({'jobId': job_id, 'status': 'queued'}), 202
+
+def owns_job(job):
+    # Another user's job answers exactly like a missing one
+    return job is not None and job.get('ownerId') == request.user['uid']
+
+@app.route('/api/jobs/transcribe', methods=['POST'])
+@verify_firebase_token
+def enqueue_transcription():
+    data = request.json
+    if not data or 'audio_chunks' not in data or not data['audio_chunks']:
+        return jsonify({'error': 'No audio data provided'}), 400
+    return enqueue_job('transcribe', data['audio_chunks'])
+
+@app.route('/api/jobs/analyze-symptoms', methods=['POST'])
+@verify_firebase_token
+def enqueue_symptom_analysis():
+    data = request.get_json()
+    transcript = data.get('transcript', '')
+    if not transcript:
+        return jsonify({'error': 'No transcript provided'}), 400
+    return enqueue_job('analyze-symptoms', transcript)
+
+@app.route('/api/jobs/predict-ailment', methods=['POST'])
+@verify_firebase_token
+def enqueue_ailment_prediction():
+    data = request.get_json()
+    user_id = data.get('userId')
+    symptoms = data.get('symptoms', [])
+    if not user_id or not symptoms:
+        return jsonify({'error': 'User ID and symptoms required'}), 400
+    if not is_symptom_list(symptoms):
+        return jsonify({'error': SYMPTOM_LIST_ERROR}), 400
+    if not is_caller(user_id):
+        return forbidden()
+    symptom_id = data.get('symptomId')
+    if symptom_id and not owns_symptom(user_id, repository.get_symptom(symptom_id)):
+        return forbidden()
+    return enqueue_job('predict-ailment', user_id, symptoms, symptom_id)
+
+@app.route('/api/jobs/metrics', methods=['GET'])
+@internal_only
+def get_job_metrics():
+    return jsonify(job_queue.metrics())
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+@verify_firebase_token
+def get_job(job_id):
+    # ?wait=<seconds> long-polls until the job finishes or the wait expires
+    try:
+        wait = min(max(float(request.args.get('wait', 0)), 0.0), 30.0)
+    except ValueError:
+        return jsonify({'error': 'wait must be a number of seconds'}), 400
+    job = job_queue.get(job_id)
+    if not owns_job(job):
+        return jsonify({'error': 'Job not found'}), 404
+    if wait > 0 and job['status'] not in FINISHED_STATES:
+        job = job_queue.wait(job_id, timeout=wait) or job
+    return jsonify(job)
+
+@app.route('/api/jobs/<job_id>/events', methods=['GET'])
+@verify_firebase_token
+def stream_job_events(job_id):
+    if not owns_job(job_queue.get(job_id)):
+        return jsonify({'error': 'Job not found'}), 404
+
+    def events():
+        last_status = None
+        while True:
+            job = job_queue.wait(job_id, timeout=15.0)
+            if job is None:
+                yield sse_event('error', {'error': 'Job not found'})
+                return
+            if job['status'] != last_status:
+                last_status = job['status']
+                yield sse_event('status', job)
+            else:
+                yield ': keep-alive\n\n'
+            if job['status'] in FINISHED_STATES:
+                return
+
+    return Response(stream_with_context(events()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+def _service_gauges():
+    cache = response_cache.stats()
+    queue = job_queue.metrics()
+    extraction = extraction_stats.stats()
+    flights = single_flight.stats()
+    audio = preprocess_stats.stats()
+    reports = report_cache.stats()
+    http = http_stats.stats()
+    slots = slot_engine.stats()
+    keys = key_refresh_stats.stats()
+    return {
+        'mediassist_llm_cache_hits_total': cache['hits'] + cache['diskHits'],
+        'mediassist_llm_cache_misses_total': cache['misses'],
+        'mediassist_llm_cache_evictions_total': cache['evictions'],
+        'mediassist_job_queue_depth': queue['queueDepth'],
+        'mediassist_job_queue_running': queue['running'],
+        'mediassist_symptoms_local_total': extraction['servedLocally'],
+        'mediassist_symptoms_llm_total': extraction['escalatedToLlm'],
+        'mediassist_singleflight_executed_total': flights['executed'],
+        'mediassist_singleflight_shared_total': flights['shared'] + flights['sharedAcrossWorkers'],
+        'mediassist_audio_preprocess_files_total': audio['files'],
+        'mediassist_audio_preprocess_bytes_saved_total': audio['bytesSaved'],
+        'mediassist_audio_preprocess_seconds_total': audio['seconds'],
+        'mediassist_report_cache_hits_total': reports['hits'] + reports['diskHits'],
+        'mediassist_report_cache_misses_total': reports['misses'],
+        'mediassist_http_not_modified_total': http['notModified'],
+        'mediassist_http_compression_bytes_saved_total': http['bytesSaved'],
+        'mediassist_slot_searches_total': slots['searches'],
+        'mediassist_slot_bookings_total': slots['bookings'],
+        'mediassist_slot_conflicts_total': slots['conflicts'],
+        'mediassist_slot_index_free_slots': slots['freeSlotsIndexed'],
+        'mediassist_auth_key_refresh_total': keys['refreshed'],
+        'mediassist_auth_key_refresh_failures_total': keys['failed'],
+        'mediassist_auth_key_refresh_supported': int(keys['supported']),
+    }
+
+metrics.register_gauges(_service_gauges)
+metrics.register_gauges(resilience.gauges)
+
 # For Vercel deployment
 app.debug = False
 
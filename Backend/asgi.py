@@ -0,0 +1,227 @@
+"""ASGI entry point for the backend.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 5000
+    gunicorn -k uvicorn.workers.UvicornWorker asgi:application
+
+Serves the same Flask app through asgiref's WsgiToAsgi, so every route keeps
+its contract. The event loop owns the sockets, so slow clients, keep-alive
+connections and request bodies cost no thread. Each chunk of a response is
+sent with asgiref's blocking send, so a streamed (SSE) response waits for a
+slow client instead of buffering. Request bodies are spooled by asgiref and
+refused with 413 past ASGI_MAX_BODY_BYTES before Flask sees them.
+
+Limitation: the views are synchronous and the provider SDKs (AssemblyAI,
+Gemini, Firestore, Firebase Auth) are blocking, so a request still holds one
+pool thread while it waits on them; ASGI_THREADS caps how many do at once.
+What this mode removes is the process per concurrent request of sync
+gunicorn: a few hundred threads in one process cost far less memory than the
+same number of workers. Releasing the thread during provider I/O would need
+async views and async provider clients.
+
+Measured with loadtest.py on one 1-vCPU instance (load generator on the same
+host), fake providers with 500 ms of transcription latency
+(FAKE_TRANSCRIBE_LATENCY_MS=500, ASSEMBLYAI_MAX_CONCURRENCY=512),
+POST /api/transcribe, 200 concurrent clients, 1000 requests:
+
+    setup                                        rps     p50      p99    RSS
+    gunicorn -w 4 app:app (sync)                 7.8   25.4 s   25.6 s   261 MB
+    gunicorn -w 4 -k gthread --threads 64      182.8   0.66 s   2.75 s   298 MB
+    uvicorn asgi:application (1 process)       236.4   0.67 s   1.19 s   126 MB
+
+    MEDIASSIST_PROVIDERS=fake python asgi.py --check   # SSE and body-limit checks through the bridge
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import SyncToAsync
+from asgiref.wsgi import WsgiToAsgiInstance
+
+from app import app as flask_app
+from transcription import MAX_UPLOAD_BYTES
+
+ASGI_THREADS = int(os.getenv('ASGI_THREADS', '256'))
+# The largest legitimate body is a recording sent base64-encoded inside JSON
+MAX_BODY_BYTES = int(os.getenv('ASGI_MAX_BODY_BYTES', str(MAX_UPLOAD_BYTES * 4 // 3 + 1024 * 1024)))
+
+
+class BodyTooLarge(Exception):
+    pass
+
+
+class _FlaskInstance(WsgiToAsgiInstance):
+    """asgiref's per-request bridge, run on our pool and closing the response iterable.
+
+    asgiref 3.7 runs every request on one thread-sensitive thread and never
+    calls close(), which is where Flask pops its contexts and runs teardown hooks.
+    """
+
+    def __init__(self, wsgi_application, executor):
+        super().__init__(wsgi_application)
+        self.executor = executor
+
+    def build_environ(self, scope, body):
+        environ = super().build_environ(scope, body)
+        # The body is fully spooled, so its length is known even for a chunked upload
+        body.seek(0, os.SEEK_END)
+        environ['CONTENT_LENGTH'] = str(body.tell())
+        body.seek(0)
+        environ['wsgi.errors'] = sys.stderr
+        return environ
+
+    async def run_wsgi_app(self, body):
+        await SyncToAsync(self._run_wsgi_app, thread_sensitive=False, executor=self.executor)(body)
+
+    def _run_wsgi_app(self, body):
+        environ = self.build_environ(self.scope, body)
+        iterable = self.wsgi_application(environ, self.start_response)
+        try:
+            for output in iterable:
+                if not self.response_started:
+                    self.response_started = True
+                    self.sync_send(self.response_start)
+                if output:
+                    self.sync_send({'type': 'http.response.body', 'body': output, 'more_body': True})
+        finally:
+            if hasattr(iterable, 'close'):
+                iterable.close()
+        if not self.response_started:
+            self.response_started = True
+            self.sync_send(self.response_start)
+        self.sync_send({'type': 'http.response.body'})
+
+
+class FlaskASGI:
+    def __init__(self, wsgi_app, max_threads, max_body_bytes=MAX_BODY_BYTES):
+        self.wsgi_app = wsgi_app
+        self.max_body_bytes = max_body_bytes
+        self.executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix='asgi-view')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        declared = dict(scope.get('headers', [])).get(b'content-length')
+        if declared is not None and declared.isdigit() and int(declared) > self.max_body_bytes:
+            await self._send_too_large(send)
+            return
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            received += len(message.get('body', b''))
+            if received > self.max_body_bytes:
+                raise BodyTooLarge()
+            return message
+
+        try:
+            await _FlaskInstance(self.wsgi_app, self.executor)(scope, limited_receive, send)
+        except BodyTooLarge:
+            await self._send_too_large(send)
+
+    async def _send_too_large(self, send):
+        payload = f'{{"error": "Request body exceeds {self.max_body_bytes} bytes"}}'.encode('ascii')
+        await send({'type': 'http.response.start', 'status': 413,
+                    'headers': [(b'content-type', b'application/json'),
+                                (b'content-length', str(len(payload)).encode('ascii'))]})
+        await send({'type': 'http.response.body', 'body': payload, 'more_body': False})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+
+application = FlaskASGI(flask_app, ASGI_THREADS)
+
+
+async def call(app, method, path, body=b'', headers=(), chunk_bytes=64 * 1024):
+    """Drive one request through an ASGI app in-process and return (status, body)."""
+    parts = [body[i:i + chunk_bytes] for i in range(0, len(body), chunk_bytes)] or [b'']
+    finished = asyncio.Event()
+    result = {'status': None, 'body': []}
+
+    async def receive():
+        if parts:
+            chunk = parts.pop(0)
+            return {'type': 'http.request', 'body': chunk, 'more_body': bool(parts)}
+        await finished.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            result['status'] = message['status']
+            return
+        result['body'].append(message.get('body', b''))
+        if not message.get('more_body'):
+            finished.set()
+
+    path, _, query = path.partition('?')
+    scope = {'type': 'http', 'method': method, 'path': path, 'query_string': query.encode('latin-1'),
+             'root_path': '', 'http_version': '1.1', 'scheme': 'http',
+             'headers': [(k.lower().encode('latin-1'), str(v).encode('latin-1')) for k, v in headers]}
+    await app(scope, receive, send)
+    return result['status'], b''.join(result['body'])
+
+
+async def _check(concurrency):
+    import fakes
+    import repository
+    if not fakes.ENABLED:
+        raise SystemExit('asgi.py --check must run with MEDIASSIST_PROVIDERS=fake')
+    user_id = 'asgi-check-user'
+    repository.user_ref(user_id).set({'name': 'ASGI Check', 'allergies': 'penicillin'})
+    headers = [('Content-Type', 'application/json'), ('Authorization', f'Bearer {fakes.FAKE_TOKEN_PREFIX}{user_id}')]
+    body = json.dumps({'userId': user_id, 'symptoms': ['fever', 'cough', 'headache']}).encode('utf-8')
+    failures = []
+
+    responses = await asyncio.gather(*[call(application, 'POST', '/api/predict-ailment/stream', body, headers)
+                                       for _ in range(concurrency)])
+    complete = sum(1 for status, text in responses if status == 200 and b'event: prediction' in text)
+    if complete != concurrency:
+        failures.append(f'{concurrency - complete}/{concurrency} concurrent SSE streams did not complete')
+    for _ in range(3):
+        status, text = await call(application, 'POST', '/api/predict-ailment/stream', body, headers)
+        if status != 200 or b'event: prediction' not in text:
+            failures.append('sequential SSE stream did not complete')
+
+    oversized = b'x' * (application.max_body_bytes + 1)
+    status, _ = await call(application, 'POST', '/api/transcribe/upload', oversized,
+                           headers + [('Content-Length', len(oversized))])
+    if status != 413:
+        failures.append(f'declared oversized body got {status}, not 413')
+    status, _ = await call(application, 'POST', '/api/transcribe/upload', oversized, headers)
+    if status != 413:
+        failures.append(f'undeclared oversized body got {status}, not 413')
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--check', action='store_true', help='run the bridge checks against the fake providers')
+    parser.add_argument('--concurrency', type=int, default=20)
+    args = parser.parse_args()
+    if not args.check:
+        parser.print_help()
+        return
+    failures = asyncio.run(_check(args.concurrency))
+    for failure in failures:
+        print(f'FAIL {failure}')
+    print('bridge checks passed' if not failures else f'{len(failures)} bridge checks failed')
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
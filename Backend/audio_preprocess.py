@@ -0,0 +1,257 @@
+"""Shrinks recordings before they are uploaded for transcription.
+
+The container is sniffed from the file's magic bytes so the upload carries the
+right extension. WAV is decoded with the standard library; other containers
+(the browser's webm/ogg opus) are decoded by ffmpeg when it is on PATH. The
+samples are downmixed to mono, resampled to TARGET_SAMPLE_RATE (low-pass
+filtered first when downsampling, so content above the new Nyquist frequency
+does not alias) and leading and trailing silence is trimmed with an energy
+threshold over fixed-size frames. The result is re-encoded (opus through
+ffmpeg, otherwise 16-bit PCM WAV) and only used when it is smaller than the
+original. An ffmpeg run longer than AUDIO_FFMPEG_TIMEOUT_SECONDS is killed and
+the upload fails with PreprocessTimeout.
+"""
+import os
+import shutil
+import subprocess
+import threading
+import time
+import wave
+
+from metrics import span
+
+np = None  # numpy is imported by the first upload, keeping it out of cold starts
+
+PREPROCESS_ENABLED = os.getenv('AUDIO_PREPROCESS', '1') != '0'
+TARGET_SAMPLE_RATE = int(os.getenv('AUDIO_TARGET_SAMPLE_RATE', '16000'))
+OPUS_BITRATE = os.getenv('AUDIO_OPUS_BITRATE', '24k')
+FRAME_MS = 30
+SILENCE_FLOOR_DBFS = float(os.getenv('AUDIO_SILENCE_FLOOR_DBFS', '-50'))
+SILENCE_BELOW_PEAK_DB = float(os.getenv('AUDIO_SILENCE_BELOW_PEAK_DB', '35'))
+PAD_MS = 200
+FFMPEG_TIMEOUT_SECONDS = float(os.getenv('AUDIO_FFMPEG_TIMEOUT_SECONDS', '30'))
+# Passband edge of the anti-aliasing filter, as a fraction of the target rate's Nyquist frequency
+LOWPASS_PASSBAND = 0.8
+
+FFMPEG = shutil.which('ffmpeg')
+
+_SIGNATURES = (
+    (0, b'RIFF', '.wav'),
+    (0, b'\x1aE\xdf\xa3', '.webm'),
+    (0, b'OggS', '.ogg'),
+    (0, b'fLaC', '.flac'),
+    (0, b'ID3', '.mp3'),
+    (4, b'ftyp', '.m4a'),
+)
+
+
+class PreprocessTimeout(Exception):
+    pass
+
+
+def _load_numpy():
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:  # preprocessing is skipped without numpy
+            return False
+        np = numpy
+    return True
+
+
+def sniff_suffix(path):
+    with open(path, 'rb') as f:
+        head = f.read(12)
+    for offset, magic, suffix in _SIGNATURES:
+        if head[offset:offset + len(magic)] == magic:
+            if suffix == '.wav' and head[8:12] != b'WAVE':
+                continue
+            return suffix
+    if head[:2] in (b'\xff\xfb', b'\xff\xf3', b'\xff\xf2'):
+        return '.mp3'
+    return ''
+
+
+def relabel(path, suffix):
+    """Rename ``path`` so its extension matches ``suffix``; returns the new path."""
+    root, current = os.path.splitext(path)
+    if current == suffix:
+        return path
+    new_path = root + suffix
+    os.replace(path, new_path)
+    return new_path
+
+
+def _read_wav(path):
+    with wave.open(path, 'rb') as wav:
+        channels = wav.getnchannels()
+        width = wav.getsampwidth()
+        rate = wav.getframerate()
+        raw = wav.readframes(wav.getnframes())
+    if width == 1:
+        samples = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128.0) / 128.0
+    elif width == 2:
+        samples = np.frombuffer(raw, dtype='<i2').astype(np.float32) / 32768.0
+    elif width == 4:
+        samples = np.frombuffer(raw, dtype='<i4').astype(np.float32) / 2147483648.0
+    else:
+        raise ValueError(f'unsupported sample width {width}')
+    samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels)
+    return samples.mean(axis=1), rate
+
+
+def _decode_with_ffmpeg(path):
+    # ffmpeg downmixes and resamples while decoding
+    result = subprocess.run(
+        [FFMPEG, '-v', 'error', '-i', path, '-f', 's16le', '-ac', '1', '-ar', str(TARGET_SAMPLE_RATE), '-'],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True, timeout=FFMPEG_TIMEOUT_SECONDS)
+    return np.frombuffer(result.stdout, dtype='<i2').astype(np.float32) / 32768.0, TARGET_SAMPLE_RATE
+
+
+def lowpass(samples, rate, target_rate):
+    """Windowed-sinc FIR low-pass that removes what ``target_rate`` cannot represent."""
+    ratio = rate / target_rate
+    # The Blackman window's transition band is about 5.5 / taps of the input rate,
+    # so scaling the length with the ratio keeps it clear of the target Nyquist
+    taps = 2 * int(np.ceil(16 * ratio)) + 1
+    cutoff = 0.5 * LOWPASS_PASSBAND / ratio
+    n = np.arange(taps) - (taps - 1) / 2
+    kernel = 2 * cutoff * np.sinc(2 * cutoff * n) * np.blackman(taps)
+    kernel /= kernel.sum()
+    return np.convolve(samples, kernel.astype(np.float32), mode='same')
+
+
+def resample(samples, rate, target_rate):
+    if rate == target_rate or len(samples) == 0:
+        return samples
+    if rate > target_rate:
+        samples = lowpass(samples, rate, target_rate)
+    duration = len(samples) / rate
+    target_positions = np.arange(int(duration * target_rate)) / target_rate
+    return np.interp(target_positions, np.arange(len(samples)) / rate, samples).astype(np.float32)
+
+
+def trim_silence(samples, rate):
+    """Drop leading and trailing frames whose RMS energy is below the speech threshold."""
+    frame = max(1, rate * FRAME_MS // 1000)
+    frame_count = len(samples) // frame
+    if frame_count == 0:
+        return samples
+    frames = samples[:frame_count * frame].reshape(frame_count, frame)
+    rms = np.sqrt(np.mean(frames * frames, axis=1))
+    dbfs = 20.0 * np.log10(np.maximum(rms, 1e-10))
+    threshold = max(SILENCE_FLOOR_DBFS, dbfs.max() - SILENCE_BELOW_PEAK_DB)
+    voiced = np.flatnonzero(dbfs >= threshold)
+    if len(voiced) == 0:
+        return samples[:0]
+    pad = PAD_MS // FRAME_MS
+    start = max(0, voiced[0] - pad) * frame
+    end = min(len(samples), (voiced[-1] + 1 + pad) * frame)
+    return samples[start:end]
+
+
+def _encode(samples, rate, base_path):
+    pcm = (np.clip(samples, -1.0, 1.0) * 32767.0).astype('<i2').tobytes()
+    out_path = base_path + ('.prep.ogg' if FFMPEG else '.prep.wav')
+    try:
+        if FFMPEG:
+            subprocess.run(
+                [FFMPEG, '-v', 'error', '-y', '-f', 's16le', '-ar', str(rate), '-ac', '1', '-i', '-',
+                 '-c:a', 'libopus', '-b:a', OPUS_BITRATE, '-application', 'voip', out_path],
+                input=pcm, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True,
+                timeout=FFMPEG_TIMEOUT_SECONDS)
+        else:
+            with wave.open(out_path, 'wb') as wav:
+                wav.setnchannels(1)
+                wav.setsampwidth(2)
+                wav.setframerate(rate)
+                wav.writeframes(pcm)
+    except BaseException:
+        _remove(out_path)
+        raise
+    return out_path
+
+
+def _remove(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+class PreprocessStats:
+    def __init__(self):
+        self.files = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, bytes_in, bytes_out, seconds):
+        with self._lock:
+            self.files += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+            self.seconds += seconds
+
+    def stats(self):
+        with self._lock:
+            return {
+                'files': self.files,
+                'bytesIn': self.bytes_in,
+                'bytesOut': self.bytes_out,
+                'bytesSaved': self.bytes_in - self.bytes_out,
+                'seconds': round(self.seconds, 3),
+            }
+
+
+preprocess_stats = PreprocessStats()
+
+
+def prepare_for_upload(path):
+    """Return (path, upload_path) for a spooled recording.
+
+    ``path`` is the original file renamed to its sniffed extension and
+    ``upload_path`` the preprocessed copy, or the same path when no smaller
+    encoding was produced. The caller deletes both. If preprocessing raises,
+    the recording and any partial copy are deleted before the error propagates;
+    an ffmpeg timeout is raised as PreprocessTimeout.
+    """
+    started = time.perf_counter()
+    upload_path = path
+    try:
+        with span('audio.preprocess'):
+            path = relabel(path, sniff_suffix(path))
+            original_size = os.path.getsize(path)
+            upload_path = path
+            if PREPROCESS_ENABLED and _load_numpy():
+                try:
+                    if path.endswith('.wav'):
+                        samples, rate = _read_wav(path)
+                    elif FFMPEG:
+                        samples, rate = _decode_with_ffmpeg(path)
+                    else:
+                        samples = None
+                    if samples is not None and len(samples):
+                        samples = trim_silence(resample(samples, rate, TARGET_SAMPLE_RATE), TARGET_SAMPLE_RATE)
+                        if len(samples):
+                            upload_path = _encode(samples, TARGET_SAMPLE_RATE, os.path.splitext(path)[0])
+                            if os.path.getsize(upload_path) >= original_size:
+                                os.unlink(upload_path)
+                                upload_path = path
+                except (ValueError, EOFError, OSError, wave.Error, subprocess.CalledProcessError):
+                    # Undecodable input, or an ffmpeg that cannot run, is uploaded as-is
+                    if upload_path != path:
+                        _remove(upload_path)
+                    upload_path = path
+                except subprocess.TimeoutExpired as e:
+                    raise PreprocessTimeout(f'Audio processing did not finish within {e.timeout:g} seconds') from e
+        upload_size = os.path.getsize(upload_path)
+    except BaseException:
+        _remove(path)
+        if upload_path != path:
+            _remove(upload_path)
+        raise
+    preprocess_stats.record(original_size, upload_size, time.perf_counter() - started)
+    return path, upload_path
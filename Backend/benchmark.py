@@ -0,0 +1,391 @@
+"""Offline benchmark for every API route, run against the fake providers.
+
+    python benchmark.py --concurrency 16 --requests 400
+    FAKE_LLM_LATENCY_MS=800 FAKE_TRANSCRIBE_LATENCY_MS=1500 python benchmark.py --routes predict-ailment
+    python benchmark.py --json > bench.json   # machine-readable, e.g. for CI
+    python benchmark.py --asgi --routes predict-ailment-stream job-events
+
+Requests go through the Flask test client, or with --asgi through the ASGI
+bridge in asgi.py, so no server or network is needed either way. Streamed
+responses are read to the end, so SSE routes are timed until their last
+event. Each route reports throughput and p50/p95/p99 latency under the
+requested concurrency, then a single-threaded tracemalloc pass reports the
+bytes allocated per request. Jobs a route leaves queued are drained before
+the next route starts.
+"""
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+os.environ.setdefault('MEDIASSIST_PROVIDERS', 'fake')
+
+import app as backend  # noqa: E402
+import fakes  # noqa: E402
+import repository  # noqa: E402
+from jobs import job_queue  # noqa: E402
+from llm_cache import response_cache  # noqa: E402
+from loadtest import percentile  # noqa: E402
+
+TRANSCRIPTS = (
+    "I have had a fever and a cough since Monday.",
+    "Bad headache and some nausea after lunch, feeling dizzy too.",
+    "Sore throat, fatigue and I think I lost my sense of smell.",
+    "Sharp chest pain and shortness of breath when climbing stairs.",
+)
+AUDIO_BYTES = b'\x1aE\xdf\xa3' + b'\x00' * 32 * 1024
+AUDIO_CHUNK = 'data:audio/webm;base64,' + base64.b64encode(AUDIO_BYTES).decode('ascii')
+
+
+class Fixture:
+    """Seeds the fake Firestore and hands out per-request inputs."""
+
+    def __init__(self, users=50, symptoms_per_user=20):
+        if not fakes.ENABLED:
+            raise SystemExit('benchmark.py must run with MEDIASSIST_PROVIDERS=fake')
+        fakes.firestore_client.reset()
+        self.user_ids = [f'bench-user-{i}' for i in range(users)]
+        self.symptom_ids = []
+        for user_id in self.user_ids:
+            repository.user_ref(user_id).set({
+                'name': 'Bench User', 'email': f'{user_id}@example.com', 'age': 40,
+                'allergies': 'penicillin', 'medications': 'none', 'conditions': 'asthma'
+            })
+            repository.medical_info_ref(user_id).set({'bloodType': 'O+', 'allergies': 'penicillin'})
+            for i in range(symptoms_per_user):
+                symptom_id = repository.add_symptom({
+                    'userId': user_id, 'transcript': TRANSCRIPTS[i % len(TRANSCRIPTS)],
+                    'symptoms': ['fever', 'cough'], 'created': repository.server_timestamp(),
+                    'status': 'ailment_predicted',
+                    'prediction': json.loads(fakes.FakeGenerativeModel._prediction_answer(['fever']).split('\n', 1)[1])
+                })
+                self.symptom_ids.append((user_id, symptom_id))
+                repository.add_appointment({'userId': user_id, 'symptomId': symptom_id, 'status': 'pending',
+                                            'createdAt': repository.server_timestamp()})
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def next_index(self):
+        with self._lock:
+            return next(self._counter)
+
+    def user(self, i):
+        return self.user_ids[i % len(self.user_ids)]
+
+    def symptom(self, i):
+        return self.symptom_ids[i % len(self.symptom_ids)]
+
+    def fresh_symptom(self, i):
+        # generate-health-report only does real work for a symptom without a report
+        user_id = self.user(i)
+        symptom_id = repository.add_symptom({
+            'userId': user_id, 'transcript': TRANSCRIPTS[0], 'symptoms': ['fever'],
+            'created': repository.server_timestamp(), 'status': 'ailment_predicted', 'prediction': {}
+        })
+        return user_id, symptom_id
+
+
+def _auth(user_id):
+    return {'Authorization': f'Bearer {fakes.FAKE_TOKEN_PREFIX}{user_id}'}
+
+
+def _login(fx, i):
+    return 'POST', '/api/auth/login', {'email': f'user{i}@example.com', 'password': 'secret'}, {}
+
+
+def _transcribe(fx, i):
+    return 'POST', '/api/transcribe', {'audio_chunks': [AUDIO_CHUNK]}, _auth(fx.user(i))
+
+
+def _transcribe_stream(fx, i):
+    return 'POST', '/api/transcribe/stream', {'audio_chunks': [AUDIO_CHUNK]}, _auth(fx.user(i))
+
+
+def _transcribe_upload(fx, i):
+    return 'POST', '/api/transcribe/upload', AUDIO_BYTES, {**_auth(fx.user(i)), 'Content-Type': 'audio/webm'}
+
+
+def _analyze(fx, i):
+    return 'POST', '/api/analyze-symptoms', {'transcript': TRANSCRIPTS[i % len(TRANSCRIPTS)]}, _auth(fx.user(i))
+
+
+def _save(fx, i):
+    user_id = fx.user(i)
+    body = {'userId': user_id, 'transcript': TRANSCRIPTS[0], 'symptoms': ['fever', 'cough']}
+    return 'POST', '/api/save-symptoms', body, _auth(user_id)
+
+
+def _predict(fx, i):
+    user_id, symptom_id = fx.symptom(i)
+    body = {'userId': user_id, 'symptoms': ['fever', 'cough', 'headache'], 'symptomId': symptom_id}
+    return 'POST', '/api/predict-ailment', body, _auth(user_id)
+
+
+def _predict_stream(fx, i):
+    method, _, body, headers = _predict(fx, i)
+    return method, '/api/predict-ailment/stream', body, headers
+
+
+def _generate_report(fx, i):
+    user_id, symptom_id = fx.fresh_symptom(i)
+    return 'POST', '/api/generate-health-report', {'userId': user_id, 'symptomId': symptom_id}, _auth(user_id)
+
+
+def _book(fx, i):
+    user_id, symptom_id = fx.symptom(i)
+    body = {'userId': user_id, 'symptomId': symptom_id, 'preferredDate': '2026-11-02',
+            'preferredTime': '10:30', 'urgency': 'medium'}
+    return 'POST', '/api/book-appointment', body, _auth(user_id)
+
+
+def _list_reports(fx, i):
+    user_id = fx.user(i)
+    return 'GET', f'/api/health-reports/{user_id}', None, _auth(user_id)
+
+
+def _list_appointments(fx, i):
+    user_id = fx.user(i)
+    return 'GET', f'/api/appointments/{user_id}', None, _auth(user_id)
+
+
+def _voice_consultation(fx, i):
+    user_id = fx.user(i)
+    return 'POST', '/api/voice-consultation', {'userId': user_id, 'audio_chunks': [AUDIO_CHUNK]}, _auth(user_id)
+
+
+def _enqueue_analyze(fx, i):
+    method, _, body, headers = _analyze(fx, i)
+    return method, '/api/jobs/analyze-symptoms', body, headers
+
+
+def _enqueue_predict(fx, i):
+    method, _, body, headers = _predict(fx, i)
+    return method, '/api/jobs/predict-ailment', body, headers
+
+
+def _submitted_job(fx, i):
+    user_id, symptom_id = fx.symptom(i)
+    job_id = job_queue.submit('predict-ailment', user_id, ['fever', 'cough', 'headache'], symptom_id, owner=user_id)
+    return user_id, job_id
+
+
+def _job_result(fx, i):
+    # Submission to finished result, long-polled
+    user_id, job_id = _submitted_job(fx, i)
+    return 'GET', f'/api/jobs/{job_id}?wait=30', None, _auth(user_id)
+
+
+def _job_events(fx, i):
+    user_id, job_id = _submitted_job(fx, i)
+    return 'GET', f'/api/jobs/{job_id}/events', None, _auth(user_id)
+
+
+SCENARIOS = {
+    'login': _login,
+    'transcribe': _transcribe,
+    'transcribe-upload': _transcribe_upload,
+    'analyze-symptoms': _analyze,
+    'save-symptoms': _save,
+    'predict-ailment': _predict,
+    'predict-ailment-stream': _predict_stream,
+    'generate-health-report': _generate_report,
+    'book-appointment': _book,
+    'health-reports': _list_reports,
+    'appointments': _list_appointments,
+    'voice-consultation': _voice_consultation,
+    'transcribe-stream': _transcribe_stream,
+    'jobs-analyze-symptoms': _enqueue_analyze,
+    'jobs-predict-ailment': _enqueue_predict,
+    'job-result': _job_result,
+    'job-events': _job_events,
+}
+
+
+def _issue(client, fx, scenario):
+    method, path, body, headers = scenario(fx, fx.next_index())
+    started = time.perf_counter()
+    if isinstance(body, bytes):
+        response = client.open(path, method=method, data=body, headers=headers)
+    else:
+        response = client.open(path, method=method, json=body, headers=headers)
+    response.get_data()  # drain streamed responses
+    elapsed = time.perf_counter() - started
+    response.close()
+    return elapsed, response.status_code
+
+
+async def _issue_asgi(application, fx, scenario):
+    from asgi import call
+    method, path, body, headers = scenario(fx, fx.next_index())
+    if body is None:
+        body = b''
+    elif not isinstance(body, bytes):
+        body = json.dumps(body).encode('utf-8')
+        headers = {**headers, 'Content-Type': 'application/json'}
+    started = time.perf_counter()
+    status, _ = await call(application, method, path, body, list(headers.items()))
+    return time.perf_counter() - started, status
+
+
+def _run_threads(fx, scenario, concurrency, total_requests, record):
+    lock = threading.Lock()
+    remaining = [total_requests]
+
+    def worker():
+        client = backend.app.test_client()
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            elapsed, status = _issue(client, fx, scenario)
+            with lock:
+                record(elapsed, status)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+async def _run_tasks(fx, scenario, concurrency, total_requests, record):
+    from asgi import application
+    remaining = [total_requests]
+
+    async def worker():
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            record(*await _issue_asgi(application, fx, scenario))
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+
+
+def measure_latency(fx, scenario, concurrency, total_requests, use_asgi=False):
+    latencies = []
+    statuses = {}
+
+    def record(elapsed, status):
+        latencies.append(elapsed)
+        statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    if use_asgi:
+        asyncio.run(_run_tasks(fx, scenario, concurrency, total_requests, record))
+    else:
+        _run_threads(fx, scenario, concurrency, total_requests, record)
+    wall_time = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'requests': len(latencies),
+        'statuses': statuses,
+        'throughputRps': round(len(latencies) / wall_time, 1) if wall_time else 0.0,
+        'p50Ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95Ms': round(percentile(latencies, 95) * 1000, 3),
+        'p99Ms': round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+def measure_allocations(fx, scenario, samples, use_asgi=False):
+    if use_asgi:
+        # One event loop for every sample, so its setup is not counted per request
+        return asyncio.run(_measure_allocations_asgi(fx, scenario, samples))
+    client = backend.app.test_client()
+    _issue(client, fx, scenario)  # warm up imports and caches outside the measurement
+    tracemalloc.start()
+    try:
+        allocated = 0
+        peak = 0
+        for _ in range(samples):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            _issue(client, fx, scenario)
+            _, request_peak = tracemalloc.get_traced_memory()
+            allocated += request_peak - before
+            peak = max(peak, request_peak - before)
+    finally:
+        tracemalloc.stop()
+    return {'allocKbPerRequest': round(allocated / samples / 1024, 1), 'peakAllocKb': round(peak / 1024, 1)}
+
+
+async def _measure_allocations_asgi(fx, scenario, samples):
+    from asgi import application
+    await _issue_asgi(application, fx, scenario)
+    tracemalloc.start()
+    try:
+        allocated = 0
+        peak = 0
+        for _ in range(samples):
+            tracemalloc.reset_peak()
+            before, _ = tracemalloc.get_traced_memory()
+            await _issue_asgi(application, fx, scenario)
+            _, request_peak = tracemalloc.get_traced_memory()
+            allocated += request_peak - before
+            peak = max(peak, request_peak - before)
+    finally:
+        tracemalloc.stop()
+    return {'allocKbPerRequest': round(allocated / samples / 1024, 1), 'peakAllocKb': round(peak / 1024, 1)}
+
+
+def drain_jobs(timeout=60.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        queue = job_queue.metrics()
+        if not queue['queueDepth'] and not queue['running']:
+            return
+        time.sleep(0.05)
+
+
+def run(routes, concurrency, total_requests, alloc_samples, cold_cache, use_asgi=False):
+    fx = Fixture()
+    if cold_cache:
+        response_cache.max_entries = 0
+        response_cache.disk_path = None
+    results = {}
+    for name in routes:
+        scenario = SCENARIOS[name]
+        response_cache.clear()
+        reads, writes = fakes.firestore_client.reads, fakes.firestore_client.writes
+        result = measure_latency(fx, scenario, concurrency, total_requests, use_asgi)
+        drain_jobs()
+        issued = result['requests']
+        result['firestoreReadsPerRequest'] = round((fakes.firestore_client.reads - reads) / issued, 2)
+        result['firestoreWritesPerRequest'] = round((fakes.firestore_client.writes - writes) / issued, 2)
+        result.update(measure_allocations(fx, scenario, alloc_samples, use_asgi))
+        drain_jobs()
+        results[name] = result
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--routes', nargs='*', choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--alloc-samples', type=int, default=20)
+    parser.add_argument('--cold-cache', action='store_true', help='disable the LLM response cache')
+    parser.add_argument('--asgi', action='store_true', help='issue requests through the ASGI bridge in asgi.py')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    results = run(args.routes, args.concurrency, args.requests, args.alloc_samples, args.cold_cache, args.asgi)
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    header = f"{'route':<24}{'rps':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'KB/req':>9}  statuses"
+    print(header)
+    print('-' * len(header))
+    for name, r in results.items():
+        print(f"{name:<24}{r['throughputRps']:>9}{r['p50Ms']:>9}{r['p95Ms']:>9}{r['p99Ms']:>9}"
+              f"{r['allocKbPerRequest']:>9}  {r['statuses']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Cold-start import report and budget check for the serverless entry point.
+
+    python coldstart.py                      # per-package import-time breakdown
+    python coldstart.py --budget-ms 400      # exit 1 if `import app` is over budget
+
+Each run imports ``app`` in a fresh interpreter with ``-X importtime``; the
+median of ``--runs`` runs is reported. The check also fails when one of the
+provider SDKs that should load lazily is imported at startup.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+LAZY_MODULES = ('assemblyai', 'google.generativeai', 'firebase_admin', 'google.cloud.firestore', 'grpc',
+                'requests', 'numpy')
+
+_PROBE = ("import json, sys, app; "
+          f"print(json.dumps([m for m in {LAZY_MODULES!r} if m in sys.modules]))")
+
+
+def _import_once():
+    env = dict(os.environ, PROVIDER_WARMUP='0')
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', _PROBE], cwd=BACKEND_DIR, env=env,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True)
+    by_package = {}
+    total_us = 0
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        module = name.strip()
+        package = module.split('.')[0]
+        by_package[package] = by_package.get(package, 0) + int(self_us)
+        if module == 'app':
+            total_us = int(cumulative_us)
+    return total_us, by_package, json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure(runs):
+    totals, breakdowns, eager = [], [], set()
+    for _ in range(runs):
+        total_us, by_package, loaded = _import_once()
+        totals.append(total_us)
+        breakdowns.append(by_package)
+        eager.update(loaded)
+    packages = {name for b in breakdowns for name in b}
+    median_by_package = {name: statistics.median(b.get(name, 0) for b in breakdowns) for name in packages}
+    return {
+        'importAppMs': round(statistics.median(totals) / 1000, 1),
+        'packagesMs': {name: round(us / 1000, 1) for name, us in
+                       sorted(median_by_package.items(), key=lambda item: -item[1])},
+        'eagerlyLoaded': sorted(eager),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=3)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument('--budget-ms', type=float, default=float(os.getenv('COLD_START_BUDGET_MS', '0')) or None)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+
+    report = measure(args.runs)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print(f"import app: {report['importAppMs']} ms (median of {args.runs})")
+        for name, ms in list(report['packagesMs'].items())[:args.top]:
+            print(f'  {name:<32}{ms:>8} ms')
+        if report['eagerlyLoaded']:
+            print(f"eagerly loaded: {', '.join(report['eagerlyLoaded'])}")
+
+    failures = []
+    if report['eagerlyLoaded']:
+        failures.append(f"SDKs imported at startup: {', '.join(report['eagerlyLoaded'])}")
+    if args.budget_ms is not None and report['importAppMs'] > args.budget_ms:
+        failures.append(f"import app took {report['importAppMs']} ms, budget is {args.budget_ms} ms")
+    for failure in failures:
+        print(f'FAIL {failure}', file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
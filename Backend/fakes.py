@@ -0,0 +1,421 @@
+"""Offline stand-ins for AssemblyAI, Gemini, Firestore and Firebase Auth.
+
+Enabled with MEDIASSIST_PROVIDERS=fake. They implement only the surface the
+backend uses, return realistic payloads, and can inject latency so the
+benchmark suite exercises the same code paths as production without network
+access or credentials.
+"""
+import copy
+import datetime
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+
+ENABLED = os.getenv('MEDIASSIST_PROVIDERS', 'live') == 'fake'
+
+LLM_LATENCY_MS = float(os.getenv('FAKE_LLM_LATENCY_MS', '0'))
+TRANSCRIBE_LATENCY_MS = float(os.getenv('FAKE_TRANSCRIBE_LATENCY_MS', '0'))
+FIRESTORE_LATENCY_MS = float(os.getenv('FAKE_FIRESTORE_LATENCY_MS', '0'))
+# A slow tail and transient failures, for exercising hedging, retries and the circuit breaker
+LLM_TAIL_RATE = float(os.getenv('FAKE_LLM_TAIL_RATE', '0'))
+LLM_TAIL_LATENCY_MS = float(os.getenv('FAKE_LLM_TAIL_LATENCY_MS', '0'))
+LLM_ERROR_RATE = float(os.getenv('FAKE_LLM_ERROR_RATE', '0'))
+STREAM_CHUNK_CHARS = 48
+
+CANNED_TRANSCRIPT = ("I've had a fever and a dry cough for three days, "
+                     "a headache since yesterday and I lost my sense of smell.")
+
+SYMPTOM_VOCABULARY = ('fever', 'cough', 'headache', 'sore throat', 'fatigue', 'nausea',
+                      'loss of smell', 'chest pain', 'shortness of breath', 'dizziness')
+
+_SYMPTOM_PHRASES = {'lost my sense of smell': 'loss of smell'}
+
+
+def _sleep(latency_ms):
+    if latency_ms > 0:
+        time.sleep(latency_ms / 1000.0)
+
+
+# Transcription
+
+class FakeTranscript:
+    def __init__(self, text):
+        import assemblyai as aai
+        self.status = aai.TranscriptStatus.completed
+        self.text = text
+        self.error = None
+
+
+class FakeTranscriber:
+    def transcribe(self, audio_file_path):
+        _sleep(TRANSCRIBE_LATENCY_MS)
+        return FakeTranscript(CANNED_TRANSCRIPT)
+
+
+# LLM
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGenerativeModel:
+    """Deterministic Gemini stand-in that answers the prompts the backend sends."""
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        if 'Transcript:' in prompt:
+            text = self._symptoms_answer(prompt.split('Transcript:', 1)[1])
+        elif re.search(r'^Case 1:$', prompt, re.MULTILINE):
+            text = self._batch_answer(re.findall(r'^Symptoms: (.*)$', prompt, re.MULTILINE))
+        else:
+            symptoms_line = re.search(r'^Symptoms: (.*)$', prompt, re.MULTILINE)
+            symptoms = [s.strip() for s in symptoms_line.group(1).split(',')] if symptoms_line else []
+            text = self._prediction_answer(symptoms)
+        if LLM_ERROR_RATE and random.random() < LLM_ERROR_RATE:
+            from google.api_core.exceptions import ServiceUnavailable
+            raise ServiceUnavailable('fake Gemini outage')
+        if stream:
+            return self._stream(text)
+        _sleep(LLM_TAIL_LATENCY_MS if LLM_TAIL_RATE and random.random() < LLM_TAIL_RATE else LLM_LATENCY_MS)
+        return FakeResponse(text)
+
+    @staticmethod
+    def _stream(text, chunk_chars=STREAM_CHUNK_CHARS):
+        # Spread the configured latency over the chunks, like tokens arriving
+        chunks = [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)]
+        for chunk in chunks:
+            _sleep(LLM_LATENCY_MS / len(chunks))
+            yield FakeResponse(chunk)
+
+    @staticmethod
+    def _symptoms_answer(transcript):
+        text = transcript.lower()
+        for phrase, canonical in _SYMPTOM_PHRASES.items():
+            text = text.replace(phrase, canonical)
+        found = [s for s in SYMPTOM_VOCABULARY if s in text]
+        return f"```json\n{json.dumps(found)}\n```"
+
+    @staticmethod
+    def _prediction_answer(symptoms):
+        severe = any(s in ('chest pain', 'shortness of breath') for s in symptoms)
+        prediction = {
+            'possibleAilments': [
+                {'name': 'Viral upper respiratory infection', 'confidence': 'high',
+                 'description': f"Consistent with {', '.join(symptoms[:3]) or 'the reported symptoms'}."},
+                {'name': 'Influenza', 'confidence': 'medium',
+                 'description': 'Fever with cough and headache is common in influenza.'},
+            ],
+            'recommendations': ['Rest and stay hydrated.', 'Monitor your temperature.'],
+            'urgency': 'high' if severe else 'medium',
+            'shouldSeeDoctor': severe,
+        }
+        return "Here is my assessment:\n" + json.dumps(prediction, indent=2)
+
+    @classmethod
+    def _batch_answer(cls, symptom_lines):
+        results = []
+        for number, line in enumerate(symptom_lines, 1):
+            answer = cls._prediction_answer([s.strip() for s in line.split(',')])
+            results.append({'case': number, **json.loads(answer.split('\n', 1)[1])})
+        return "```json\n" + json.dumps({'results': results}) + "\n```"
+
+
+# Firestore
+
+def _gcloud_firestore():
+    # Imported on use so that importing this module stays cheap in live mode
+    from google.cloud import firestore
+    return firestore
+
+
+def _resolve(value, current=None):
+    """Replace write sentinels; ``current`` is the stored value a transform applies to."""
+    firestore = _gcloud_firestore()
+    if value is firestore.SERVER_TIMESTAMP:
+        return datetime.datetime.now(datetime.timezone.utc)
+    if isinstance(value, firestore.Increment):
+        return (current if isinstance(current, (int, float)) else 0) + value.value
+    if isinstance(value, dict):
+        return {k: _resolve(v, current.get(k) if isinstance(current, dict) else None) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_resolve(v) for v in value]
+    return value
+
+
+def _merge(target, data):
+    """Apply a ``set(..., merge=True)``: nested maps merge field by field, DELETE_FIELD removes."""
+    firestore = _gcloud_firestore()
+    for key, value in data.items():
+        if value is firestore.DELETE_FIELD:
+            target.pop(key, None)
+        elif isinstance(value, dict) and isinstance(target.get(key), dict):
+            _merge(target[key], value)
+        else:
+            target[key] = _resolve(_merge({}, value) if isinstance(value, dict) else value, target.get(key))
+    return target
+
+
+def _get_path(data, field_path):
+    for part in field_path.split('.'):
+        if not isinstance(data, dict) or part not in data:
+            return None
+        data = data[part]
+    return data
+
+
+class FakeSnapshot:
+    def __init__(self, reference, data, fields=None):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+        self._fields = fields
+
+    def get(self, field_path):
+        return _get_path(self._data, field_path)
+
+    def to_dict(self):
+        if self._data is None:
+            return None
+        data = copy.deepcopy(self._data)
+        if self._fields is not None:
+            data = {k: v for k, v in data.items() if k in self._fields}
+        return data
+
+
+class FakeDocumentReference:
+    def __init__(self, client, collection_name, doc_id):
+        self._client = client
+        self.collection_name = collection_name
+        self.id = doc_id
+        self.path = f'{collection_name}/{doc_id}'
+
+    def get(self, **kwargs):
+        _sleep(FIRESTORE_LATENCY_MS)
+        return self._client._read(self)
+
+    def set(self, data, merge=False):
+        _sleep(FIRESTORE_LATENCY_MS)
+        self._client._write('set', self, data, merge=merge)
+
+    def create(self, data):
+        _sleep(FIRESTORE_LATENCY_MS)
+        self._client._write('create', self, data)
+
+    def update(self, fields):
+        _sleep(FIRESTORE_LATENCY_MS)
+        self._client._write('update', self, fields)
+
+    def delete(self):
+        _sleep(FIRESTORE_LATENCY_MS)
+        self._client._write('delete', self, None)
+
+
+class FakeQuery:
+    def __init__(self, client, collection_name, filters=(), orders=(), limit=None, cursor=None, fields=None):
+        self._client = client
+        self._collection_name = collection_name
+        self._filters = tuple(filters)
+        self._orders = tuple(orders)
+        self._limit = limit
+        self._cursor = cursor
+        self._fields = fields
+
+    def _copy(self, **changes):
+        state = dict(filters=self._filters, orders=self._orders, limit=self._limit,
+                     cursor=self._cursor, fields=self._fields)
+        state.update(changes)
+        return FakeQuery(self._client, self._collection_name, **state)
+
+    def where(self, field_path, op, value):
+        return self._copy(filters=self._filters + ((field_path, op, value),))
+
+    def order_by(self, field_path, direction='ASCENDING'):
+        return self._copy(orders=self._orders + ((field_path, direction),))
+
+    def limit(self, count):
+        return self._copy(limit=count)
+
+    def start_after(self, snapshot):
+        return self._copy(cursor=snapshot)
+
+    def select(self, field_paths):
+        return self._copy(fields=tuple(field_paths))
+
+    def _matches(self, data):
+        for field_path, op, value in self._filters:
+            actual = _get_path(data, field_path)
+            if op == '==' and actual != value:
+                return False
+            if op == 'in' and actual not in value:
+                return False
+            if op == '>=' and (actual is None or actual < value):
+                return False
+            if op == '<=' and (actual is None or actual > value):
+                return False
+            if op == '>' and (actual is None or actual <= value):
+                return False
+            if op == '<' and (actual is None or actual >= value):
+                return False
+        return True
+
+    def stream(self, **kwargs):
+        _sleep(FIRESTORE_LATENCY_MS)
+        rows = self._client._scan(self._collection_name, self._matches)
+        for field_path, direction in reversed(self._orders):
+            rows.sort(key=lambda row: (_get_path(row[1], field_path) is None, _get_path(row[1], field_path)),
+                      reverse=direction == _gcloud_firestore().Query.DESCENDING)
+        if self._cursor is not None:
+            ids = [doc_id for doc_id, _ in rows]
+            if self._cursor.id in ids:
+                rows = rows[ids.index(self._cursor.id) + 1:]
+        if self._limit is not None:
+            rows = rows[:self._limit]
+        for doc_id, data in rows:
+            ref = FakeDocumentReference(self._client, self._collection_name, doc_id)
+            yield FakeSnapshot(ref, data, self._fields)
+
+    def get(self, **kwargs):
+        return list(self.stream())
+
+
+class FakeCollection(FakeQuery):
+    def __init__(self, client, name):
+        super().__init__(client, name)
+        self.id = name
+
+    def document(self, doc_id=None):
+        return FakeDocumentReference(self._client, self._collection_name, doc_id or uuid.uuid4().hex[:20])
+
+    def add(self, data):
+        ref = self.document()
+        ref.create(data)
+        return datetime.datetime.now(datetime.timezone.utc), ref
+
+
+class FakeWriteBatch:
+    def __init__(self, client):
+        self._client = client
+        self._writes = []
+
+    def set(self, ref, data, merge=False):
+        self._writes.append(('set', ref, data, merge))
+        return self
+
+    def create(self, ref, data):
+        self._writes.append(('create', ref, data, False))
+        return self
+
+    def update(self, ref, fields):
+        self._writes.append(('update', ref, fields, False))
+        return self
+
+    def delete(self, ref):
+        self._writes.append(('delete', ref, None, False))
+        return self
+
+    def commit(self, **kwargs):
+        from google.api_core.exceptions import AlreadyExists, NotFound
+        _sleep(FIRESTORE_LATENCY_MS)
+        with self._client._lock:
+            # Validate first so a failing write leaves nothing applied, like Firestore
+            for op, ref, _, _ in self._writes:
+                exists = ref.path in self._client._docs
+                if op == 'create' and exists:
+                    raise AlreadyExists(f'Document already exists: {ref.path}')
+                if op == 'update' and not exists:
+                    raise NotFound(f'No document to update: {ref.path}')
+            for op, ref, data, merge in self._writes:
+                self._client._apply(op, ref, data, merge)
+        self._writes = []
+
+
+class FakeFirestore:
+    """In-memory, thread-safe subset of google.cloud.firestore.Client."""
+
+    def __init__(self):
+        self._docs = {}
+        self._lock = threading.RLock()
+        self.reads = 0
+        self.writes = 0
+
+    def collection(self, name):
+        return FakeCollection(self, name)
+
+    def batch(self):
+        return FakeWriteBatch(self)
+
+    def get_all(self, refs, **kwargs):
+        _sleep(FIRESTORE_LATENCY_MS)
+        return [self._read(ref) for ref in refs]
+
+    def reset(self):
+        with self._lock:
+            self._docs.clear()
+            self.reads = self.writes = 0
+
+    def _read(self, ref):
+        with self._lock:
+            self.reads += 1
+            data = self._docs.get(ref.path)
+            return FakeSnapshot(ref, copy.deepcopy(data) if data is not None else None)
+
+    def _scan(self, collection_name, predicate):
+        prefix = collection_name + '/'
+        with self._lock:
+            rows = [(path[len(prefix):], data) for path, data in self._docs.items()
+                    if path.startswith(prefix) and predicate(data)]
+            self.reads += len(rows)
+            # Snapshots get a private copy, like documents decoded off the wire
+            return [(doc_id, copy.deepcopy(data)) for doc_id, data in rows]
+
+    def _write(self, op, ref, data, merge=False):
+        batch = FakeWriteBatch(self)
+        batch._writes.append((op, ref, data, merge))
+        batch.commit()
+
+    def _apply(self, op, ref, data, merge):
+        self.writes += 1
+        if op == 'delete':
+            self._docs.pop(ref.path, None)
+        elif op == 'update':
+            doc = self._docs[ref.path]
+            for field_path, value in data.items():
+                target = doc
+                parts = field_path.split('.')
+                for part in parts[:-1]:
+                    target = target.setdefault(part, {})
+                target[parts[-1]] = _resolve(value, target.get(parts[-1]))
+        elif op == 'set' and merge:
+            _merge(self._docs.setdefault(ref.path, {}), copy.deepcopy(data))
+        else:
+            self._docs[ref.path] = _resolve(copy.deepcopy(data))
+
+
+firestore_client = FakeFirestore()
+
+
+# Firebase Auth
+
+FAKE_TOKEN_PREFIX = 'fake-token:'
+
+
+def sign_in_with_password(email, password):
+    if not email or not password:
+        return {'error': {'message': 'INVALID_LOGIN_CREDENTIALS'}}
+    uid = 'user-' + uuid.uuid5(uuid.NAMESPACE_URL, email).hex[:12]
+    return {'idToken': FAKE_TOKEN_PREFIX + uid, 'localId': uid}
+
+
+def verify_id_token(token):
+    if not token.startswith(FAKE_TOKEN_PREFIX):
+        raise ValueError('Not a fake token')
+    uid = token[len(FAKE_TOKEN_PREFIX):]
+    return {'uid': uid, 'user_id': uid, 'exp': int(time.time()) + 3600}
@@ -1,5 +1,18 @@
-import firebase_admin
-from firebase_admin import credentials, auth
+import threading
 
-cred = credentials.Certificate('serviceAccountKey.json')  # path to your Firebase key
-firebase_admin.initialize_app(cred)
+import fakes
+
+_lock = threading.Lock()
+
+
+def initialize():
+    """Initialize the default firebase_admin app from the certificate on first use."""
+    if fakes.ENABLED:
+        return None
+    import firebase_admin
+    from firebase_admin import credentials
+    with _lock:
+        if not firebase_admin._apps:
+            cred = credentials.Certificate('serviceAccountKey.json')  # path to your Firebase key
+            firebase_admin.initialize_app(cred)
+    return firebase_admin.get_app()
@@ -0,0 +1,181 @@
+"""HTTP-level caching: ETags, conditional GETs, Cache-Control and compression.
+
+Every non-streamed 200 response to a GET gets a strong ETag over its body,
+and a request whose If-None-Match already names it is answered with an empty
+304. Views decorated with ``cache_for`` also get a Cache-Control lifetime;
+other GETs are marked ``private, no-cache`` so browsers revalidate instead of
+refetching. Bodies above COMPRESS_MIN_BYTES are compressed with brotli or
+gzip as the client accepts; compressed variants carry the encoding as an
+ETag suffix, which is stripped again when matching If-None-Match.
+"""
+import gzip
+import hashlib
+import os
+import threading
+from functools import wraps
+
+from flask import current_app, request
+
+try:
+    import orjson
+except ImportError:  # stdlib json is used for responses without it
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # only gzip is offered without it
+    brotli = None
+
+from llm_cache import ResponseCache
+from metrics import span
+
+COMPRESS_MIN_BYTES = int(os.getenv('HTTP_COMPRESS_MIN_BYTES', '1024'))
+GZIP_LEVEL = int(os.getenv('HTTP_GZIP_LEVEL', '6'))
+BROTLI_QUALITY = int(os.getenv('HTTP_BROTLI_QUALITY', '5'))
+COMPRESSIBLE_TYPES = ('application/json', 'text/plain', 'text/html', 'text/css', 'application/javascript')
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+IMMUTABLE_MAX_AGE = 31536000
+
+# Generated reports never change once written; entries are dropped when a report is (re)written
+report_cache = ResponseCache(
+    max_entries=int(os.getenv('REPORT_CACHE_MAX_ENTRIES', '1024')),
+    ttl_seconds=int(os.getenv('REPORT_CACHE_TTL_SECONDS', '86400')),
+    disk_path=os.getenv('REPORT_CACHE_PATH') or None,
+)
+
+
+class HttpCacheStats:
+    def __init__(self):
+        self.not_modified = 0
+        self.compressed = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._lock = threading.Lock()
+
+    def record_not_modified(self):
+        with self._lock:
+            self.not_modified += 1
+
+    def record_compressed(self, bytes_in, bytes_out):
+        with self._lock:
+            self.compressed += 1
+            self.bytes_in += bytes_in
+            self.bytes_out += bytes_out
+
+    def stats(self):
+        with self._lock:
+            return {
+                'notModified': self.not_modified,
+                'compressed': self.compressed,
+                'bytesSaved': self.bytes_in - self.bytes_out,
+                'encodings': list(ENCODINGS),
+            }
+
+
+http_stats = HttpCacheStats()
+
+
+def cache_for(max_age, public=False, immutable=False):
+    """Give successful responses of the decorated view a Cache-Control lifetime."""
+    directives = ['public' if public else 'private', f'max-age={max_age}']
+    if immutable:
+        directives.append('immutable')
+    header = ', '.join(directives)
+
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            response = current_app.make_response(f(*args, **kwargs))
+            if response.status_code == 200:
+                response.headers['Cache-Control'] = header
+            return response
+        return wrapper
+    return decorator
+
+
+def _strip_encoding(tag):
+    for encoding in ENCODINGS:
+        if tag.endswith('-' + encoding):
+            return tag[:-len(encoding) - 1]
+    return tag
+
+
+def _not_modified(etag):
+    if_none_match = request.if_none_match
+    if not if_none_match:
+        return False
+    return if_none_match.star_tag or any(_strip_encoding(tag) == etag for tag in if_none_match.as_set())
+
+
+def _pick_encoding():
+    accepted = request.accept_encodings
+    best, best_quality = None, 0
+    for encoding in ENCODINGS:
+        quality = accepted[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def _compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL)
+
+
+def _finalize(response):
+    if response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers:
+        return response
+    data = response.get_data()
+
+    if request.method == 'GET' and response.status_code == 200:
+        etag = hashlib.sha256(data).hexdigest()[:32]
+        response.set_etag(etag)
+        response.headers.setdefault('Cache-Control', 'private, no-cache')
+        if _not_modified(etag):
+            http_stats.record_not_modified()
+            response.status_code = 304
+            response.set_data(b'')
+            response.headers.pop('Content-Type', None)
+            return response
+
+    if len(data) < COMPRESS_MIN_BYTES or response.mimetype not in COMPRESSIBLE_TYPES:
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = _pick_encoding()
+    if encoding is None:
+        return response
+    with span(f'compress.{encoding}'):
+        compressed = _compress(data, encoding)
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(f'{etag}-{encoding}')
+    http_stats.record_compressed(len(data), len(compressed))
+    return response
+
+
+def init_app(app):
+    """Install the response hook and the orjson-backed encoder; call after metrics.init_app."""
+    app.after_request(_finalize)
+    if orjson is None:
+        return
+
+    json_encoder = app.json_encoder
+
+    class FastJSONEncoder(json_encoder):
+        def untimed_encode(self, o):
+            # Called inside metrics' json_serialize span, for the orjson path and the fallback alike
+            if self.indent is not None:
+                return super().untimed_encode(o)
+            # Datetimes go through the app encoder's default() so their format matches jsonify's
+            options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+            if self.sort_keys:
+                options |= orjson.OPT_SORT_KEYS
+            try:
+                return orjson.dumps(o, default=self.default, option=options).decode('utf-8')
+            except TypeError:  # orjson.JSONEncodeError included
+                return super().untimed_encode(o)
+
+    app.json_encoder = FastJSONEncoder
@@ -0,0 +1,248 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+FINISHED_STATES = (SUCCEEDED, FAILED)
+
+
+class QueueFull(Exception):
+    pass
+
+
+class MemoryJobStore:
+    def __init__(self, result_ttl_seconds=3600):
+        self.result_ttl_seconds = result_ttl_seconds
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def create(self, job):
+        with self._lock:
+            self._prune()
+            self._jobs[job['id']] = dict(job)
+
+    def update(self, job_id, **fields):
+        with self._lock:
+            if job_id in self._jobs:
+                self._jobs[job_id].update(fields)
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def _prune(self):
+        cutoff = time.time() - self.result_ttl_seconds
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.get('finishedAt') and job['finishedAt'] < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+
+class SQLiteJobStore:
+    """Job records in a SQLite file, so any worker on the host can answer a poll."""
+
+    COLUMNS = ('id', 'stage', 'ownerId', 'status', 'result', 'error', 'enqueuedAt', 'startedAt', 'finishedAt')
+
+    def __init__(self, path, result_ttl_seconds=3600):
+        self.path = path
+        self.result_ttl_seconds = result_ttl_seconds
+        self._local = threading.local()
+
+    def _connect(self):
+        # Per thread, and reopened in a forked worker instead of sharing the parent's
+        pid = os.getpid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != pid:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS jobs ('
+                'id TEXT PRIMARY KEY, stage TEXT, ownerId TEXT, status TEXT, result TEXT, error TEXT, '
+                'enqueuedAt REAL, startedAt REAL, finishedAt REAL)'
+            )
+            # Files written before jobs carried an owner
+            if 'ownerId' not in {row[1] for row in conn.execute('PRAGMA table_info(jobs)')}:
+                conn.execute('ALTER TABLE jobs ADD COLUMN ownerId TEXT')
+            self._local.conn = conn
+            self._local.pid = pid
+        return conn
+
+    def create(self, job):
+        conn = self._connect()
+        conn.execute('DELETE FROM jobs WHERE finishedAt < ?', (time.time() - self.result_ttl_seconds,))
+        conn.execute(
+            'INSERT INTO jobs (id, stage, ownerId, status, enqueuedAt) VALUES (?, ?, ?, ?, ?)',
+            (job['id'], job['stage'], job.get('ownerId'), job['status'], job['enqueuedAt'])
+        )
+
+    def update(self, job_id, **fields):
+        if 'result' in fields:
+            fields['result'] = json.dumps(fields['result'])
+        assignments = ', '.join(f'{name} = ?' for name in fields)
+        self._connect().execute(
+            f'UPDATE jobs SET {assignments} WHERE id = ?', (*fields.values(), job_id)
+        )
+
+    def get(self, job_id):
+        row = self._connect().execute(
+            f"SELECT {', '.join(self.COLUMNS)} FROM jobs WHERE id = ?", (job_id,)
+        ).fetchone()
+        if not row:
+            return None
+        job = dict(zip(self.COLUMNS, row))
+        if job['result'] is not None:
+            job['result'] = json.loads(job['result'])
+        return job
+
+
+class _StageStats:
+    def __init__(self, name, handler, concurrency):
+        self.name = name
+        self.handler = handler
+        self.concurrency = concurrency
+        self.pending = deque()
+        self.running = 0
+        self.completed = 0
+        self.failed = 0
+        self.wait_count = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.run_total = 0.0
+
+    def snapshot(self):
+        return {
+            'concurrency': self.concurrency,
+            'queued': len(self.pending),
+            'running': self.running,
+            'completed': self.completed,
+            'failed': self.failed,
+            'avgWaitSeconds': self.wait_total / self.wait_count if self.wait_count else 0.0,
+            'maxWaitSeconds': self.wait_max,
+            'avgRunSeconds': self.run_total / (self.completed + self.failed) if self.completed + self.failed else 0.0,
+        }
+
+
+class JobQueue:
+    """Runs registered stage handlers on a bounded thread pool.
+
+    Each stage has its own concurrency limit; work beyond that limit waits in
+    a per-stage FIFO instead of occupying a pool thread, so one slow provider
+    cannot starve the other stages.
+    """
+
+    def __init__(self, store, max_workers=8, max_queued=256):
+        self.store = store
+        self.max_queued = max_queued
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._stages = {}
+        self._lock = threading.Lock()
+        self._finished = threading.Condition(self._lock)
+        self._reserved = 0
+
+    def register_stage(self, name, handler, concurrency=2):
+        self._stages[name] = _StageStats(name, handler, concurrency)
+
+    def submit(self, stage_name, *args, owner=None, **kwargs):
+        stage = self._stages[stage_name]
+        job_id = uuid.uuid4().hex
+        enqueued_at = time.time()
+        # The slot is reserved under the lock, but the store write (SQLite I/O) happens
+        # outside it so that submitters and finishing workers do not queue behind the disk
+        with self._lock:
+            if sum(len(s.pending) for s in self._stages.values()) + self._reserved >= self.max_queued:
+                raise QueueFull('Job queue is full, please retry shortly')
+            self._reserved += 1
+        try:
+            self.store.create({'id': job_id, 'stage': stage_name, 'ownerId': owner, 'status': QUEUED,
+                               'enqueuedAt': enqueued_at})
+        except BaseException:
+            with self._lock:
+                self._reserved -= 1
+            raise
+        with self._lock:
+            self._reserved -= 1
+            stage.pending.append((job_id, enqueued_at, args, kwargs))
+            self._dispatch(stage)
+        return job_id
+
+    def _dispatch(self, stage):
+        # Caller holds self._lock
+        while stage.pending and stage.running < stage.concurrency:
+            stage.running += 1
+            self._pool.submit(self._run, stage, *stage.pending.popleft())
+
+    def _run(self, stage, job_id, enqueued_at, args, kwargs):
+        started_at = time.time()
+        waited = started_at - enqueued_at
+        with self._lock:
+            stage.wait_count += 1
+            stage.wait_total += waited
+            stage.wait_max = max(stage.wait_max, waited)
+        succeeded = False
+        try:
+            self.store.update(job_id, status=RUNNING, startedAt=started_at)
+            result = stage.handler(*args, **kwargs)
+            self.store.update(job_id, status=SUCCEEDED, result=result, finishedAt=time.time())
+            succeeded = True
+        except Exception as e:
+            self.store.update(job_id, status=FAILED, error=str(e), finishedAt=time.time())
+        finally:
+            # Free the slot even if the store is unavailable, or the stage would stall
+            with self._lock:
+                stage.running -= 1
+                stage.run_total += time.time() - started_at
+                if succeeded:
+                    stage.completed += 1
+                else:
+                    stage.failed += 1
+                self._dispatch(stage)
+                self._finished.notify_all()
+
+    def get(self, job_id):
+        return self.store.get(job_id)
+
+    def wait(self, job_id, timeout=30.0, poll_interval=0.5):
+        # Jobs run by another worker only show up through the store, so the
+        # condition wait is capped at poll_interval before re-reading it.
+        deadline = time.time() + timeout
+        while True:
+            job = self.store.get(job_id)
+            remaining = deadline - time.time()
+            if job is None or job['status'] in FINISHED_STATES or remaining <= 0:
+                return job
+            with self._lock:
+                self._finished.wait(min(poll_interval, remaining))
+
+    def metrics(self):
+        with self._lock:
+            stages = {name: stage.snapshot() for name, stage in self._stages.items()}
+        return {
+            'queueDepth': sum(s['queued'] for s in stages.values()),
+            'running': sum(s['running'] for s in stages.values()),
+            'maxQueued': self.max_queued,
+            'stages': stages,
+        }
+
+
+def _make_store():
+    ttl = int(os.getenv('JOB_RESULT_TTL_SECONDS', '3600'))
+    path = os.getenv('JOB_STORE_PATH')
+    if path:
+        return SQLiteJobStore(path, result_ttl_seconds=ttl)
+    return MemoryJobStore(result_ttl_seconds=ttl)
+
+
+job_queue = JobQueue(
+    _make_store(),
+    max_workers=int(os.getenv('JOB_WORKERS', '8')),
+    max_queued=int(os.getenv('JOB_MAX_QUEUED', '256')),
+)
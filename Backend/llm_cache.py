@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+# Bump a template version whenever the matching prompt text in app.py changes,
+# so cached answers produced by the old prompt are no longer served.
+ANALYZE_PROMPT_VERSION = 'analyze-v2'
+PREDICT_PROMPT_VERSION = 'predict-v2'
+
+
+def normalize_text(text):
+    return ' '.join((text or '').lower().split())
+
+
+def normalize_symptoms(symptoms):
+    return sorted({normalize_text(s) for s in symptoms or [] if normalize_text(s)})
+
+
+def make_key(model_name, prompt_version, **inputs):
+    payload = json.dumps(
+        {'model': model_name, 'prompt': prompt_version, 'inputs': inputs},
+        sort_keys=True,
+        separators=(',', ':'),
+        default=str,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """Two-tier cache for parsed model responses.
+
+    The first tier is a bounded in-process LRU with a TTL. The optional second
+    tier is a SQLite file that several gunicorn workers on the same host can
+    share; entries found there are promoted into the LRU. Expired rows are
+    never served, and are deleted by a write at most once per
+    ``sweep_interval_seconds`` in each process rather than on every write.
+    """
+
+    def __init__(self, max_entries=512, ttl_seconds=3600, disk_path=None, sweep_interval_seconds=60):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.disk_path = disk_path
+        self.sweep_interval_seconds = sweep_interval_seconds
+        self._next_sweep = 0.0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _connect(self):
+        # One connection per thread and per process, opened on first use: a
+        # connection inherited across a fork (gunicorn --preload) must not be reused.
+        pid = os.getpid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != pid:
+            conn = sqlite3.connect(self.disk_path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS llm_cache ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS llm_cache_expires ON llm_cache (expires)')
+            self._local.conn = conn
+            self._local.pid = pid
+        return conn
+
+    def _store_local(self, key, value, expires):
+        self._entries[key] = (value, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0]
+                del self._entries[key]
+                self.evictions += 1
+
+        if self.disk_path:
+            try:
+                row = self._connect().execute(
+                    'SELECT value, expires FROM llm_cache WHERE key = ?', (key,)
+                ).fetchone()
+            except sqlite3.Error:
+                row = None
+            if row and row[1] > now:
+                value = json.loads(row[0])
+                with self._lock:
+                    self._store_local(key, value, row[1])
+                    self.disk_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value):
+        now = time.time()
+        expires = now + self.ttl_seconds
+        with self._lock:
+            self._store_local(key, value, expires)
+            sweep = now >= self._next_sweep
+            if sweep:
+                self._next_sweep = now + self.sweep_interval_seconds
+        if self.disk_path:
+            try:
+                conn = self._connect()
+                conn.execute(
+                    'INSERT OR REPLACE INTO llm_cache (key, value, expires) VALUES (?, ?, ?)',
+                    (key, json.dumps(value), expires),
+                )
+                if sweep:
+                    conn.execute('DELETE FROM llm_cache WHERE expires <= ?', (now,))
+            except sqlite3.Error:
+                pass
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.disk_path:
+            try:
+                self._connect().execute('DELETE FROM llm_cache WHERE key = ?', (key,))
+            except sqlite3.Error:
+                pass
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        if self.disk_path:
+            try:
+                self._connect().execute('DELETE FROM llm_cache')
+            except sqlite3.Error:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'maxEntries': self.max_entries,
+                'ttlSeconds': self.ttl_seconds,
+                'diskPath': self.disk_path,
+                'hits': self.hits,
+                'diskHits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+
+response_cache = ResponseCache(
+    max_entries=int(os.getenv('LLM_CACHE_MAX_ENTRIES', '512')),
+    ttl_seconds=int(os.getenv('LLM_CACHE_TTL_SECONDS', '3600')),
+    disk_path=os.getenv('LLM_CACHE_PATH') or None,
+    sweep_interval_seconds=int(os.getenv('LLM_CACHE_SWEEP_SECONDS', '60')),
+)
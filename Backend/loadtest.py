@@ -0,0 +1,108 @@
+"""Minimal HTTP load generator for comparing serving modes.
+
+Start the backend one way, run the same load, then repeat with the other:
+
+    gunicorn -w 4 -b :5000 app:app
+    gunicorn -w 1 -k uvicorn.workers.UvicornWorker -b :5000 asgi:application
+
+    python loadtest.py --url http://localhost:5000/api/analyze-symptoms \\
+        --body '{"transcript": "I have a fever and a cough"}' \\
+        --header "Authorization: Bearer $TOKEN" --concurrency 200 --requests 2000
+"""
+import argparse
+import http.client
+import json
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_load(url, method='GET', body=None, headers=None, concurrency=10, total_requests=100, timeout=60):
+    """Issue ``total_requests`` requests from ``concurrency`` keep-alive clients and summarize them."""
+    target = urlsplit(url)
+    path = target.path + (f'?{target.query}' if target.query else '')
+    connection_class = http.client.HTTPSConnection if target.scheme == 'https' else http.client.HTTPConnection
+    request_headers = {'Content-Type': 'application/json', **(headers or {})}
+    payload = body.encode('utf-8') if isinstance(body, str) else body
+
+    latencies = []
+    statuses = {}
+    errors = []
+    lock = threading.Lock()
+    remaining = [total_requests]
+
+    def worker():
+        conn = connection_class(target.netloc, timeout=timeout)
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    break
+                remaining[0] -= 1
+            started = time.perf_counter()
+            try:
+                conn.request(method, path, body=payload, headers=request_headers)
+                response = conn.getresponse()
+                response.read()
+                status = response.status
+            except Exception as e:
+                conn.close()
+                conn = connection_class(target.netloc, timeout=timeout)
+                with lock:
+                    errors.append(str(e))
+                continue
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                statuses[status] = statuses.get(status, 0) + 1
+        conn.close()
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_time = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        'url': url,
+        'concurrency': concurrency,
+        'requests': total_requests,
+        'completed': len(latencies),
+        'errors': len(errors),
+        'statuses': statuses,
+        'wallSeconds': round(wall_time, 3),
+        'throughputRps': round(len(latencies) / wall_time, 1) if wall_time else 0.0,
+        'p50Ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95Ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99Ms': round(percentile(latencies, 99) * 1000, 2),
+        'maxMs': round(latencies[-1] * 1000, 2) if latencies else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', required=True)
+    parser.add_argument('--method', default=None, help='defaults to POST when --body is given')
+    parser.add_argument('--body')
+    parser.add_argument('--header', action='append', default=[], help='"Name: value", repeatable')
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--requests', type=int, default=100)
+    args = parser.parse_args()
+
+    headers = dict(h.split(':', 1) for h in args.header)
+    headers = {k.strip(): v.strip() for k, v in headers.items()}
+    method = args.method or ('POST' if args.body else 'GET')
+    print(json.dumps(run_load(args.url, method, args.body, headers, args.concurrency, args.requests), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""Hot-path timing spans and a Prometheus text exposition for them.
+
+Every external call and the JSON parse/serialize steps run inside ``span()``,
+which records its duration into a histogram labelled with the Flask route
+(or ``background`` for work running outside a request) and the stage name.
+Set PROFILE_SAMPLE_RATE (0-1) to run that fraction of requests under cProfile;
+the stats are written to PROFILE_DIR for offline inspection.
+"""
+import bisect
+import cProfile
+import os
+import random
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import g, has_request_context, request
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'mediassist-profiles'))
+
+
+class Histogram:
+    def __init__(self, name, help_text, label_names, buckets=DURATION_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = label_names
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            if index < len(self.buckets):
+                series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            items = sorted((labels, (list(s[0]), s[1], s[2])) for labels, s in self._series.items())
+        for labels, (counts, total, count) in items:
+            label_text = ','.join(f'{k}="{v}"' for k, v in zip(self.label_names, labels))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{label_text},le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {total}')
+            lines.append(f'{self.name}_count{{{label_text}}} {count}')
+        return lines
+
+
+stage_duration = Histogram('mediassist_stage_duration_seconds',
+                           'Time spent in one stage of a request (external call, parse, serialize).',
+                           ('route', 'stage'))
+request_duration = Histogram('mediassist_request_duration_seconds',
+                             'End-to-end request handling time.', ('route', 'method', 'status'))
+
+_gauge_sources = []
+
+
+def current_route():
+    if has_request_context():
+        return request.endpoint or 'unmatched'
+    return 'background'
+
+
+@contextmanager
+def span(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_duration.observe((current_route(), stage), time.perf_counter() - started)
+
+
+def register_gauges(source):
+    """Register a callable returning {metric_name: value} to include in /metrics.
+
+    Names ending in ``_total`` are exposed as counters, everything else as gauges.
+    """
+    _gauge_sources.append(source)
+
+
+def render():
+    lines = stage_duration.render() + request_duration.render()
+    for source in _gauge_sources:
+        for name, value in source().items():
+            lines.append(f"# TYPE {name} {'counter' if name.endswith('_total') else 'gauge'}")
+            lines.append(f'{name} {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def init_app(app):
+    @app.before_request
+    def _start_request_timer():
+        g.request_started = time.perf_counter()
+        if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+        if request.is_json:
+            # Parsed once here and cached by Flask for the view's get_json()
+            with span('json_parse'):
+                request.get_json(silent=True)
+
+    @app.after_request
+    def _finish_request_timer(response):
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            profiler.dump_stats(os.path.join(
+                PROFILE_DIR, f'{current_route()}-{int(time.time() * 1000)}-{os.getpid()}.prof'))
+        started = g.pop('request_started', None)
+        if started is not None:
+            request_duration.observe((current_route(), request.method, str(response.status_code)),
+                                     time.perf_counter() - started)
+        return response
+
+    json_encoder = app.json_encoder
+
+    class TimedJSONEncoder(json_encoder):
+        def encode(self, o):
+            with span('json_serialize'):
+                return self.untimed_encode(o)
+
+        def untimed_encode(self, o):
+            # Encoders installed later override this, so the span still covers their output
+            return super().encode(o)
+
+    app.json_encoder = TimedJSONEncoder
@@ -1,5 +1,140 @@
-from firebase_admin import auth
 from flask import request, jsonify
+from collections import OrderedDict
+import hashlib
+import hmac
+import ipaddress
+import logging
+import os
+import threading
+import time
+
+import fakes
+import providers
+from metrics import span
+
+TOKEN_CACHE_MAX_ENTRIES = int(os.getenv('TOKEN_CACHE_MAX_ENTRIES', '10000'))
+KEY_REFRESH_SECONDS = int(os.getenv('AUTH_KEY_REFRESH_SECONDS', '300'))
+# Bearer token for /metrics and the other operational endpoints; unset, they answer loopback only
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+# The key refresher reaches into firebase_admin's private token verifier, whose
+# layout was checked against these major versions (requirements.txt pins 6.2.0)
+KEY_REFRESH_SDK_MAJORS = (5, 6)
+
+logger = logging.getLogger(__name__)
+
+
+class VerifiedTokenCache:
+    """Bounded LRU of decoded claims keyed by token hash; entries expire with the token."""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, token_hash):
+        with self._lock:
+            entry = self._entries.get(token_hash)
+            if entry is None:
+                return None
+            claims, expires = entry
+            if expires <= time.time():
+                del self._entries[token_hash]
+                return None
+            self._entries.move_to_end(token_hash)
+            return claims
+
+    def set(self, token_hash, claims):
+        expires = claims.get('exp', 0)
+        if expires <= time.time():
+            return
+        with self._lock:
+            self._entries[token_hash] = (claims, expires)
+            self._entries.move_to_end(token_hash)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class KeyRefreshStats:
+    def __init__(self):
+        self.refreshed = 0
+        self.failed = 0
+        self.supported = True
+        self._lock = threading.Lock()
+
+    def record(self, succeeded):
+        with self._lock:
+            if succeeded:
+                self.refreshed += 1
+            else:
+                self.failed += 1
+
+    def stats(self):
+        with self._lock:
+            return {'refreshed': self.refreshed, 'failed': self.failed, 'supported': self.supported}
+
+
+token_cache = VerifiedTokenCache(TOKEN_CACHE_MAX_ENTRIES)
+key_refresh_stats = KeyRefreshStats()
+_refresher = {'pid': None}
+_refresher_lock = threading.Lock()
+
+
+def _signing_key_fetcher():
+    """Return a callable fetching Google's signing keys through firebase_admin's key cache.
+
+    firebase_admin requests the cert URL through a cache-control aware session,
+    so calling it keeps that cache warm and the refetch on key rotation happens
+    on the refresher thread instead of in a request. That session is private
+    API, so None is returned for SDK versions it was not checked against.
+    """
+    import firebase_admin
+    if int(firebase_admin.__version__.split('.')[0]) not in KEY_REFRESH_SDK_MAJORS:
+        return None
+    verifier = providers.firebase_auth()._get_client(None)._token_verifier
+    return lambda: verifier.request(verifier.id_token_verifier.cert_url, method='GET')
+
+
+def _key_refresh_loop():
+    fetch = None
+    while True:
+        try:
+            fetch = fetch or _signing_key_fetcher()
+            if fetch is None:
+                import firebase_admin
+                key_refresh_stats.supported = False
+                logger.warning("Signing key refresher disabled: firebase_admin %s is not a supported version",
+                               firebase_admin.__version__)
+                return
+            response = fetch()
+            if response.status != 200:
+                raise RuntimeError(f'signing key fetch returned HTTP {response.status}')
+            key_refresh_stats.record(True)
+        except Exception:
+            key_refresh_stats.record(False)
+            logger.exception("Refreshing Firebase signing keys failed")
+        time.sleep(KEY_REFRESH_SECONDS)
+
+
+def start_key_refresher():
+    pid = os.getpid()
+    if _refresher['pid'] == pid:
+        return
+    with _refresher_lock:
+        if _refresher['pid'] == pid:
+            return
+        threading.Thread(target=_key_refresh_loop, name='auth-key-refresh', daemon=True).start()
+        _refresher['pid'] = pid
+
+
+def verify_token(token):
+    token_hash = hashlib.sha256(token.encode('utf-8')).hexdigest()
+    claims = token_cache.get(token_hash)
+    if claims is None:
+        with span('firebase_auth.verify_token'):
+            claims = providers.verify_id_token(token)
+        token_cache.set(token_hash, claims)
+    return claims
+
 
 def verify_firebase_token(f):
     def wrapper(*args, **kwargs):
@@ -7,9 +142,11 @@ def verify_firebase_token(f):
         if not auth_header:
             return jsonify({'message': 'Missing Authorization Header'}), 401
 
+        if not fakes.ENABLED:
+            start_key_refresher()
         token = auth_header.replace('Bearer ', '')
         try:
-            decoded_token = auth.verify_id_token(token)
+            decoded_token = verify_token(token)
             request.user = decoded_token
         except Exception as e:
             return jsonify({'message': 'Invalid or expired token', 'error': str(e)}), 403
@@ -17,3 +154,33 @@ def verify_firebase_token(f):
         return f(*args, **kwargs)
     wrapper.__name__ = f.__name__
     return wrapper
+
+
+def is_caller(user_id):
+    """True when ``user_id`` is the signed-in user; call inside a verify_firebase_token route."""
+    return bool(user_id) and user_id == request.user.get('uid')
+
+
+def forbidden():
+    return jsonify({'error': "You can only access your own records"}), 403
+
+
+def _is_loopback(address):
+    try:
+        return ipaddress.ip_address(address or '').is_loopback
+    except ValueError:
+        return False
+
+
+def internal_only(f):
+    """Restrict an operational endpoint to the METRICS_TOKEN bearer, or to loopback without one."""
+    def wrapper(*args, **kwargs):
+        if METRICS_TOKEN:
+            supplied = request.headers.get('Authorization', '').replace('Bearer ', '', 1)
+            if not hmac.compare_digest(supplied.encode('utf-8'), METRICS_TOKEN.encode('utf-8')):
+                return jsonify({'message': 'Invalid metrics token'}), 403
+        elif not _is_loopback(request.remote_addr):
+            return jsonify({'message': 'Internal endpoint'}), 403
+        return f(*args, **kwargs)
+    wrapper.__name__ = f.__name__
+    return wrapper
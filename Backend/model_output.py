@@ -0,0 +1,341 @@
+"""Recovers structured data from free-form model responses.
+
+``find_json`` scans the text for balanced blocks, tracking bracket depth and
+string state, so nested arrays, prose before or after the payload, markdown
+fences and several candidate blocks are handled without regex backtracking.
+A well-formed payload is found in one pass; an opener that never balances
+costs a scan to where it fails, so text full of unclosed brackets is
+quadratic in the worst case. Each balanced block is
+cleaned of ``//`` comments and trailing commas (both of which the model copies
+from our prompt) before it is decoded. The validators then coerce the result
+into the shape the frontend expects or reject it.
+
+Run ``python model_output.py`` to check the parser against the corpus of
+malformed responses in data/malformed_responses.json.
+"""
+import json
+import os
+import sys
+
+CONFIDENCE_LEVELS = ('high', 'medium', 'low')
+URGENCY_LEVELS = ('high', 'medium', 'low')
+
+CORPUS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'malformed_responses.json')
+
+_CLOSERS = {'{': '}', '[': ']'}
+
+
+class ParseError(ValueError):
+    pass
+
+
+def _block_end(text, start):
+    """Return the index just past the block opened at ``start``, or None if it never balances."""
+    stack = [_CLOSERS[text[start]]]
+    in_string = False
+    escaped = False
+    i = start + 1
+    while i < len(text):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == '/' and text.startswith('//', i):
+            # Comments copied from the prompt may contain brackets of their own
+            i = text.find('\n', i)
+            if i == -1:
+                return None
+        elif ch in _CLOSERS:
+            stack.append(_CLOSERS[ch])
+        elif ch in '}]':
+            if ch != stack.pop():
+                return None
+            if not stack:
+                return i + 1
+        i += 1
+    return None
+
+
+def _balanced_blocks(text, openers):
+    """Yield (start, end) of each top-level balanced block that starts with one of ``openers``.
+
+    A block that balances is skipped over whole. When one does not, scanning
+    resumes at the next character, so each unbalanced opener rescans the text
+    up to its failure point.
+    """
+    i = 0
+    while i < len(text):
+        if text[i] in openers:
+            end = _block_end(text, i)
+            if end is not None:
+                yield i, end
+                i = end
+                continue
+        i += 1
+
+
+def _strip_comments_and_trailing_commas(block):
+    out = []
+    in_string = False
+    escaped = False
+    i = 0
+    n = len(block)
+    while i < n:
+        ch = block[i]
+        if in_string:
+            out.append(ch)
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+            out.append(ch)
+        elif ch == '/' and block.startswith('//', i):
+            while i < n and block[i] != '\n':
+                i += 1
+            continue
+        elif ch in '}]':
+            # Drop a comma that only has whitespace between it and this closer
+            j = len(out) - 1
+            while j >= 0 and out[j] in ' \t\r\n':
+                j -= 1
+            if j >= 0 and out[j] == ',':
+                del out[j]
+            out.append(ch)
+        else:
+            out.append(ch)
+        i += 1
+    return ''.join(out)
+
+
+def _decode(block):
+    try:
+        return json.loads(block)
+    except ValueError:
+        return json.loads(_strip_comments_and_trailing_commas(block))
+
+
+def find_json(text, openers='{[', accept=None):
+    """Return the first balanced JSON value in ``text`` that decodes (and passes ``accept``)."""
+    if not text:
+        raise ParseError('empty response')
+    for start, end in _balanced_blocks(text, openers):
+        try:
+            value = _decode(text[start:end])
+        except ValueError:
+            continue
+        if accept is None or accept(value):
+            return value
+    raise ParseError('no decodable JSON value found')
+
+
+def _symptom_payload(value):
+    if isinstance(value, dict):
+        value = value.get('symptoms')
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+
+def parse_symptom_list(text):
+    value = find_json(text, '[{', accept=_symptom_payload)
+    if isinstance(value, dict):
+        value = value['symptoms']
+    return [item.strip() for item in value if isinstance(item, str) and item.strip()]
+
+
+def _level(value, allowed, default):
+    value = str(value or '').strip().lower()
+    return value if value in allowed else default
+
+
+def _as_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ('true', 'yes', '1')
+
+
+def validate_ailment(ailment):
+    """Return one possibleAilments entry in canonical form, or None if it has no name."""
+    if isinstance(ailment, str):
+        ailment = {'name': ailment}
+    if not isinstance(ailment, dict) or not str(ailment.get('name') or '').strip():
+        return None
+    return {
+        'name': str(ailment['name']).strip(),
+        'confidence': _level(ailment.get('confidence'), CONFIDENCE_LEVELS, 'low'),
+        'description': str(ailment.get('description') or '').strip(),
+    }
+
+
+def validate_prediction(value):
+    """Coerce a decoded prediction into the possibleAilments/recommendations/urgency/shouldSeeDoctor shape."""
+    if not isinstance(value, dict):
+        raise ParseError('prediction must be a JSON object')
+    ailments = value.get('possibleAilments')
+    recommendations = value.get('recommendations')
+    if ailments is None and recommendations is None:
+        raise ParseError('prediction has neither possibleAilments nor recommendations')
+
+    if isinstance(ailments, dict):
+        ailments = [ailments]
+    possible_ailments = [a for a in map(validate_ailment, ailments or []) if a is not None]
+
+    if isinstance(recommendations, str):
+        recommendations = [recommendations]
+    return {
+        'possibleAilments': possible_ailments,
+        'recommendations': [str(r).strip() for r in recommendations or [] if str(r).strip()],
+        'urgency': _level(value.get('urgency'), URGENCY_LEVELS, 'medium'),
+        'shouldSeeDoctor': _as_bool(value.get('shouldSeeDoctor', False)),
+    }
+
+
+def parse_prediction(text):
+    return validate_prediction(find_json(
+        text, '{', accept=lambda v: 'possibleAilments' in v or 'recommendations' in v))
+
+
+def _case_number(entry):
+    try:
+        return int(entry.get('case'))
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_prediction_batch(text, count=None):
+    """Parse a packed ``{"results": [{"case": n, ...}]}`` answer into one prediction per case.
+
+    Entries are placed by their case number, or by position when none carry
+    one; cases that are missing or fail validation come back as None.
+    """
+    value = find_json(text, '{[', accept=lambda v: isinstance(v, list) or 'results' in v)
+    entries = value if isinstance(value, list) else value.get('results')
+    if not isinstance(entries, list):
+        raise ParseError('results must be a JSON array')
+    entries = [entry for entry in entries if isinstance(entry, dict)]
+    count = len(entries) if count is None else count
+    predictions = [None] * count
+    numbered = [(_case_number(entry), entry) for entry in entries]
+    if all(number is None for number, _ in numbered):
+        numbered = [(position, entry) for position, entry in enumerate(entries, 1)]
+    for number, entry in numbered:
+        if number is None or not 1 <= number <= count or predictions[number - 1] is not None:
+            continue
+        try:
+            predictions[number - 1] = validate_prediction(entry)
+        except ParseError:
+            pass
+    return predictions
+
+
+class AilmentStream:
+    """Incremental parser that yields each possibleAilments element as soon as it is complete.
+
+    Feed it the streamed text chunks in order; it keeps its scan position and
+    string/bracket state between calls, so every character is examined once.
+    The full prediction should still be parsed from the joined text at the end.
+    """
+
+    KEY = '"possibleAilments"'
+
+    def __init__(self):
+        self._text = ''
+        self._pos = 0
+        self._state = 'key'
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._element_start = None
+
+    def feed(self, chunk):
+        self._text += chunk
+        ailments = []
+        text = self._text
+        while self._pos < len(text) and self._state != 'done':
+            if self._state == 'key':
+                found = text.find(self.KEY, self._pos)
+                if found == -1:
+                    # Keep enough tail to match a key split across chunks
+                    self._pos = max(self._pos, len(text) - len(self.KEY))
+                    break
+                self._pos = found + len(self.KEY)
+                self._state = 'array'
+                continue
+            ch = text[self._pos]
+            self._pos += 1
+            if self._state == 'array':
+                if ch == '[':
+                    self._state = 'elements'
+                elif ch not in ': \t\r\n':
+                    self._state = 'done'
+                continue
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == '\\':
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+                if self._depth == 0:
+                    self._element_start = self._pos - 1
+            elif ch in '{[':
+                if self._depth == 0:
+                    self._element_start = self._pos - 1
+                self._depth += 1
+            elif ch in '}]':
+                if self._depth == 0:
+                    ailments.extend(self._emit(self._pos - 1))
+                    self._state = 'done'
+                    continue
+                self._depth -= 1
+                if self._depth == 0:
+                    ailments.extend(self._emit(self._pos))
+            elif ch == ',' and self._depth == 0 and self._element_start is not None:
+                # A bare string element ends at the separating comma
+                ailments.extend(self._emit(self._pos - 1))
+        return ailments
+
+    def _emit(self, end):
+        start, self._element_start = self._element_start, None
+        if start is None:
+            return []
+        try:
+            ailment = validate_ailment(_decode(self._text[start:end]))
+        except ValueError:
+            return []
+        return [ailment] if ailment is not None else []
+
+
+def check_corpus(path=CORPUS_PATH):
+    """Parse every corpus entry and return the names of the ones that do not match expectations."""
+    with open(path, 'r', encoding='utf-8') as f:
+        corpus = json.load(f)
+    parsers = {'symptoms': parse_symptom_list, 'prediction': parse_prediction,
+               'prediction-batch': parse_prediction_batch}
+    failures = []
+    for case in corpus:
+        try:
+            result = parsers[case['kind']](case['text'], *case.get('args', ()))
+        except ParseError:
+            result = None
+        if result != case['expect']:
+            failures.append(case['name'])
+    return len(corpus), failures
+
+
+if __name__ == '__main__':
+    total, failed = check_corpus()
+    for name in failed:
+        print(f'FAIL {name}')
+    print(f'{total - len(failed)}/{total} corpus responses parsed as expected')
+    sys.exit(1 if failed else 0)
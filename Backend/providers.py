@@ -0,0 +1,124 @@
+"""Single switch point between the live provider SDKs and the offline fakes.
+
+The SDKs are imported and configured on first use rather than at startup, so
+a cold serverless instance serving /firebase-config or /api/auth/login never
+loads AssemblyAI, Gemini or the Firebase Admin SDK. Set PROVIDER_WARMUP=1 to
+load them on a background thread right after startup instead.
+"""
+import importlib
+import os
+import threading
+
+import fakes
+import firebase_config
+import repository
+import resilience
+from metrics import span
+
+SIGN_IN_URL = "https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword?key={api_key}"
+
+# Native JSON output needs google-generativeai>=0.5 (response_mime_type); off by default for the pinned SDK
+GEMINI_JSON_MODE = os.getenv('GEMINI_JSON_MODE', '0') == '1'
+WARMUP_ENABLED = os.getenv('PROVIDER_WARMUP', '0') == '1'
+
+_sdks = {}
+_sdk_lock = threading.Lock()
+
+
+def _configure_assemblyai(module):
+    module.settings.api_key = os.getenv('ASSEMBLYAI_API_KEY')
+    module.settings.http_timeout = resilience.assemblyai.timeout
+
+
+def _configure_genai(module):
+    module.configure(api_key=os.getenv("GEMINI_API_KEY"))
+
+
+def _configure_firebase_auth(module):
+    firebase_config.initialize()
+
+
+_CONFIGURE = {
+    'assemblyai': _configure_assemblyai,
+    'google.generativeai': _configure_genai,
+    'firebase_admin.auth': _configure_firebase_auth,
+}
+
+
+def _sdk(name):
+    module = _sdks.get(name)
+    if module is not None:
+        return module
+    with _sdk_lock:
+        module = _sdks.get(name)
+        if module is None:
+            with span(f'import.{name}'):
+                module = importlib.import_module(name)
+                _CONFIGURE[name](module)
+            _sdks[name] = module
+    return module
+
+
+def assemblyai():
+    return _sdk('assemblyai')
+
+
+def genai():
+    return _sdk('google.generativeai')
+
+
+def firebase_auth():
+    return _sdk('firebase_admin.auth')
+
+
+def warm_up():
+    """Import the SDKs and build the Firestore client on a daemon thread."""
+    def _load():
+        # The fakes only borrow AssemblyAI's status enum
+        for name in ('assemblyai',) if fakes.ENABLED else tuple(_CONFIGURE):
+            _sdk(name)
+        repository.get_db()
+
+    threading.Thread(target=_load, name='provider-warmup', daemon=True).start()
+
+
+def get_transcriber():
+    if fakes.ENABLED:
+        return fakes.FakeTranscriber()
+    return assemblyai().Transcriber()
+
+
+def get_model(model_name):
+    if fakes.ENABLED:
+        return fakes.FakeGenerativeModel(model_name)
+    return genai().GenerativeModel(model_name)
+
+
+def json_generation_config():
+    return {'response_mime_type': 'application/json'} if GEMINI_JSON_MODE else None
+
+
+def _sign_in(api_key, email, password):
+    if fakes.ENABLED:
+        return fakes.sign_in_with_password(email, password)
+    payload = {
+        "email": email,
+        "password": password,
+        "returnSecureToken": True
+    }
+    response = repository.get_http_session().post(SIGN_IN_URL.format(api_key=api_key), json=payload,
+                                                  timeout=resilience.firebase_auth.timeout)
+    if response.status_code == 429 or response.status_code >= 500:
+        response.raise_for_status()
+    return response.json()
+
+
+def sign_in_with_password(api_key, email, password):
+    with span('firebase_auth.sign_in'):
+        return resilience.firebase_auth.call(lambda: _sign_in(api_key, email, password))
+
+
+def verify_id_token(token):
+    if fakes.ENABLED:
+        return fakes.verify_id_token(token)
+    return firebase_auth().verify_id_token(token)
@@ -0,0 +1,379 @@
+"""Offline re-scoring of stored predictions after a prompt or model change.
+
+Walks userSymptoms in document-id order one page at a time, so memory stays
+flat however large the collection is. Records whose predictionVersion is
+already current are skipped, fallback predictions never are; the rest are
+sent to Gemini several cases per prompt through a bounded pool with its own
+rate limit, timeout and circuit breaker, so a run neither floods the
+provider nor shares failure state with the API. Identical (symptoms, medical
+context) inputs are scored once.
+
+Each page's results are written back in batched writes together with the
+summary documents that show them, and the page cursor is then saved to the
+checkpoint file. An interrupted run continues from there with --resume;
+records of the unfinished page that were already written are skipped by
+their version. Records that could not be scored keep their old prediction
+and are picked up by the next run.
+
+    python reanalyze.py --dry-run --limit 500 --diff-out diff.jsonl   # preview what would change
+    python reanalyze.py --checkpoint rescore.json                      # re-score every record
+    python reanalyze.py --checkpoint rescore.json --resume             # continue an interrupted run
+"""
+import argparse
+import datetime
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import providers
+import repository
+import resilience
+import summaries
+from app import GEMINI_MODEL, PREDICTION_VERSION, UNABLE_TO_ANALYZE, build_predict_prompt, build_batch_predict_prompt
+from llm_cache import response_cache
+from model_output import parse_prediction, parse_prediction_batch, ParseError
+from resilience import CircuitOpen, ProviderUnavailable
+
+SCAN_FIELDS = ('userId', 'symptoms', 'prediction', 'predictionVersion')
+# Firestore rejects batches of more than 500 writes
+MAX_BATCH_WRITES = 500
+MAX_CIRCUIT_WAITS = 3
+
+
+class RateLimiter:
+    """Token bucket shared by the worker threads; ``rate`` <= 0 disables it."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        # A bucket smaller than one token could never pay for a call
+        self.capacity = max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class Rescorer:
+    def __init__(self, provider, pack_size=8, concurrency=8, max_rps=5.0, use_cache=True):
+        self.provider = provider
+        self.pack_size = max(1, pack_size)
+        self.limiter = RateLimiter(max_rps)
+        self.use_cache = use_cache
+        self.model = providers.get_model(GEMINI_MODEL)
+        self._pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='rescore')
+        self._lock = threading.Lock()
+        self.counts = dict.fromkeys(('modelCalls', 'packedCalls', 'singleCalls', 'packMisses',
+                                     'cacheHits', 'duplicates', 'unscored'), 0)
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self.counts[name] += amount
+
+    def _generate(self, prompt):
+        """Return the model's text, or None once the provider keeps failing."""
+        for _ in range(MAX_CIRCUIT_WAITS + 1):
+            self.limiter.acquire()
+            try:
+                response = self.provider.call(lambda: self.model.generate_content(
+                    prompt, generation_config=providers.json_generation_config()))
+            except CircuitOpen:
+                # Let the provider recover instead of failing the rest of the page
+                time.sleep(self.provider.reset_seconds)
+                continue
+            except ProviderUnavailable:
+                return None
+            self._count('modelCalls')
+            return getattr(response, 'text', None)
+        return None
+
+    def _score_one(self, case):
+        self._count('singleCalls')
+        text = self._generate(case['prompt'])
+        try:
+            return parse_prediction(text) if text else None
+        except ParseError:
+            return None
+
+    def _score_pack(self, pack):
+        if len(pack) == 1:
+            return [self._score_one(pack[0])]
+        self._count('packedCalls')
+        text = self._generate(build_batch_predict_prompt([(c['symptoms'], c['medicalInfo']) for c in pack]))
+        try:
+            predictions = parse_prediction_batch(text, len(pack)) if text else [None] * len(pack)
+        except ParseError:
+            predictions = [None] * len(pack)
+        if text is None:
+            return predictions
+        # Cases the packed answer dropped or garbled get a prompt of their own
+        missed = [i for i, prediction in enumerate(predictions) if prediction is None]
+        self._count('packMisses', len(missed))
+        for i in missed:
+            predictions[i] = self._score_one(pack[i])
+        return predictions
+
+    def score(self, cases):
+        """Return one prediction (or None when it could not be scored) per (symptoms, medical_info)."""
+        by_key = {}
+        keys = []
+        for symptoms, medical_info in cases:
+            key, prompt = build_predict_prompt(symptoms, medical_info)
+            keys.append(key)
+            if key in by_key:
+                self._count('duplicates')
+                continue
+            by_key[key] = {'symptoms': symptoms, 'medicalInfo': medical_info, 'prompt': prompt}
+
+        results = {}
+        pending = []
+        for key, case in by_key.items():
+            cached = response_cache.get(key) if self.use_cache else None
+            if cached is not None:
+                self._count('cacheHits')
+                results[key] = cached
+            else:
+                case['key'] = key
+                pending.append(case)
+
+        packs = [pending[i:i + self.pack_size] for i in range(0, len(pending), self.pack_size)]
+        for pack, predictions in zip(packs, self._pool.map(self._score_pack, packs)):
+            for case, prediction in zip(pack, predictions):
+                results[case['key']] = prediction
+                if prediction is None:
+                    self._count('unscored')
+                elif self.use_cache:
+                    response_cache.set(case['key'], prediction)
+        return [results[key] for key in keys]
+
+    def close(self):
+        self._pool.shutdown()
+
+
+class BatchWriter:
+    """Collects writes and commits them in batches of at most ``max_writes``."""
+
+    def __init__(self, max_writes=MAX_BATCH_WRITES):
+        self.max_writes = max_writes
+        self.commits = 0
+        self._batch = None
+        self._size = 0
+
+    def _next(self):
+        if self._batch is None:
+            self._batch = repository.batch()
+        self._size += 1
+        return self._batch
+
+    def update(self, ref, fields):
+        self._next().update(ref, fields)
+        if self._size >= self.max_writes:
+            self.flush()
+
+    def merge(self, ref, fields):
+        self._next().set(ref, fields, merge=True)
+        if self._size >= self.max_writes:
+            self.flush()
+
+    def flush(self):
+        if self._batch is not None:
+            repository.commit(self._batch)
+            self.commits += 1
+        self._batch = None
+        self._size = 0
+
+
+def headline(prediction):
+    """The parts of a prediction a patient acts on, for diffing."""
+    prediction = prediction or {}
+    ailments = prediction.get('possibleAilments') or []
+    top = max(ailments, key=lambda a: summaries.CONFIDENCE_ORDER.get(a.get('confidence', 'low'), 0)) \
+        if ailments else {}
+    return {'topAilment': top.get('name'), 'urgency': prediction.get('urgency'),
+            'shouldSeeDoctor': prediction.get('shouldSeeDoctor')}
+
+
+def load_checkpoint(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        checkpoint = json.load(f)
+    if checkpoint.get('predictionVersion') != PREDICTION_VERSION:
+        raise SystemExit(f"{path} was written for {checkpoint.get('predictionVersion')}, "
+                         f"not {PREDICTION_VERSION}; start without --resume")
+    return checkpoint
+
+
+def save_checkpoint(path, page_token, counts):
+    checkpoint = {
+        'predictionVersion': PREDICTION_VERSION,
+        'pageToken': page_token,
+        'counts': counts,
+        'updatedAt': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _needs_rescore(data, force):
+    # Fallback predictions are re-scored whatever version they were stamped with
+    return bool(data.get('symptoms')) and bool(data.get('prediction')) and \
+        (force or data.get('predictionVersion') != PREDICTION_VERSION or data['prediction'] == UNABLE_TO_ANALYZE)
+
+
+def process_page(docs, rescorer, writer, force, dry_run, diff_file, counts, show):
+    records = [(doc.id, doc.to_dict()) for doc in docs]
+    counts['scanned'] += len(records)
+    records = [(symptom_id, data) for symptom_id, data in records if _needs_rescore(data, force)]
+    counts['skipped'] += len(docs) - len(records)
+    if not records:
+        return
+
+    user_ids = sorted({data.get('userId') for _, data in records if data.get('userId')})
+    refs = [repository.user_ref(u) for u in user_ids] + [repository.summary_ref(u) for u in user_ids]
+    loaded = repository.get_many(*refs) if refs else []
+    medical_infos = {u: info or {} for u, info in zip(user_ids, loaded[:len(user_ids)])}
+    user_summaries = {u: summary for u, summary in zip(user_ids, loaded[len(user_ids):]) if summary}
+
+    predictions = rescorer.score([(data['symptoms'], medical_infos.get(data.get('userId'), {}))
+                                  for _, data in records])
+
+    summary_fields = {}
+    for (symptom_id, data), prediction in zip(records, predictions):
+        if prediction is None:
+            counts['failed'] += 1
+            continue
+        counts['rescored'] += 1
+        user_id = data.get('userId')
+        before, after = headline(data.get('prediction')), headline(prediction)
+        if before != after:
+            counts['changed'] += 1
+            if diff_file is not None:
+                diff_file.write(json.dumps({'symptomId': symptom_id, 'userId': user_id,
+                                            'before': before, 'after': after}) + '\n')
+            if dry_run and counts['changed'] <= show:
+                changes = ', '.join(f'{k} {before[k]!r} -> {after[k]!r}' for k in after if before[k] != after[k])
+                print(f'  {symptom_id}: {changes}')
+        if dry_run:
+            continue
+        writer.update(repository.symptom_ref(symptom_id), {
+            'prediction': prediction,
+            'predictionVersion': PREDICTION_VERSION,
+            'rescoredAt': repository.server_timestamp(),
+        })
+        summary = user_summaries.get(user_id)
+        fields = summaries.prediction_rescored(summary, user_id, symptom_id, prediction) if summary else None
+        if fields:
+            # Later records of the same user build on the fields staged for earlier ones
+            summary.update(fields)
+            summary_fields.setdefault(user_id, {}).update(fields)
+
+    for user_id, fields in summary_fields.items():
+        writer.merge(repository.summary_ref(user_id), fields)
+    writer.flush()
+
+
+def _progress(counts, initial, rescorer, started):
+    # Totals include earlier runs of a resumed job; rates cover this run only
+    elapsed = max(time.monotonic() - started, 1e-9)
+    calls = rescorer.counts['modelCalls']
+    scanned, rescored = counts['scanned'] - initial['scanned'], counts['rescored'] - initial['rescored']
+    return (f"scanned {counts['scanned']}, rescored {counts['rescored']}, changed {counts['changed']}, "
+            f"skipped {counts['skipped']}, failed {counts['failed']} | "
+            f"{scanned / elapsed:.1f} scanned/s, {rescored / elapsed:.1f} rescored/s, "
+            f"{calls / elapsed:.2f} model calls/s ({calls} calls, {rescorer.counts['cacheHits']} cache hits, "
+            f"{rescorer.counts['duplicates']} duplicates)")
+
+
+def run(args):
+    if args.resume and not args.checkpoint:
+        raise SystemExit('--resume needs --checkpoint')
+    counts = dict.fromkeys(('pages', 'scanned', 'skipped', 'rescored', 'changed', 'failed'), 0)
+    page_token = None
+    if args.resume:
+        checkpoint = load_checkpoint(args.checkpoint)
+        page_token = checkpoint['pageToken']
+        counts.update(checkpoint.get('counts', {}))
+        if page_token is None:
+            print(f'{args.checkpoint} records a finished run')
+            return counts
+
+    provider = resilience.Provider('gemini_batch', timeout=args.timeout, retries=args.retries,
+                                   failure_threshold=args.breaker_failures, reset_seconds=args.breaker_reset)
+    rescorer = Rescorer(provider, pack_size=args.pack_size, concurrency=args.concurrency,
+                        max_rps=args.max_rps, use_cache=not args.no_cache)
+    writer = BatchWriter(args.write_batch)
+    diff_file = open(args.diff_out, 'a', encoding='utf-8') if args.diff_out else None
+    started = time.monotonic()
+    initial = dict(counts)
+    print(f"{'Dry run: ' if args.dry_run else ''}re-scoring to {PREDICTION_VERSION}")
+    try:
+        while True:
+            page_size = args.page_size
+            if args.limit:
+                page_size = min(page_size, args.limit - (counts['scanned'] - initial['scanned']))
+                if page_size <= 0:
+                    break
+            docs, next_token = repository.fetch_page(repository.all_symptoms_query(), repository.USER_SYMPTOMS,
+                                                     page_size, page_token, fields=SCAN_FIELDS)
+            process_page(docs, rescorer, writer, args.force, args.dry_run, diff_file, counts, args.show)
+            counts['pages'] += 1
+            page_token = next_token
+            if args.checkpoint and not args.dry_run:
+                save_checkpoint(args.checkpoint, page_token, counts)
+            if counts['pages'] % args.progress_every == 0 or page_token is None:
+                print(f"[page {counts['pages']}] {_progress(counts, initial, rescorer, started)}")
+            if page_token is None:
+                break
+    finally:
+        rescorer.close()
+        if diff_file is not None:
+            diff_file.close()
+
+    print(f"done in {time.monotonic() - started:.1f}s: {_progress(counts, initial, rescorer, started)}; "
+          f"{rescorer.counts['packedCalls']} packed and {rescorer.counts['singleCalls']} single prompts, "
+          f"{rescorer.counts['packMisses']} pack misses, {writer.commits} batch commits")
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--page-size', type=int, default=300, help='symptom records read per page')
+    parser.add_argument('--pack-size', type=int, default=8, help='cases per model prompt (1 disables packing)')
+    parser.add_argument('--concurrency', type=int, default=8, help='model prompts in flight')
+    parser.add_argument('--max-rps', type=float, default=5.0, help='model prompts started per second (0: no limit)')
+    parser.add_argument('--timeout', type=float, default=60.0, help='seconds per model attempt')
+    parser.add_argument('--retries', type=int, default=3)
+    parser.add_argument('--breaker-failures', type=int, default=5)
+    parser.add_argument('--breaker-reset', type=float, default=30.0)
+    parser.add_argument('--write-batch', type=int, default=400, help=f'writes per batch (at most {MAX_BATCH_WRITES})')
+    parser.add_argument('--checkpoint', help='file that records the page cursor after each page')
+    parser.add_argument('--resume', action='store_true', help='continue from the cursor in --checkpoint')
+    parser.add_argument('--dry-run', action='store_true', help='score but do not write; report what would change')
+    parser.add_argument('--diff-out', help='append one JSON line per changed prediction to this file')
+    parser.add_argument('--show', type=int, default=20, help='changes printed in a dry run')
+    parser.add_argument('--limit', type=int, default=0, help='stop after scanning this many records')
+    parser.add_argument('--force', action='store_true', help='re-score records already at the current version')
+    parser.add_argument('--no-cache', action='store_true', help='ignore and do not fill the prediction cache')
+    parser.add_argument('--progress-every', type=int, default=10, help='pages between progress lines')
+    args = parser.parse_args()
+    args.write_batch = min(args.write_batch, MAX_BATCH_WRITES)
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+import base64
+import binascii
+import os
+import threading
+
+import fakes
+import firebase_config
+import resilience
+from metrics import span
+
+USERS = 'users'
+MEDICAL_INFORMATION = 'medicalInformation'
+USER_SYMPTOMS = 'userSymptoms'
+HEALTH_REPORTS = 'healthReports'
+APPOINTMENTS = 'appointments'
+USER_SUMMARIES = 'userSummaries'
+SLOT_BOOKINGS = 'slotBookings'
+
+_lock = threading.Lock()
+_clients = {'pid': None, 'db': None, 'http': None}
+
+
+def firestore_module():
+    # The Firestore SDK takes a large share of cold-start time, so it is only
+    # imported by the first request that touches the database.
+    from google.cloud import firestore
+    return firestore
+
+
+def server_timestamp():
+    return firestore_module().SERVER_TIMESTAMP
+
+
+def _ensure_clients():
+    # gRPC channels and pooled sockets must not cross a fork (gunicorn --preload),
+    # so clients are created lazily and rebuilt when the process id changes.
+    pid = os.getpid()
+    if _clients['pid'] == pid:
+        return
+    with _lock:
+        if _clients['pid'] == pid:
+            return
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        if fakes.ENABLED:
+            db = fakes.firestore_client
+        else:
+            app = firebase_config.initialize()
+            db = firestore_module().Client(credentials=app.credential.get_credential(), project=app.project_id)
+
+        http = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=4,
+            pool_maxsize=int(os.getenv('HTTP_POOL_MAXSIZE', '16'))
+        )
+        http.mount('https://', adapter)
+
+        _clients.update(pid=pid, db=db, http=http)
+
+
+def get_db():
+    _ensure_clients()
+    return _clients['db']
+
+
+def get_http_session():
+    _ensure_clients()
+    return _clients['http']
+
+
+def batch():
+    return get_db().batch()
+
+
+def _timeout():
+    return resilience.timeout_for(resilience.FIRESTORE_TIMEOUT_SECONDS, 'firestore')
+
+
+def commit(write_batch):
+    with span('firestore.batch_commit'):
+        return write_batch.commit(timeout=_timeout())
+
+
+class InvalidPageToken(ValueError):
+    pass
+
+
+def encode_page_token(doc_id):
+    return base64.urlsafe_b64encode(doc_id.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_page_token(token):
+    try:
+        return base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode('utf-8')
+    except (binascii.Error, UnicodeDecodeError):
+        raise InvalidPageToken('Invalid page token')
+
+
+def fetch_page(query, collection_name, page_size, page_token=None, fields=None):
+    """Run ``query`` for one page and return (snapshots, next_page_token).
+
+    The page token is the opaque id of the last document on the previous
+    page; ``fields`` restricts the returned document fields server-side.
+    """
+    if page_token:
+        with span(f'firestore.get.{collection_name}'):
+            cursor = get_db().collection(collection_name).document(decode_page_token(page_token)).get(
+                timeout=_timeout())
+        if not cursor.exists:
+            raise InvalidPageToken('Invalid page token')
+        query = query.start_after(cursor)
+    if fields:
+        query = query.select(fields)
+    # One extra document tells us whether another page exists
+    with span(f'firestore.query.{collection_name}'):
+        docs = list(query.limit(page_size + 1).stream(timeout=_timeout()))
+    next_token = encode_page_token(docs[page_size - 1].id) if len(docs) > page_size else None
+    return docs[:page_size], next_token
+
+
+def _to_dict(doc):
+    return doc.to_dict() if doc is not None and doc.exists else None
+
+
+def get_many(*refs):
+    """Fetch several documents in one batched round trip.
+
+    Returns their data in the order of ``refs``, with None for missing docs.
+    """
+    with span('firestore.get_all'):
+        docs = {doc.reference.path: doc for doc in get_db().get_all(list(refs), timeout=_timeout())}
+    return [_to_dict(docs.get(ref.path)) for ref in refs]
+
+
+# users / medicalInformation
+
+def user_ref(user_id):
+    return get_db().collection(USERS).document(user_id)
+
+
+def medical_info_ref(user_id):
+    return get_db().collection(MEDICAL_INFORMATION).document(user_id)
+
+
+def _get(ref, collection_name):
+    with span(f'firestore.get.{collection_name}'):
+        return _to_dict(ref.get(timeout=_timeout()))
+
+
+def get_user(user_id):
+    return _get(user_ref(user_id), USERS)
+
+
+def get_medical_info(user_id):
+    return _get(medical_info_ref(user_id), MEDICAL_INFORMATION)
+
+
+# userSymptoms
+
+def symptom_ref(symptom_id=None):
+    collection = get_db().collection(USER_SYMPTOMS)
+    return collection.document(symptom_id) if symptom_id else collection.document()
+
+
+def get_symptom(symptom_id):
+    return _get(symptom_ref(symptom_id), USER_SYMPTOMS)
+
+
+def add_symptom(data):
+    with span(f'firestore.add.{USER_SYMPTOMS}'):
+        _, doc_ref = get_db().collection(USER_SYMPTOMS).add(data)
+    return doc_ref.id
+
+
+def all_symptoms_query():
+    # Unordered collection queries run in document-id order, which the page cursors rely on
+    return get_db().collection(USER_SYMPTOMS)
+
+
+def symptoms_query(user_id):
+    return (get_db().collection(USER_SYMPTOMS)
+            .where('userId', '==', user_id)
+            .order_by('created', direction=firestore_module().Query.DESCENDING))
+
+
+# healthReports
+
+def health_report_ref(report_id):
+    return get_db().collection(HEALTH_REPORTS).document(report_id)
+
+
+def get_health_report(report_id):
+    return _get(health_report_ref(report_id), HEALTH_REPORTS)
+
+
+def _create(ref, collection_name, data, write_batch=None):
+    """Create ``ref`` only if it does not exist yet; return False if it already did.
+
+    Other writes staged on ``write_batch`` commit with it or not at all.
+    """
+    from google.api_core.exceptions import AlreadyExists
+    write_batch = write_batch or batch()
+    write_batch.create(ref, data)
+    try:
+        with span(f'firestore.create.{collection_name}'):
+            write_batch.commit(timeout=_timeout())
+    except AlreadyExists:
+        return False
+    return True
+
+
+def create_health_report(report_id, data, write_batch=None):
+    return _create(health_report_ref(report_id), HEALTH_REPORTS, data, write_batch)
+
+
+def health_reports_query(user_id):
+    return get_db().collection(HEALTH_REPORTS).where('userId', '==', user_id)
+
+
+# appointments
+
+def appointment_ref(appointment_id=None):
+    collection = get_db().collection(APPOINTMENTS)
+    return collection.document(appointment_id) if appointment_id else collection.document()
+
+
+def add_appointment(data):
+    with span(f'firestore.add.{APPOINTMENTS}'):
+        _, doc_ref = get_db().collection(APPOINTMENTS).add(data)
+    return doc_ref.id
+
+
+def slot_booking_ref(key):
+    return get_db().collection(SLOT_BOOKINGS).document(key)
+
+
+def create_slot_booking(key, data, write_batch=None):
+    """Claim a slot; False when another booking already holds it."""
+    return _create(slot_booking_ref(key), SLOT_BOOKINGS, data, write_batch)
+
+
+def booked_slots(date):
+    """Return (clinicianId, minute) pairs booked on ``date``."""
+    query = get_db().collection(SLOT_BOOKINGS).where('date', '==', date).select(['clinicianId', 'minute'])
+    with span(f'firestore.query.{SLOT_BOOKINGS}'):
+        return [(doc.get('clinicianId'), doc.get('minute')) for doc in query.stream(timeout=_timeout())]
+
+
+def appointments_query(user_id):
+    return (get_db().collection(APPOINTMENTS)
+            .where('userId', '==', user_id)
+            .order_by('createdAt', direction=firestore_module().Query.DESCENDING))
+
+
+# userSummaries
+
+def summary_ref(user_id):
+    return get_db().collection(USER_SUMMARIES).document(user_id)
+
+
+def get_summary(user_id):
+    return _get(summary_ref(user_id), USER_SUMMARIES)
+
+
+def set_summary(user_id, data):
+    with span(f'firestore.set.{USER_SUMMARIES}'):
+        summary_ref(user_id).set(data)
@@ -0,0 +1,381 @@
+"""Deadlines, retries, hedging and circuit breakers for outbound provider calls.
+
+Each request gets a deadline (REQUEST_DEADLINE_SECONDS, overridable per
+endpoint) and every provider attempt is bounded by the smaller of the
+provider's own timeout and what is left of that deadline. Calls run on a
+bounded pool so a hung SDK call releases the request thread when its
+timeout passes, even when the SDK itself has no timeout parameter.
+
+Transient failures (timeouts, connection errors, 429/5xx-style errors) are
+retried with full-jitter exponential backoff. Idempotent calls to a provider
+with hedging enabled send a second identical request once the first has run
+longer than the provider's recent p95, and use whichever answers first.
+After ``failure_threshold`` consecutive transient failures a provider's
+circuit opens and calls fail fast with CircuitOpen until ``reset_seconds``
+pass, when a single probe call is let through. Callers catch
+ProviderUnavailable to serve their fallback.
+
+Each provider runs its calls, hedges and stream pumps on its own executor of
+``max_concurrency`` workers, a bulkhead: a hung AssemblyAI upload or a burst
+of Gemini hedges can exhaust only that provider's workers. Hedges are only
+sent while the provider has an idle worker.
+"""
+import contextvars
+import math
+import os
+import queue
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+REQUEST_DEADLINE_SECONDS = float(os.getenv('REQUEST_DEADLINE_SECONDS', '25'))
+# Endpoints whose work legitimately takes longer than the default deadline
+ENDPOINT_DEADLINES = {
+    'transcribe_audio': float(os.getenv('TRANSCRIBE_DEADLINE_SECONDS', '120')),
+    'transcribe_audio_upload': float(os.getenv('TRANSCRIBE_DEADLINE_SECONDS', '120')),
+    'transcribe_audio_stream': float(os.getenv('TRANSCRIBE_DEADLINE_SECONDS', '120')),
+    'voice_consultation': float(os.getenv('TRANSCRIBE_DEADLINE_SECONDS', '120')),
+    'stream_job_events': None,
+}
+
+BACKOFF_BASE_SECONDS = float(os.getenv('RETRY_BACKOFF_BASE_SECONDS', '0.2'))
+BACKOFF_CAP_SECONDS = float(os.getenv('RETRY_BACKOFF_CAP_SECONDS', '2'))
+HEDGE_MIN_SECONDS = float(os.getenv('HEDGE_MIN_SECONDS', '0.5'))
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+# Matched against the exception's class hierarchy so the SDKs need not be imported here
+RETRYABLE_ERRORS = {'TimeoutError', 'ConnectionError', 'ServiceUnavailable', 'DeadlineExceeded',
+                    'InternalServerError', 'TooManyRequests', 'ResourceExhausted', 'BadGateway',
+                    'GatewayTimeout', 'Timeout', 'RetryError'}
+
+_deadline = contextvars.ContextVar('deadline', default=None)
+
+
+class ProviderUnavailable(Exception):
+    def __init__(self, provider, reason):
+        super().__init__(f'{provider} unavailable: {reason}')
+        self.provider = provider
+
+
+class CircuitOpen(ProviderUnavailable):
+    pass
+
+
+class DeadlineExceeded(ProviderUnavailable):
+    pass
+
+
+class AttemptTimeout(TimeoutError):
+    pass
+
+
+def set_deadline(seconds):
+    _deadline.set(time.monotonic() + seconds if seconds else None)
+
+
+def remaining():
+    """Seconds left before the current request's deadline, or None without one."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def timeout_for(limit, provider='request'):
+    """``limit`` capped by the request deadline; raises DeadlineExceeded once it has passed."""
+    left = remaining()
+    if left is None:
+        return limit
+    if left <= 0:
+        raise DeadlineExceeded(provider, 'request deadline exceeded')
+    return min(limit, left)
+
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+def is_retryable(error):
+    if any(cls.__name__ in RETRYABLE_ERRORS for cls in type(error).__mro__):
+        return True
+    # requests.HTTPError carries the response, google.api_core errors an integer code
+    status = getattr(getattr(error, 'response', None), 'status_code', None) or getattr(error, 'code', None)
+    return status in RETRYABLE_STATUS
+
+
+class Provider:
+    def __init__(self, name, timeout, retries=0, hedge=False, failure_threshold=5, reset_seconds=30,
+                 max_concurrency=16):
+        self.name = name
+        self.timeout = timeout
+        self.retries = retries
+        self.hedge = hedge
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.max_concurrency = max_concurrency
+        self._pool = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix=f'{name}-call')
+        self._in_flight = 0
+        self._latencies = deque(maxlen=LATENCY_WINDOW)
+        self._lock = threading.Lock()
+        self._consecutive_failures = 0
+        self._opened_at = None
+        self._probing = False
+        self.counts = dict.fromkeys(('calls', 'successes', 'failures', 'timeouts', 'retries', 'hedged',
+                                     'hedgeWins', 'shortCircuited', 'fallbacks'), 0)
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def _allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < self.reset_seconds:
+                return False
+            # Half-open: one probe decides whether the circuit closes again
+            self._probing = True
+            return True
+
+    def _record_success(self, latency=None):
+        with self._lock:
+            self._consecutive_failures = 0
+            self._opened_at = None
+            self._probing = False
+            if latency is not None:
+                self._latencies.append(latency)
+
+    def _record_failure(self):
+        with self._lock:
+            self._consecutive_failures += 1
+            if self._probing or self._consecutive_failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+            self._probing = False
+
+    def _release_probe(self):
+        with self._lock:
+            self._probing = False
+
+    def _submit(self, fn):
+        with self._lock:
+            self._in_flight += 1
+        future = self._pool.submit(fn)
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, future):
+        with self._lock:
+            self._in_flight -= 1
+
+    def _has_idle_worker(self):
+        with self._lock:
+            return self._in_flight < self.max_concurrency
+
+    def _hedge_delay(self):
+        if not self.hedge:
+            return None
+        with self._lock:
+            if len(self._latencies) < HEDGE_MIN_SAMPLES:
+                return None
+            ordered = sorted(self._latencies)
+        return max(HEDGE_MIN_SECONDS, ordered[int(0.95 * (len(ordered) - 1))])
+
+    def _attempt(self, fn, timeout, idempotent):
+        now = time.monotonic()
+        expires = now + timeout
+        hedge_delay = self._hedge_delay() if idempotent else None
+        hedge_at = now + hedge_delay if hedge_delay is not None and hedge_delay < timeout else None
+        first = self._submit(fn)
+        pending = {first}
+        error = None
+        while pending:
+            wake = expires if hedge_at is None else hedge_at
+            done, pending = wait(pending, timeout=max(0.0, wake - time.monotonic()), return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    for other in pending:
+                        other.cancel()
+                    if future is not first:
+                        self._count('hedgeWins')
+                    return future.result()
+                error = future.exception()
+            if hedge_at is not None and time.monotonic() >= hedge_at:
+                hedge_at = None
+                if pending and self._has_idle_worker():
+                    self._count('hedged')
+                    pending.add(self._submit(fn))
+            elif not done and time.monotonic() >= expires:
+                for future in pending:
+                    future.cancel()
+                raise AttemptTimeout(f'{self.name} did not answer within {timeout:.1f}s')
+        raise error
+
+    def call(self, fn, idempotent=True):
+        """Run ``fn()`` under this provider's timeout, retry, hedging and breaker policy."""
+        if not self._allow():
+            self._count('shortCircuited')
+            raise CircuitOpen(self.name, 'circuit open')
+        self._count('calls')
+        attempt = 0
+        while True:
+            try:
+                timeout = timeout_for(self.timeout, self.name)
+            except DeadlineExceeded:
+                self._release_probe()
+                self._count('failures')
+                raise
+            started = time.monotonic()
+            try:
+                result = self._attempt(fn, timeout, idempotent)
+            except Exception as e:
+                if not is_retryable(e):
+                    # The provider answered; the request itself was bad
+                    self._record_success()
+                    self._count('failures')
+                    raise
+                if isinstance(e, TimeoutError):
+                    self._count('timeouts')
+                self._record_failure()
+                delay = random.uniform(0, min(BACKOFF_CAP_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt))
+                left = remaining()
+                if attempt >= self.retries or (left is not None and delay >= left) or not self._allow():
+                    self._count('failures')
+                    raise ProviderUnavailable(self.name, str(e) or type(e).__name__) from e
+                self._count('retries')
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self._record_success(time.monotonic() - started)
+            self._count('successes')
+            return result
+
+    def stream(self, make_iterator):
+        """Yield from ``make_iterator()`` with the provider timeout bounding the whole stream."""
+        if not self._allow():
+            self._count('shortCircuited')
+            raise CircuitOpen(self.name, 'circuit open')
+        self._count('calls')
+        items = queue.Queue()
+        finished = object()
+
+        def pump():
+            try:
+                for item in make_iterator():
+                    items.put((item, None))
+                items.put((finished, None))
+            except Exception as e:
+                items.put((None, e))
+
+        try:
+            expires = time.monotonic() + timeout_for(self.timeout, self.name)
+        except DeadlineExceeded:
+            self._release_probe()
+            self._count('failures')
+            raise
+        self._submit(pump)
+        settled = False
+        try:
+            while True:
+                try:
+                    item, error = items.get(timeout=max(0.0, expires - time.monotonic()))
+                except queue.Empty:
+                    settled = True
+                    self._count('timeouts')
+                    self._count('failures')
+                    self._record_failure()
+                    raise ProviderUnavailable(self.name, 'stream timed out')
+                if error is not None:
+                    settled = True
+                    self._count('failures')
+                    if not is_retryable(error):
+                        self._record_success()
+                        raise error
+                    self._record_failure()
+                    raise ProviderUnavailable(self.name, str(error) or type(error).__name__) from error
+                if item is finished:
+                    settled = True
+                    self._record_success()
+                    self._count('successes')
+                    return
+                yield item
+        finally:
+            if not settled:
+                # Closed early (e.g. the client went away): a half-open probe must not stay claimed
+                self._release_probe()
+
+    def reopens_in(self):
+        """Seconds until an open circuit lets a probe through, or None while it is closed."""
+        with self._lock:
+            if self._opened_at is None:
+                return None
+            return max(0.0, self._opened_at + self.reset_seconds - time.monotonic())
+
+    def record_fallback(self):
+        self._count('fallbacks')
+
+    def stats(self):
+        with self._lock:
+            return {**self.counts, 'circuitOpen': self._opened_at is not None,
+                    'consecutiveFailures': self._consecutive_failures, 'inFlight': self._in_flight,
+                    'maxConcurrency': self.max_concurrency}
+
+
+def _provider(name, timeout, retries, hedge=False, max_concurrency=16):
+    prefix = name.upper()
+    return Provider(
+        name,
+        timeout=float(os.getenv(f'{prefix}_TIMEOUT_SECONDS', str(timeout))),
+        retries=int(os.getenv(f'{prefix}_RETRIES', str(retries))),
+        hedge=os.getenv(f'{prefix}_HEDGE', '1' if hedge else '0') == '1',
+        failure_threshold=int(os.getenv(f'{prefix}_BREAKER_FAILURES', '5')),
+        reset_seconds=float(os.getenv(f'{prefix}_BREAKER_RESET_SECONDS', '30')),
+        max_concurrency=int(os.getenv(f'{prefix}_MAX_CONCURRENCY', str(max_concurrency))),
+    )
+
+
+gemini = _provider('gemini', timeout=20, retries=1, hedge=True, max_concurrency=24)
+assemblyai = _provider('assemblyai', timeout=90, retries=1, max_concurrency=8)
+firebase_auth = _provider('firebase_auth', timeout=5, retries=1, max_concurrency=8)
+PROVIDERS = (gemini, assemblyai, firebase_auth)
+
+FIRESTORE_TIMEOUT_SECONDS = float(os.getenv('FIRESTORE_TIMEOUT_SECONDS', '10'))
+RETRY_AFTER_SECONDS = int(os.getenv('PROVIDER_RETRY_AFTER_SECONDS', '5'))
+
+
+def retry_after(error):
+    """Whole seconds a client should wait before retrying a request that failed with ``error``."""
+    for provider in PROVIDERS:
+        if provider.name == getattr(error, 'provider', None):
+            left = provider.reopens_in()
+            if left:
+                return max(1, math.ceil(left))
+    return RETRY_AFTER_SECONDS
+
+
+def stats():
+    return {provider.name: provider.stats() for provider in PROVIDERS}
+
+
+def gauges():
+    values = {}
+    for provider in PROVIDERS:
+        counts = provider.stats()
+        for key, metric in (('calls', 'calls'), ('failures', 'failures'), ('timeouts', 'timeouts'),
+                            ('retries', 'retries'), ('hedged', 'hedged'), ('hedgeWins', 'hedge_wins'),
+                            ('shortCircuited', 'short_circuited'), ('fallbacks', 'fallbacks')):
+            values[f'mediassist_{provider.name}_{metric}_total'] = counts[key]
+        values[f'mediassist_{provider.name}_circuit_open'] = int(counts['circuitOpen'])
+        values[f'mediassist_{provider.name}_in_flight'] = counts['inFlight']
+    return values
+
+
+def init_app(app):
+    from flask import request
+
+    @app.before_request
+    def _start_deadline():
+        set_deadline(ENDPOINT_DEADLINES.get(request.endpoint, REQUEST_DEADLINE_SECONDS))
+
+    @app.teardown_request
+    def _clear_deadline(exc):
+        set_deadline(None)
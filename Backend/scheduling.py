@@ -0,0 +1,310 @@
+"""Clinician slot calendars, availability search and slot booking.
+
+Schedules come from data/clinicians.json: weekly opening hours and a fixed
+slot length per clinician. Hours and every ``YYYY-MM-DDTHH:MM`` slot start
+are wall-clock times in the catalogue's ``timezone`` (an IANA name,
+overridable with CLINIC_TIMEZONE), and "now" is taken in that zone whatever
+the server's own zone is. For each searched day every clinician's free slot
+starts are merged into one sorted array of ``minute << CLINICIAN_BITS |
+clinician`` keys (plus one array per specialty), so the earliest free slots
+after a given time are one bisect and a short scan away however many
+clinicians there are. Day indexes are built on first use, kept for
+SLOT_INDEX_TTL_SECONDS and then rebuilt so bookings made by other workers
+show up; concurrent requests for a stale day wait for one rebuild.
+
+A booking is a ``slotBookings/<clinicianId>_<date>_<HHMM>`` document created
+in the same batch as the appointment. create() fails when the document
+exists, so two concurrent bookings of one slot cannot both commit; the index
+only guides search.
+
+    python scheduling.py --clinicians 5000    # synthetic build and search timings
+"""
+import argparse
+import bisect
+import datetime
+import json
+import os
+import random
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from zoneinfo import ZoneInfo
+
+import repository
+
+CLINICIANS_PATH = os.getenv('CLINICIANS_PATH',
+                            os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'clinicians.json'))
+CLINIC_TIMEZONE = os.getenv('CLINIC_TIMEZONE')
+INDEX_TTL_SECONDS = float(os.getenv('SLOT_INDEX_TTL_SECONDS', '30'))
+INDEX_MAX_DAYS = int(os.getenv('SLOT_INDEX_MAX_DAYS', '60'))
+CLINICIAN_BITS = 20
+WEEKDAYS = ('mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun')
+
+# (first day offset, last day offset) searched per urgency. Routine requests start
+# a day out so the soonest slots stay free for urgent patients.
+URGENCY_WINDOWS = {'high': (0, 1), 'medium': (0, 6), 'low': (1, 13)}
+
+
+class SlotError(ValueError):
+    pass
+
+
+class SlotUnavailable(SlotError):
+    pass
+
+
+def load_catalogue(path=CLINICIANS_PATH):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def to_minute(hhmm):
+    hours, minutes = hhmm.split(':')
+    return int(hours) * 60 + int(minutes)
+
+
+def format_minute(minute):
+    return f'{minute // 60:02d}:{minute % 60:02d}'
+
+
+def parse_slot(value):
+    """Split a ``YYYY-MM-DDTHH:MM`` slot start into (date, minute of day)."""
+    try:
+        moment = datetime.datetime.strptime(value or '', '%Y-%m-%dT%H:%M')
+    except ValueError:
+        raise SlotError('slotStart must look like YYYY-MM-DDTHH:MM')
+    return moment.date().isoformat(), moment.hour * 60 + moment.minute
+
+
+def slot_key(clinician_id, date, minute):
+    return f"{clinician_id}_{date}_{format_minute(minute).replace(':', '')}"
+
+
+class DayIndex:
+    __slots__ = ('date', 'keys', 'built_at')
+
+    def __init__(self, date, keys, built_at):
+        self.date = date
+        self.keys = keys  # {None: all free slots, specialty: that specialty's free slots}
+        self.built_at = built_at
+
+    def earliest(self, after_minute, limit, specialty=None):
+        keys = self.keys.get(specialty)
+        if not keys:
+            return []
+        start = bisect.bisect_left(keys, after_minute << CLINICIAN_BITS)
+        return keys[start:start + limit]
+
+    def remove(self, key):
+        for keys in self.keys.values():
+            i = bisect.bisect_left(keys, key)
+            if i < len(keys) and keys[i] == key:
+                del keys[i]
+
+
+class SlotEngine:
+    def __init__(self, catalogue, load_booked, ttl_seconds=INDEX_TTL_SECONDS, max_days=INDEX_MAX_DAYS):
+        self.version = catalogue['version']
+        self.timezone = CLINIC_TIMEZONE or catalogue.get('timezone', 'UTC')
+        self.zone = ZoneInfo(self.timezone)
+        self.clinicians = catalogue['clinicians']
+        self._index_of = {c['id']: i for i, c in enumerate(self.clinicians)}
+        self._hours = [{day: [(to_minute(start), to_minute(end)) for start, end in spans]
+                        for day, spans in c.get('hours', {}).items()} for c in self.clinicians]
+        self._load_booked = load_booked
+        self.ttl_seconds = ttl_seconds
+        self.max_days = max_days
+        self._days = OrderedDict()
+        self._building = {}
+        self._lock = threading.Lock()
+        self.searches = 0
+        self.builds = 0
+        self.bookings = 0
+        self.conflicts = 0
+
+    def _starts(self, index, weekday):
+        length = self.clinicians[index]['slotMinutes']
+        for start, end in self._hours[index].get(weekday, ()):
+            yield from range(start, end - length + 1, length)
+
+    def _build(self, date):
+        weekday = WEEKDAYS[datetime.date.fromisoformat(date).weekday()]
+        booked = {(self._index_of.get(clinician_id), minute) for clinician_id, minute in self._load_booked(date)}
+        by_specialty = {}
+        for index, clinician in enumerate(self.clinicians):
+            free = by_specialty.setdefault(clinician['specialty'], [])
+            free.extend(minute << CLINICIAN_BITS | index for minute in self._starts(index, weekday)
+                        if (index, minute) not in booked)
+        keys = {specialty: array('q', sorted(free)) for specialty, free in by_specialty.items()}
+        keys[None] = array('q', sorted(key for free in keys.values() for key in free))
+        return DayIndex(date, keys, time.monotonic())
+
+    def _fresh(self, date):
+        # Caller holds self._lock
+        day = self._days.get(date)
+        if day is not None and time.monotonic() - day.built_at < self.ttl_seconds:
+            self._days.move_to_end(date)
+            return day
+        return None
+
+    def _day(self, date):
+        with self._lock:
+            day = self._fresh(date)
+            if day is not None:
+                return day
+            building = self._building.setdefault(date, threading.Lock())
+        # One thread rebuilds a stale day; the others wait for it and reuse the result
+        with building:
+            with self._lock:
+                day = self._fresh(date)
+                if day is not None:
+                    return day
+            try:
+                day = self._build(date)
+            finally:
+                with self._lock:
+                    self._building.pop(date, None)
+            with self._lock:
+                self.builds += 1
+                self._days[date] = day
+                self._days.move_to_end(date)
+                while len(self._days) > self.max_days:
+                    self._days.popitem(last=False)
+        return day
+
+    def now(self, now=None):
+        """``now`` (default: the current time) as an aware datetime in the catalogue's zone.
+
+        A naive ``now`` is taken to be wall-clock time in that zone already.
+        """
+        if now is None:
+            return datetime.datetime.now(self.zone)
+        if now.tzinfo is None:
+            return now.replace(tzinfo=self.zone)
+        return now.astimezone(self.zone)
+
+    def validate(self, clinician_id, date, minute):
+        """Raise SlotError unless ``minute`` on ``date`` is one of the clinician's slots."""
+        index = self._index_of.get(clinician_id)
+        if index is None:
+            raise SlotError(f'Unknown clinician {clinician_id}')
+        weekday = WEEKDAYS[datetime.date.fromisoformat(date).weekday()]
+        if minute not in set(self._starts(index, weekday)):
+            raise SlotError(f'{clinician_id} has no slot at {date} {format_minute(minute)}')
+        return self.clinicians[index]
+
+    def prepare(self, clinician_id, slot_start, upcoming=(), now=None):
+        """Validate a requested slot and return its booking details.
+
+        Raises SlotError for a slot that is not on the clinician's calendar or
+        already started, SlotUnavailable when it overlaps one of the patient's
+        ``upcoming`` appointments.
+        """
+        date, minute = parse_slot(slot_start)
+        clinician = self.validate(clinician_id, date, minute)
+        slot = self._slot(date, minute << CLINICIAN_BITS | self._index_of[clinician_id])
+        now = self.now(now)
+        if slot['slotStart'] <= now.strftime('%Y-%m-%dT%H:%M'):
+            raise SlotError('That slot has already started')
+        for other in upcoming:
+            if other.get('slotStart') and other.get('slotEnd') and \
+                    other['slotStart'] < slot['slotEnd'] and slot['slotStart'] < other['slotEnd']:
+                raise SlotUnavailable(f"You already have an appointment at {other['slotStart']}")
+        return {**slot, 'date': date, 'minute': minute, 'key': slot_key(clinician['id'], date, minute)}
+
+    def _slot(self, date, key):
+        minute, index = key >> CLINICIAN_BITS, key & ((1 << CLINICIAN_BITS) - 1)
+        clinician = self.clinicians[index]
+        return {
+            'clinicianId': clinician['id'],
+            'clinicianName': clinician['name'],
+            'specialty': clinician['specialty'],
+            'slotStart': f'{date}T{format_minute(minute)}',
+            'slotEnd': f"{date}T{format_minute(minute + clinician['slotMinutes'])}",
+        }
+
+    def search(self, urgency='medium', limit=10, specialty=None, now=None):
+        """Earliest free slots inside the urgency's booking window, soonest first."""
+        first, last = URGENCY_WINDOWS.get(urgency, URGENCY_WINDOWS['medium'])
+        now = self.now(now)
+        slots = []
+        for offset in range(first, last + 1):
+            date = (now.date() + datetime.timedelta(days=offset)).isoformat()
+            after = now.hour * 60 + now.minute + 1 if offset == 0 else 0
+            for key in self._day(date).earliest(after, limit - len(slots), specialty):
+                slots.append(self._slot(date, key))
+            if len(slots) >= limit:
+                break
+        with self._lock:
+            self.searches += 1
+        return slots
+
+    def mark_booked(self, clinician_id, date, minute, conflict=False):
+        index = self._index_of.get(clinician_id)
+        with self._lock:
+            if conflict:
+                self.conflicts += 1
+            else:
+                self.bookings += 1
+            day = self._days.get(date)
+            if day is not None and index is not None:
+                day.remove(minute << CLINICIAN_BITS | index)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'catalogueVersion': self.version,
+                'timezone': self.timezone,
+                'clinicians': len(self.clinicians),
+                'daysIndexed': len(self._days),
+                'freeSlotsIndexed': sum(len(day.keys[None]) for day in self._days.values()),
+                'searches': self.searches,
+                'indexBuilds': self.builds,
+                'bookings': self.bookings,
+                'conflicts': self.conflicts,
+            }
+
+
+slot_engine = SlotEngine(load_catalogue(), repository.booked_slots)
+
+
+def _synthetic_catalogue(count):
+    specialties = ('general practice', 'internal medicine', 'pulmonology', 'cardiology', 'urgent care')
+    hours = {day: [['08:00', '12:00'], ['13:00', '18:00']] for day in WEEKDAYS}
+    return {'version': 'synthetic', 'clinicians': [
+        {'id': f'c{i}', 'name': f'Clinician {i}', 'specialty': specialties[i % len(specialties)],
+         'slotMinutes': random.choice((10, 15, 20, 30)), 'hours': hours} for i in range(count)]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--clinicians', type=int, default=5000)
+    parser.add_argument('--searches', type=int, default=2000)
+    args = parser.parse_args()
+
+    engine = SlotEngine(_synthetic_catalogue(args.clinicians), lambda date: (), ttl_seconds=3600)
+    today = engine.now().date().isoformat()
+    started = time.perf_counter()
+    day = engine._day(today)
+    print(f'built {today}: {len(day.keys[None])} free slots for {args.clinicians} clinicians '
+          f'in {(time.perf_counter() - started) * 1000:.1f} ms')
+
+    for urgency in URGENCY_WINDOWS:
+        engine.search(urgency)  # builds the window's days
+        started = time.perf_counter()
+        for _ in range(args.searches):
+            engine.search(urgency, limit=10, specialty=random.choice((None, 'cardiology')))
+        per_search = (time.perf_counter() - started) / args.searches * 1e6
+        print(f'search urgency={urgency}: {per_search:.1f} us per search')
+
+    slot = engine.search('high', limit=1)[0]
+    date, minute = parse_slot(slot['slotStart'])
+    started = time.perf_counter()
+    engine.mark_booked(slot['clinicianId'], date, minute)
+    print(f"booked {slot['clinicianId']} {slot['slotStart']} in {(time.perf_counter() - started) * 1e6:.1f} us; "
+          f"next earliest {engine.search('high', limit=1)[0]['slotStart']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+
+def flight_key(*parts):
+    payload = json.dumps(parts, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.abandoned = False
+
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one execution.
+
+    Callers in the same process wait on the first caller's result. With a
+    SQLite ``disk_path`` the first caller on the host also claims a lease row,
+    and callers in other workers poll that row for the JSON-encoded result
+    instead of running the work again. Results stay readable for
+    ``result_ttl_seconds`` so a retry arriving just after completion is
+    answered too; a lease left behind by a crashed worker expires after
+    ``lease_seconds``.
+    """
+
+    def __init__(self, disk_path=None, lease_seconds=120, result_ttl_seconds=30, poll_interval=0.05):
+        self.disk_path = disk_path
+        self.lease_seconds = lease_seconds
+        self.result_ttl_seconds = result_ttl_seconds
+        self.poll_interval = poll_interval
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.executed = 0
+        self.shared = 0
+        self.shared_across_workers = 0
+
+    def _connect(self):
+        # Opened lazily, and again after a fork, as repository._ensure_clients does
+        pid = os.getpid()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != pid:
+            conn = sqlite3.connect(self.disk_path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS singleflight ('
+                'key TEXT PRIMARY KEY, owner TEXT NOT NULL, leaseExpires REAL NOT NULL, '
+                'value TEXT, expires REAL NOT NULL)'
+            )
+            self._local.conn = conn
+            self._local.pid = pid
+        return conn
+
+    def do(self, key, fn):
+        """Run ``fn()`` once for all concurrent callers of ``key``; returns (result, shared)."""
+        while True:
+            call, leader = self._join(key)
+            if leader:
+                break
+            if not call.abandoned:
+                return self._follow(call), True
+
+        try:
+            owner, conn, ready = self._lease(key)
+            if ready is not None:
+                call.result = ready[0]
+                return call.result, True
+            try:
+                call.result = fn()
+            except BaseException:
+                self._abandon(conn, key, owner)
+                raise
+            self._publish(conn, key, owner, call.result)
+            return call.result, False
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            self._leave(key, call)
+
+    def stream(self, key, fn):
+        """Generator form of do() for a ``fn()`` that is itself a generator.
+
+        The leader re-yields what ``fn()`` yields as it is produced and callers
+        sharing its result yield nothing, so each follower must rebuild its
+        output from the result. Use as ``result, shared = yield from
+        single_flight.stream(key, fn)``. If the leader is closed early (its
+        client went away) a waiting caller takes over as the new leader.
+        """
+        while True:
+            call, leader = self._join(key)
+            if leader:
+                break
+            if not call.abandoned:
+                return self._follow(call), True
+
+        try:
+            owner, conn, ready = self._lease(key)
+            if ready is not None:
+                call.result = ready[0]
+                return call.result, True
+            try:
+                call.result = yield from fn()
+            except BaseException:
+                self._abandon(conn, key, owner)
+                raise
+            self._publish(conn, key, owner, call.result)
+            return call.result, False
+        except GeneratorExit:
+            call.abandoned = True
+            raise
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            self._leave(key, call)
+
+    def _join(self, key):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            call.done.wait()
+        return call, leader
+
+    def _follow(self, call):
+        with self._lock:
+            self.shared += 1
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def _leave(self, key, call):
+        with self._lock:
+            del self._calls[key]
+        call.done.set()
+
+    def _claim(self, conn, key, owner):
+        now = time.time()
+        conn.execute(
+            'INSERT INTO singleflight (key, owner, leaseExpires, value, expires) VALUES (?, ?, ?, NULL, 0) '
+            'ON CONFLICT(key) DO UPDATE SET owner = excluded.owner, leaseExpires = excluded.leaseExpires, '
+            'value = NULL, expires = 0 '
+            'WHERE (singleflight.value IS NULL AND singleflight.leaseExpires <= ?) '
+            'OR (singleflight.value IS NOT NULL AND singleflight.expires <= ?)',
+            (key, owner, now + self.lease_seconds, now, now),
+        )
+        return conn.execute('SELECT owner, value, expires FROM singleflight WHERE key = ?', (key,)).fetchone()
+
+    def _lease(self, key):
+        """Return (owner, conn, ready): ``ready`` is a 1-tuple holding another worker's result, else None.
+
+        ``conn`` is None when there is no disk tier or it failed, and the work runs unshared.
+        """
+        owner = f'{os.getpid()}-{uuid.uuid4().hex}'
+        if not self.disk_path:
+            return owner, None, None
+        try:
+            conn = self._connect()
+            while True:
+                row = self._claim(conn, key, owner)
+                if row is not None and row[0] == owner:
+                    return owner, conn, None
+                if row is not None and row[1] is not None and row[2] > time.time():
+                    with self._lock:
+                        self.shared_across_workers += 1
+                    return owner, None, (json.loads(row[1]),)
+                time.sleep(self.poll_interval)
+        except sqlite3.Error:
+            return owner, None, None
+
+    def _abandon(self, conn, key, owner):
+        if conn is not None:
+            try:
+                conn.execute('DELETE FROM singleflight WHERE key = ? AND owner = ?', (key, owner))
+            except sqlite3.Error:
+                pass
+
+    def _publish(self, conn, key, owner, result):
+        with self._lock:
+            self.executed += 1
+        if conn is not None:
+            try:
+                now = time.time()
+                conn.execute('UPDATE singleflight SET value = ?, expires = ? WHERE key = ? AND owner = ?',
+                             (json.dumps(result), now + self.result_ttl_seconds, key, owner))
+                conn.execute('DELETE FROM singleflight WHERE value IS NOT NULL AND expires <= ?', (now,))
+            except sqlite3.Error:
+                pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'inFlight': len(self._calls),
+                'executed': self.executed,
+                'shared': self.shared,
+                'sharedAcrossWorkers': self.shared_across_workers,
+                'diskPath': self.disk_path,
+            }
+
+
+single_flight = SingleFlight(
+    disk_path=os.getenv('SINGLEFLIGHT_PATH') or None,
+    lease_seconds=int(os.getenv('SINGLEFLIGHT_LEASE_SECONDS', '120')),
+    result_ttl_seconds=int(os.getenv('SINGLEFLIGHT_RESULT_TTL_SECONDS', '30')),
+)
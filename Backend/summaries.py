@@ -0,0 +1,290 @@
+"""Per-user summary document, maintained alongside the writes it summarizes.
+
+``userSummaries/<userId>`` holds the counts, the latest urgency, the most
+recent report entries in compact form and the upcoming appointments, so a
+dashboard load is one document read however long the history is. Each write
+path reads the current summary with its other documents, then puts the
+updated summary into the same batch as its own write. A user without a
+summary yet gets one rebuilt from the source collections first, so the
+counters never start from whatever was written after a deploy.
+
+The report and appointment entries are stored as maps keyed by id rather
+than arrays. A write merges only the entries it touches and deletes the ones
+that fell out of its view, so two concurrent writes for the same user both
+keep their entry; readers order and trim with recent_reports() and
+upcoming_appointments(), and serialize() returns them as lists.
+
+    python summaries.py --user <userId>    # rebuild one user's summary
+    python summaries.py --all              # backfill every user
+"""
+import argparse
+import datetime
+import os
+
+import repository
+from metrics import span
+
+RECENT_REPORTS = int(os.getenv('SUMMARY_RECENT_REPORTS', '5'))
+UPCOMING_APPOINTMENTS = int(os.getenv('SUMMARY_UPCOMING_APPOINTMENTS', '5'))
+CONFIDENCE_ORDER = {'high': 3, 'medium': 2, 'low': 1}
+
+
+def _now_iso():
+    # Entries are ordered by this string when read, so they carry the app server's clock
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def _iso(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def _top_ailment(prediction):
+    ailments = (prediction or {}).get('possibleAilments') or []
+    if not ailments:
+        return None
+    return max(ailments, key=lambda a: CONFIDENCE_ORDER.get(a.get('confidence', 'low'), 0))
+
+
+def _report_entry(symptom_id, symptom_data, created=None):
+    prediction = symptom_data.get('prediction') or {}
+    top = _top_ailment(prediction)
+    return {
+        'id': symptom_id,
+        'created': created or _now_iso(),
+        'symptoms': symptom_data.get('symptoms', []),
+        'status': symptom_data.get('status', ''),
+        'topAilment': top.get('name') if top else None,
+        'urgency': prediction.get('urgency'),
+        'hasReport': False,
+    }
+
+
+def _entries(summary, field):
+    value = (summary or {}).get(field) or {}
+    if isinstance(value, list):
+        # Summaries written before entries were keyed by id
+        return [e for e in value if isinstance(e, dict)]
+    return [dict(e, id=entry_id) for entry_id, e in value.items() if isinstance(e, dict)]
+
+
+def _recent(entries):
+    # An update that raced the entry's trimming leaves a partial entry without 'created'
+    recent = [e for e in entries if e.get('created')]
+    recent.sort(key=lambda e: e['created'], reverse=True)
+    return recent[:RECENT_REPORTS]
+
+
+def recent_reports(summary):
+    return _recent(_entries(summary, 'recentReports'))
+
+
+def upcoming_appointments(summary):
+    return _upcoming(_entries(summary, 'upcomingAppointments'))
+
+
+def _keyed_update(summary, field, changes, keep):
+    """Value to merge into ``field`` for ``changes`` ({id: entry fields}), trimmed by ``keep``."""
+    current = {e['id']: e for e in _entries(summary, field)}
+    merged = dict(current)
+    for entry_id, change in changes.items():
+        merged[entry_id] = {**current.get(entry_id, {}), **change}
+    kept = {e['id'] for e in keep([dict(e, id=entry_id) for entry_id, e in merged.items()])}
+    if not isinstance((summary or {}).get(field), dict):
+        # A list (or missing) field is replaced by the whole map once
+        return {entry_id: dict(merged[entry_id], id=entry_id) for entry_id in kept}
+    value = {entry_id: change for entry_id, change in changes.items() if entry_id in kept}
+    value.update({entry_id: _delete_field() for entry_id in current if entry_id not in kept})
+    return value
+
+
+def _latest_report(symptom_id, prediction):
+    return {
+        'id': symptom_id,
+        'possibleAilments': prediction.get('possibleAilments', []),
+        'highestConfidenceAilment': _top_ailment(prediction),
+        'recommendations': prediction.get('recommendations', []),
+        'urgency': prediction.get('urgency'),
+        'shouldSeeDoctor': prediction.get('shouldSeeDoctor'),
+    }
+
+
+def _increment(amount=1):
+    return repository.firestore_module().Increment(amount)
+
+
+def _delete_field():
+    return repository.firestore_module().DELETE_FIELD
+
+
+def _base(user_id):
+    return {'userId': user_id, 'updatedAt': repository.server_timestamp()}
+
+
+def _prediction_fields(symptom_id, prediction):
+    return {
+        'lastUrgency': prediction.get('urgency'),
+        'lastShouldSeeDoctor': prediction.get('shouldSeeDoctor'),
+        'latestReport': _latest_report(symptom_id, prediction),
+    }
+
+
+def _existing(summary, user_id):
+    # Counters are incremented in place, which is only right on top of a complete summary
+    return summary if summary is not None else rebuild(user_id)
+
+
+def symptom_recorded(summary, user_id, symptom_id, symptom_data, has_report=False):
+    """Summary fields for a newly saved symptom record (possibly already predicted and reported)."""
+    summary = _existing(summary, user_id)
+    entry = dict(_report_entry(symptom_id, symptom_data), hasReport=has_report)
+    fields = {
+        **_base(user_id),
+        'symptomCount': _increment(),
+        'recentReports': _keyed_update(summary, 'recentReports', {symptom_id: entry}, _recent),
+    }
+    if has_report:
+        fields['reportCount'] = _increment()
+    if symptom_data.get('prediction'):
+        fields.update(_prediction_fields(symptom_id, symptom_data['prediction']))
+    return fields
+
+
+def _prediction_change(prediction, **extra):
+    top = _top_ailment(prediction)
+    return {'urgency': prediction.get('urgency'), 'topAilment': top.get('name') if top else None, **extra}
+
+
+def prediction_recorded(summary, user_id, symptom_id, prediction):
+    """Summary fields for a prediction written to an existing symptom record."""
+    summary = _existing(summary, user_id)
+    change = _prediction_change(prediction, status='ailment_predicted')
+    return {
+        **_base(user_id),
+        'recentReports': _keyed_update(summary, 'recentReports', {symptom_id: change}, _recent),
+        **_prediction_fields(symptom_id, prediction),
+    }
+
+
+def prediction_rescored(summary, user_id, symptom_id, prediction):
+    """Summary fields for a re-scored historical prediction, or None if the summary does not show it."""
+    is_latest = ((summary or {}).get('latestReport') or {}).get('id') == symptom_id
+    if not is_latest and not any(entry['id'] == symptom_id for entry in recent_reports(summary)):
+        return None
+    changes = {symptom_id: _prediction_change(prediction)}
+    fields = {**_base(user_id), 'recentReports': _keyed_update(summary, 'recentReports', changes, _recent)}
+    if is_latest:
+        fields.update(_prediction_fields(symptom_id, prediction))
+    return fields
+
+
+def report_created(summary, user_id, report_id, symptom_data):
+    summary = _existing(summary, user_id)
+    if any(entry['id'] == report_id for entry in recent_reports(summary)):
+        change = {'hasReport': True}
+    else:
+        change = dict(_report_entry(report_id, symptom_data, _iso(symptom_data.get('created'))), hasReport=True)
+    return {
+        **_base(user_id),
+        'reportCount': _increment(),
+        'recentReports': _keyed_update(summary, 'recentReports', {report_id: change}, _recent),
+    }
+
+
+def _appointment_entry(appointment_id, data):
+    return {
+        'id': appointment_id,
+        'symptomId': data.get('symptomId'),
+        'preferredDate': data.get('preferredDate'),
+        'preferredTime': data.get('preferredTime'),
+        'clinicianId': data.get('clinicianId'),
+        'slotStart': data.get('slotStart'),
+        'slotEnd': data.get('slotEnd'),
+        'urgency': data.get('urgency'),
+        'status': data.get('status'),
+    }
+
+
+def _upcoming(entries):
+    today = datetime.date.today().isoformat()
+    # Appointments without a preferred date stay listed until they are scheduled
+    upcoming = [e for e in entries if not e.get('preferredDate') or e['preferredDate'] >= today]
+    upcoming.sort(key=lambda e: (e.get('preferredDate') or '9999-99-99', e.get('preferredTime') or ''))
+    return upcoming[:UPCOMING_APPOINTMENTS]
+
+
+def appointment_booked(summary, user_id, appointment_id, appointment_data):
+    changes = {appointment_id: _appointment_entry(appointment_id, appointment_data)}
+    upcoming = _keyed_update(_existing(summary, user_id), 'upcomingAppointments', changes, _upcoming)
+    return {**_base(user_id), 'appointmentCount': _increment(), 'upcomingAppointments': upcoming}
+
+
+def stage(write_batch, user_id, fields):
+    write_batch.set(repository.summary_ref(user_id), fields, merge=True)
+
+
+def serialize(summary):
+    summary = dict(summary)
+    summary['updatedAt'] = _iso(summary.get('updatedAt'))
+    summary['recentReports'] = recent_reports(summary)
+    summary['upcomingAppointments'] = upcoming_appointments(summary)
+    return summary
+
+
+def rebuild(user_id):
+    """Recompute a user's summary from its source collections and overwrite it."""
+    with span(f'firestore.query.{repository.USER_SYMPTOMS}'):
+        symptom_docs = list(repository.symptoms_query(user_id).stream())
+    with span(f'firestore.query.{repository.HEALTH_REPORTS}'):
+        report_ids = {doc.id for doc in repository.health_reports_query(user_id).select([]).stream()}
+
+    recent = {}
+    for doc in symptom_docs[:RECENT_REPORTS]:
+        data = doc.to_dict()
+        recent[doc.id] = dict(_report_entry(doc.id, data, _iso(data.get('created'))), hasReport=doc.id in report_ids)
+
+    summary = {
+        'userId': user_id,
+        'symptomCount': len(symptom_docs),
+        'reportCount': len(report_ids),
+        'recentReports': recent,
+        'lastUrgency': None,
+        'lastShouldSeeDoctor': None,
+        'latestReport': None,
+        'updatedAt': repository.server_timestamp(),
+    }
+    for doc in symptom_docs:
+        prediction = doc.to_dict().get('prediction')
+        if prediction:
+            summary.update(_prediction_fields(doc.id, prediction))
+            break
+
+    with span(f'firestore.query.{repository.APPOINTMENTS}'):
+        appointments = [_appointment_entry(doc.id, doc.to_dict())
+                        for doc in repository.appointments_query(user_id).stream()]
+    summary['appointmentCount'] = len(appointments)
+    summary['upcomingAppointments'] = {e['id']: e for e in _upcoming(appointments)}
+
+    repository.set_summary(user_id, summary)
+    return summary
+
+
+def _all_user_ids():
+    return [doc.id for doc in repository.get_db().collection(repository.USERS).select([]).stream()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--user', action='append', help='user id to rebuild (repeatable)')
+    target.add_argument('--all', action='store_true', help='rebuild every user in the users collection')
+    args = parser.parse_args()
+
+    user_ids = _all_user_ids() if args.all else args.user
+    for count, user_id in enumerate(user_ids, 1):
+        summary = rebuild(user_id)
+        print(f"[{count}/{len(user_ids)}] {user_id}: {summary['symptomCount']} symptom records, "
+              f"{summary['reportCount']} reports, {summary['appointmentCount']} appointments")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+"""In-process symptom extraction over a versioned lexicon.
+
+Every synonym in data/symptom_lexicon.json is compiled into one Aho-Corasick
+automaton, so a transcript is scanned once regardless of lexicon size.
+Matches preceded by a negation cue in the same clause ("no fever", "I don't
+have a cough") are dropped. Clauses are split at punctuation and at
+conjunctions such as "and" and "with". A clause that sounds like a complaint
+but has no lexicon term, or has a complaint word ("pain", "hurts",
+"swelling") outside every term it matched, lowers the coverage score; below
+LOCAL_SYMPTOM_MIN_COVERAGE the caller should fall back to the LLM.
+
+    python symptom_extractor.py    # check extractions against data/symptom_extraction_cases.json
+"""
+import bisect
+import json
+import os
+import re
+import sys
+import threading
+from collections import deque
+
+LEXICON_PATH = os.getenv('SYMPTOM_LEXICON_PATH',
+                         os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'symptom_lexicon.json'))
+CASES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'symptom_extraction_cases.json')
+LOCAL_EXTRACTION_ENABLED = os.getenv('LOCAL_SYMPTOM_EXTRACTION', '1') != '0'
+MIN_COVERAGE = float(os.getenv('LOCAL_SYMPTOM_MIN_COVERAGE', '0.8'))
+
+NEGATION_CUES = frozenset(('no', 'not', 'without', 'never', 'denies', 'deny', 'none', 'neither', 'nor',
+                           "don't", "doesn't", "didn't", "haven't", "hasn't", "hadn't", "isn't", "aren't",
+                           "wasn't", 'dont', 'doesnt', 'didnt', 'havent', 'hasnt'))
+NEGATION_WINDOW = 5
+
+# Words naming a complaint in their own right: a clause is only covered if each one is part of a match
+COMPLAINT_TERMS = frozenset(('pain', 'pains', 'painful', 'ache', 'aches', 'aching', 'hurt', 'hurts', 'hurting',
+                             'sore', 'burning', 'throbbing', 'stabbing', 'cramp', 'cramps', 'bleeding',
+                             'swelling', 'swollen', 'lump', 'discomfort'))
+# Words that mark a clause as describing a complaint, used to estimate coverage
+COMPLAINT_CUES = COMPLAINT_TERMS | frozenset(('feel', 'feels', 'feeling', 'felt', 'symptom', 'symptoms',
+                                              'problem', 'trouble', 'sharp', 'unable', "can't", 'cannot',
+                                              'keeps', 'worse'))
+
+_CLAUSE_BREAK = re.compile(r"[.;:!?\n]+|,|\b(?:and|with|plus|also|but|however|although|though|except|yet)\b")
+_WORD = re.compile(r"[a-z']+")
+
+
+def load_lexicon(path=LEXICON_PATH):
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+class Extraction:
+    __slots__ = ('symptoms', 'negated', 'coverage')
+
+    def __init__(self, symptoms, negated, coverage):
+        self.symptoms = symptoms
+        self.negated = negated
+        self.coverage = coverage
+
+    @property
+    def confident(self):
+        return bool(self.symptoms or self.negated) and self.coverage >= MIN_COVERAGE
+
+
+class SymptomExtractor:
+    def __init__(self, lexicon):
+        self.version = lexicon['version']
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for entry in lexicon['symptoms']:
+            for phrase in {entry['name'], *entry.get('synonyms', ())}:
+                self._add(phrase.lower(), entry['name'])
+        self._build_failure_links()
+
+    def _add(self, phrase, canonical):
+        node = 0
+        for ch in phrase:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = nxt
+        self._output[node].append((len(phrase), canonical))
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def _scan(self, text):
+        """Yield (start, end, canonical) for every whole-word lexicon hit."""
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(ch, 0)
+            for length, canonical in self._output[node]:
+                start, end = i - length + 1, i + 1
+                if (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum()):
+                    yield start, end, canonical
+
+    @staticmethod
+    def _leftmost_longest(hits):
+        chosen = []
+        last_end = -1
+        for start, end, canonical in sorted(hits, key=lambda h: (h[0], h[0] - h[1])):
+            if start >= last_end:
+                chosen.append((start, end, canonical))
+                last_end = end
+        return chosen
+
+    def extract(self, transcript):
+        text = (transcript or '').lower().replace('’', "'")
+        hits = self._leftmost_longest(self._scan(text))
+
+        breaks = list(_CLAUSE_BREAK.finditer(text))
+        clauses = list(zip([0] + [m.end() for m in breaks], [m.start() for m in breaks] + [len(text)]))
+        clause_starts = [start for start, _ in clauses]
+        symptoms, negated = [], []
+        matched_clauses = set()
+        for start, end, canonical in hits:
+            clause_index = bisect.bisect_right(clause_starts, start) - 1
+            matched_clauses.add(clause_index)
+            preceding = _WORD.findall(text[clause_starts[clause_index]:start])[-NEGATION_WINDOW:]
+            target = negated if NEGATION_CUES.intersection(preceding) else symptoms
+            if canonical not in target:
+                target.append(canonical)
+        # A symptom asserted anywhere wins over a negation elsewhere
+        negated = [s for s in negated if s not in symptoms]
+
+        complaint_clauses = set(matched_clauses)
+        unexplained_clauses = set()
+        for index, (clause_start, clause_end) in enumerate(clauses):
+            for word in _WORD.finditer(text, clause_start, clause_end):
+                if word.group() not in COMPLAINT_CUES:
+                    continue
+                complaint_clauses.add(index)
+                explained = any(start <= word.start() and word.end() <= end for start, end, _ in hits)
+                if word.group() in COMPLAINT_TERMS and not explained:
+                    # "sharp pain in my lower back" next to a match elsewhere in the clause is still unmatched
+                    unexplained_clauses.add(index)
+        covered = matched_clauses - unexplained_clauses
+        coverage = len(covered) / len(complaint_clauses) if complaint_clauses else 0.0
+        return Extraction(symptoms, negated, coverage)
+
+
+class ExtractionStats:
+    def __init__(self):
+        self.local = 0
+        self.escalated = 0
+        self._lock = threading.Lock()
+
+    def record(self, served_locally):
+        with self._lock:
+            if served_locally:
+                self.local += 1
+            else:
+                self.escalated += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.local + self.escalated
+            return {
+                'lexiconVersion': extractor.version,
+                'servedLocally': self.local,
+                'escalatedToLlm': self.escalated,
+                'localFraction': round(self.local / total, 4) if total else 0.0,
+            }
+
+
+lexicon = load_lexicon()
+extractor = SymptomExtractor(lexicon)
+extraction_stats = ExtractionStats()
+
+
+def check_cases(path=CASES_PATH):
+    """Extract every case and return the ones whose symptoms or negations do not match."""
+    with open(path, 'r', encoding='utf-8') as f:
+        cases = json.load(f)
+    failures = []
+    for case in cases:
+        extraction = extractor.extract(case['text'])
+        got = (sorted(extraction.symptoms), sorted(extraction.negated))
+        if got != (sorted(case['expect']), sorted(case.get('negated', []))):
+            failures.append((case['text'], case['expect'], case.get('negated', []), got))
+    return len(cases), failures
+
+
+if __name__ == '__main__':
+    total, failed = check_cases()
+    for text, expect, negated, (symptoms, got_negated) in failed:
+        print(f'FAIL {text!r}: expected {expect} (negated {negated}), got {symptoms} (negated {got_negated})')
+    print(f'{total - len(failed)}/{total} symptom extractions as expected')
+    sys.exit(1 if failed else 0)
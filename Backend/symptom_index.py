@@ -0,0 +1,168 @@
+"""Maps free-text symptom strings to canonical lexicon IDs.
+
+Built once at import from the same lexicon file the extractor uses. Lookup
+tries an exact match on the normalized phrase, then the phrase with severity
+and filler words removed, then a character-trigram Dice match against every
+known synonym. A fuzzy match is only accepted when each of the phrase's head
+words (what hurts, rather than "pain" or "feeling") is a spelling variant of
+a word in the synonym, so "heart pain" never becomes "head pain". Results
+are memoized, so repeated strings cost a dict lookup.
+
+    python symptom_index.py    # check lookups against data/symptom_lookup_cases.json
+"""
+import json
+import os
+import re
+import sys
+from collections import defaultdict
+from functools import lru_cache
+
+from symptom_extractor import lexicon
+
+FUZZY_MIN_SCORE = 0.65
+CASES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'symptom_lookup_cases.json')
+
+MODIFIER_WORDS = frozenset(('a', 'an', 'the', 'some', 'my', 'bad', 'severe', 'mild', 'slight', 'slightly',
+                            'terrible', 'awful', 'extreme', 'intense', 'constant', 'persistent', 'chronic',
+                            'occasional', 'recurring', 'sudden', 'little', 'bit', 'very', 'really', 'minor',
+                            'major', 'sharp', 'dull', 'acute', 'frequent', 'mild-to-moderate', 'moderate'))
+
+# Complaint words shared by many synonyms; they never decide a fuzzy match on their own
+COMPLAINT_WORDS = frozenset(('pain', 'pains', 'painful', 'ache', 'aches', 'aching', 'hurt', 'hurts', 'hurting',
+                             'sore', 'feel', 'feels', 'feeling', 'i', 'im', "i'm", 'is', 'in', 'of', 'to', 'have',
+                             'having', 'left', 'right', 'side', 'upper', 'lower'))
+
+_NON_WORD = re.compile(r"[^a-z0-9' ]+")
+
+
+def normalize_phrase(text):
+    return ' '.join(_NON_WORD.sub(' ', text.lower()).split())
+
+
+def _strip_modifiers(phrase):
+    return ' '.join(word for word in phrase.split() if word not in MODIFIER_WORDS)
+
+
+def _head_words(phrase):
+    return [word for word in phrase.split() if word not in COMPLAINT_WORDS]
+
+
+def _spelling_variant(word, other):
+    """True for the same word or a typo of it: one edit, two for words of eight letters or more."""
+    if word == other:
+        return True
+    limit = 1 if max(len(word), len(other)) < 8 else 2
+    if min(len(word), len(other)) < 4 or abs(len(word) - len(other)) > limit:
+        return False
+    previous = list(range(len(other) + 1))
+    for i, a in enumerate(word, 1):
+        current = [i]
+        for j, b in enumerate(other, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a != b)))
+        if min(current) > limit:
+            return False
+        previous = current
+    return previous[-1] <= limit
+
+
+def _trigrams(phrase):
+    padded = f'  {phrase} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class SymptomIndex:
+    def __init__(self, lexicon):
+        self.version = lexicon['version']
+        self.names = {}
+        self._exact = {}
+        self._grams = {}
+        self._postings = defaultdict(list)
+        for entry in lexicon['symptoms']:
+            self.names[entry['id']] = entry['name']
+            for phrase in {entry['name'], *entry.get('synonyms', ())}:
+                key = normalize_phrase(phrase)
+                self._exact.setdefault(key, entry['id'])
+                self._exact.setdefault(_strip_modifiers(key), entry['id'])
+        for key in self._exact:
+            grams = _trigrams(key)
+            self._grams[key] = grams
+            for gram in grams:
+                self._postings[gram].append(key)
+        self._cached_lookup = lru_cache(maxsize=4096)(self._lookup)
+
+    def lookup(self, text):
+        """Return the canonical ID for ``text`` or None when nothing is close enough."""
+        if not isinstance(text, str):
+            # Rejected before the memo: a dict or list is unhashable, a number would be cached as its text
+            raise ValueError(f'symptom must be a string, not {type(text).__name__}')
+        return self._cached_lookup(text)
+
+    def _lookup(self, text):
+        phrase = normalize_phrase(text)
+        if phrase in self._exact:
+            return self._exact[phrase]
+        stripped = _strip_modifiers(phrase)
+        if stripped in self._exact:
+            return self._exact[stripped]
+        if not stripped:
+            return None
+
+        grams = _trigrams(stripped)
+        overlap = defaultdict(int)
+        for gram in grams:
+            for key in self._postings.get(gram, ()):
+                overlap[key] += 1
+        heads = _head_words(stripped)
+        if not heads:
+            return None
+        scored = []
+        for key, shared in overlap.items():
+            score = 2.0 * shared / (len(grams) + len(self._grams[key]))
+            if score >= FUZZY_MIN_SCORE:
+                scored.append((score, key))
+        for score, key in sorted(scored, reverse=True):
+            words = key.split()
+            if all(any(_spelling_variant(head, word) for word in words) for head in heads):
+                return self._exact[key]
+        return None
+
+    def canonicalize(self, symptoms):
+        """Return (sorted unique IDs, display names) for a list of raw symptom strings.
+
+        Names are the canonical names of the matched IDs followed by the
+        normalized text of any symptom the lexicon does not know, so nothing
+        the patient reported is dropped. Raises ValueError for an item that is
+        not a string.
+        """
+        ids = set()
+        unmapped = []
+        for symptom in symptoms:
+            symptom_id = self.lookup(symptom)
+            if symptom_id is not None:
+                ids.add(symptom_id)
+                continue
+            phrase = normalize_phrase(symptom)
+            if phrase and phrase not in unmapped:
+                unmapped.append(phrase)
+        ids = sorted(ids)
+        return ids, [self.names[symptom_id] for symptom_id in ids] + unmapped
+
+
+symptom_index = SymptomIndex(lexicon)
+
+
+def check_cases(path=CASES_PATH):
+    """Look up every case and return the ones whose ID does not match ``expect``."""
+    with open(path, 'r', encoding='utf-8') as f:
+        cases = json.load(f)
+    failures = [(case['text'], case['expect'], symptom_index.lookup(case['text'])) for case in cases
+                if symptom_index.lookup(case['text']) != case['expect']]
+    return len(cases), failures
+
+
+if __name__ == '__main__':
+    total, failed = check_cases()
+    for text, expect, got in failed:
+        print(f'FAIL {text!r}: expected {expect}, got {got}')
+    print(f'{total - len(failed)}/{total} symptom lookups as expected')
+    sys.exit(1 if failed else 0)
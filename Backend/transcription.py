@@ -0,0 +1,198 @@
+import base64
+import json
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import providers
+import resilience
+from audio_preprocess import PreprocessTimeout, prepare_for_upload
+from metrics import span
+
+# Base64 is decoded in slices of this many characters (a multiple of 4), so
+# only one small decoded block is held in memory next to the request string.
+DECODE_BLOCK_CHARS = 256 * 1024
+
+# Binary uploads are copied to the spool file through one buffer of this size
+UPLOAD_BUFFER_BYTES = 64 * 1024
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_AUDIO_UPLOAD_BYTES', str(25 * 1024 * 1024)))
+
+_segment_pool = ThreadPoolExecutor(
+    max_workers=int(os.getenv('TRANSCRIBE_SEGMENT_WORKERS', '4')),
+    thread_name_prefix='transcribe-segment'
+)
+
+
+class TranscriptionError(Exception):
+    pass
+
+
+class UploadError(ValueError):
+    pass
+
+
+class UploadTooLarge(UploadError):
+    pass
+
+
+class AudioTooSlow(UploadError):
+    """The recording could not be decoded or re-encoded within the ffmpeg time limit."""
+
+
+def _base64_payload(chunk):
+    # Chunks arrive as data URLs ("data:audio/webm;base64,....") from the frontend
+    comma = chunk.find(',')
+    return chunk[comma + 1:] if comma != -1 else chunk
+
+
+def decode_chunk_to(fileobj, chunk):
+    payload = _base64_payload(chunk)
+    written = 0
+    for start in range(0, len(payload), DECODE_BLOCK_CHARS):
+        block = base64.b64decode(payload[start:start + DECODE_BLOCK_CHARS])
+        fileobj.write(block)
+        written += len(block)
+    return written
+
+
+def spool_chunks(chunks, suffix=''):
+    """Decode every chunk in order into one temp file and return (path, size).
+
+    The extension is fixed up from the file's contents before upload.
+    """
+    size = 0
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
+        try:
+            for chunk in chunks:
+                size += decode_chunk_to(tmp_file, chunk)
+        except Exception:
+            tmp_file.close()
+            os.unlink(tmp_file.name)
+            raise
+        return tmp_file.name, size
+
+
+def spool_stream(stream, max_bytes=MAX_UPLOAD_BYTES, suffix=''):
+    """Copy a binary body into a temp file and return (path, size), failing once it exceeds ``max_bytes``."""
+    buffer = bytearray(UPLOAD_BUFFER_BYTES)
+    view = memoryview(buffer)
+    readinto = getattr(stream, 'readinto', None)
+    size = 0
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
+        try:
+            while True:
+                if readinto is not None:
+                    count = readinto(buffer)
+                    block = view[:count] if count else None
+                else:
+                    block = stream.read(UPLOAD_BUFFER_BYTES)
+                    count = len(block)
+                if not count:
+                    break
+                size += count
+                if size > max_bytes:
+                    raise UploadTooLarge(f'Audio upload exceeds {max_bytes} bytes')
+                tmp_file.write(block)
+        except Exception:
+            tmp_file.close()
+            os.unlink(tmp_file.name)
+            raise
+        return tmp_file.name, size
+
+
+def transcribe_file(audio_file_path):
+    transcriber = providers.get_transcriber()
+    with span('assemblyai.transcribe'):
+        transcript = resilience.assemblyai.call(lambda: transcriber.transcribe(audio_file_path))
+    if transcript.status == providers.assemblyai().TranscriptStatus.error:
+        raise TranscriptionError(transcript.error)
+    return transcript.text or ''
+
+
+def _transcribe_and_cleanup(audio_file_path):
+    # prepare_for_upload deletes the recording itself if it fails
+    try:
+        audio_file_path, upload_path = prepare_for_upload(audio_file_path)
+    except PreprocessTimeout as e:
+        raise AudioTooSlow(str(e)) from e
+    try:
+        return transcribe_file(upload_path)
+    finally:
+        os.unlink(audio_file_path)
+        if upload_path != audio_file_path:
+            os.unlink(upload_path)
+
+
+def transcribe_chunks(chunks, suffix=''):
+    audio_file_path, _ = spool_chunks(chunks, suffix)
+    return _transcribe_and_cleanup(audio_file_path)
+
+
+def transcribe_stream(stream, max_bytes=MAX_UPLOAD_BYTES):
+    audio_file_path, size = spool_stream(stream, max_bytes)
+    if size == 0:
+        os.unlink(audio_file_path)
+        raise UploadError('No audio data provided')
+    return _transcribe_and_cleanup(audio_file_path)
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _cancel_segments(futures):
+    # Segments that have not started still own their spooled file
+    for path, future in futures:
+        if future.cancel():
+            os.unlink(path)
+
+
+def stream_transcription(chunks, segmented=False, suffix=''):
+    """Yield server-sent events for a transcription request.
+
+    With ``segmented`` each chunk must be an independently decodable recording
+    (the client restarts its recorder per segment). Each segment is handed to
+    the transcription pool as soon as it is spooled, so the first segment is
+    being transcribed while later ones are still being decoded, and partial
+    text is emitted in order as each segment finishes. Otherwise all chunks
+    are spooled as a single recording and one final transcript is emitted.
+    """
+    if not segmented:
+        yield sse_event('status', {'stage': 'uploading', 'chunks': len(chunks)})
+        try:
+            audio_file_path, size = spool_chunks(chunks, suffix)
+        except Exception as e:
+            yield sse_event('error', {'error': str(e)})
+            return
+        yield sse_event('status', {'stage': 'transcribing', 'bytes': size})
+        try:
+            text = _transcribe_and_cleanup(audio_file_path)
+        except Exception as e:
+            yield sse_event('error', {'error': str(e)})
+            return
+        yield sse_event('final', {'text': text})
+        return
+
+    futures = []
+    for index, chunk in enumerate(chunks):
+        try:
+            audio_file_path, _ = spool_chunks([chunk], suffix)
+        except Exception as e:
+            _cancel_segments(futures)
+            yield sse_event('error', {'error': str(e), 'segment': index})
+            return
+        futures.append((audio_file_path, _segment_pool.submit(_transcribe_and_cleanup, audio_file_path)))
+    yield sse_event('status', {'stage': 'transcribing', 'segments': len(futures)})
+
+    texts = []
+    for index, (_, future) in enumerate(futures):
+        try:
+            text = future.result()
+        except Exception as e:
+            _cancel_segments(futures[index + 1:])
+            yield sse_event('error', {'error': str(e), 'segment': index})
+            return
+        texts.append(text)
+        yield sse_event('partial', {'segment': index, 'text': text})
+
+    yield sse_event('final', {'text': ' '.join(t for t in texts if t)})
@@ -8,6 +8,13 @@ if (!firebase.apps.length) {
     firebase.initializeApp(firebaseConfig);
 }
 
+// Attach the signed-in user's Firebase ID token to backend requests
+async function authHeaders(extra = {}) {
+    const user = firebase.auth().currentUser;
+    const token = user ? await user.getIdToken() : '';
+    return { ...extra, 'Authorization': `Bearer ${token}` };
+}
+
 // DOM Elements
 const appointmentsList = document.getElementById('appointmentsList');
 const noAppointments = document.getElementById('noAppointments');
@@ -47,7 +54,7 @@ async function loadAppointments() {
         }
 
         showLoading();
-        const response = await fetch(`http://localhost:5000/api/appointments/${user.uid}`);
+        const response = await fetch(`http://localhost:5000/api/appointments/${user.uid}`, { headers: await authHeaders() });
         
         if (response.ok) {
             const data = await response.json();
@@ -115,6 +122,7 @@ function displayAppointments(appointments) {
                                 <div class="space-y-1 text-sm text-gray-600">
                                     <p><strong>Date:</strong> ${appointmentDate}</p>
                                     <p><strong>Time:</strong> ${appointment.preferredTime || 'Not specified'}</p>
+                                    ${appointment.clinicianName ? `<p><strong>Clinician:</strong> ${appointment.clinicianName}</p>` : ''}
                                     <p><strong>Booked on:</strong> ${date}</p>
                                 </div>
                             </div>
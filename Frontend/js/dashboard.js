@@ -463,24 +463,22 @@ async function loadLastHealthTrends(userId) {
     if (!container) return;
     container.innerHTML = '<div class="text-gray-400">Loading...</div>';
     try {
-        // Get the most recent health report for the user
-        const snapshot = await db.collection('healthReports')
-            .where('userId', '==', userId)
-            .orderBy('reportGeneratedAt', 'desc')
-            .limit(1)
-            .get();
-        if (snapshot.empty) {
-            container.innerHTML = '<div class="text-gray-400">No health report data available.</div>';
-            return;
+        // The per-user summary document carries the latest analysis; it is one read however long the history is
+        const summaryDoc = await db.collection('userSummaries').doc(userId).get();
+        let ai = summaryDoc.exists ? summaryDoc.data().latestReport : null;
+        if (!ai) {
+            // Summary not built yet: fall back to the most recent health report
+            const snapshot = await db.collection('healthReports')
+                .where('userId', '==', userId)
+                .orderBy('reportGeneratedAt', 'desc')
+                .limit(1)
+                .get();
+            if (snapshot.empty) {
+                container.innerHTML = '<div class="text-gray-400">No health report data available.</div>';
+                return;
+            }
+            ai = snapshot.docs[0].data().aiAnalysis || {};
         }
-        const doc = snapshot.docs[0];
-        const data = doc.data();
-        // Extract fields
-        const ai = data.aiAnalysis || {};
-        const patient = data.patientInfo || {};
-        const medical = data.medicalInfo || {};
-        const symptoms = (data.symptomAnalysis && data.symptomAnalysis.symptoms) || data.symptoms || [];
-        const transcript = (data.symptomAnalysis && data.symptomAnalysis.transcript) || data.transcript || '';
         // Most likely condition
         const mostLikely = ai.highestConfidenceAilment || (ai.possibleAilments && ai.possibleAilments[0]) || null;
         // Other possible ailments
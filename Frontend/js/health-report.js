@@ -10,6 +10,13 @@ if (!firebase.apps.length) {
     firebase.initializeApp(firebaseConfig);
 }
 
+// Attach the signed-in user's Firebase ID token to backend requests
+async function authHeaders(extra = {}) {
+    const user = firebase.auth().currentUser;
+    const token = user ? await user.getIdToken() : '';
+    return { ...extra, 'Authorization': `Bearer ${token}` };
+}
+
 // DOM Elements
 const logoutBtn = document.getElementById('logoutBtn');
 
@@ -48,7 +55,7 @@ async function loadHealthReports() {
         if (latestReportId) {
             try {
                 // Load the detailed health report from the ID passed from the previous page
-                const detailedResponse = await fetch(`http://localhost:5000/api/health-reports/detailed/${latestReportId}`);
+                const detailedResponse = await fetch(`http://localhost:5000/api/health-reports/detailed/${latestReportId}`, { headers: await authHeaders() });
                 if (detailedResponse.ok) {
                     const detailedData = await detailedResponse.json();
                     displayLatestReport(detailedData.healthReport);
@@ -78,7 +85,7 @@ async function loadHealthReports() {
 async function loadMostRecentHealthReport(userId) {
     try {
         // First, get the most recent symptom record
-        const response = await fetch(`http://localhost:5000/api/health-reports/${userId}`);
+        const response = await fetch(`http://localhost:5000/api/health-reports/${userId}?limit=1`, { headers: await authHeaders() });
         
         if (response.ok) {
             const data = await response.json();
@@ -92,7 +99,7 @@ async function loadMostRecentHealthReport(userId) {
                 try {
                     const detailedUrl = `http://localhost:5000/api/health-reports/detailed/${mostRecentReport.id}`;
                     console.log('Fetching detailed health report:', detailedUrl);
-                    const detailedResponse = await fetch(detailedUrl);
+                    const detailedResponse = await fetch(detailedUrl, { headers: await authHeaders() });
                     console.log('Detailed report fetch status:', detailedResponse.status);
                     if (detailedResponse.ok) {
                         const detailedData = await detailedResponse.json();
@@ -132,9 +139,9 @@ async function generateHealthReportFromSymptoms(symptomReport) {
 
         const response = await fetch('http://localhost:5000/api/generate-health-report', {
             method: 'POST',
-            headers: {
+            headers: await authHeaders({
                 'Content-Type': 'application/json'
-            },
+            }),
             body: JSON.stringify({
                 userId: user.uid,
                 symptomId: symptomReport.id
@@ -146,7 +153,7 @@ async function generateHealthReportFromSymptoms(symptomReport) {
             console.log('Generate health report response:', result);
             
             // Now fetch the generated detailed report by symptomId
-            const detailedResponse = await fetch(`http://localhost:5000/api/health-reports/detailed/${symptomReport.id}`);
+            const detailedResponse = await fetch(`http://localhost:5000/api/health-reports/detailed/${symptomReport.id}`, { headers: await authHeaders() });
             if (detailedResponse.ok) {
                 const detailedData = await detailedResponse.json();
                 displayLatestReport(detailedData.healthReport);
@@ -668,6 +675,13 @@ function showAppointmentModal(symptomId) {
                 <div class="mt-3">
                     <h3 class="text-lg font-medium text-gray-900 mb-4">Book Appointment</h3>
                     <form id="appointmentForm" class="space-y-4">
+                        <div>
+                            <label class="block text-sm font-medium text-gray-700">Available Slots</label>
+                            <select id="slotChoice"
+                                    class="mt-1 block w-full border-gray-300 rounded-md shadow-sm focus:ring-red-500 focus:border-red-500">
+                                <option value="">Loading earliest slots...</option>
+                            </select>
+                        </div>
                         <div>
                             <label class="block text-sm font-medium text-gray-700">Preferred Date</label>
                             <input type="date" id="preferredDate" required 
@@ -723,11 +737,36 @@ function showAppointmentModal(symptomId) {
     // Set minimum date to today
     const today = new Date().toISOString().split('T')[0];
     document.getElementById('preferredDate').min = today;
+    loadAvailableSlots(symptomId);
     
     // Handle form submission
     document.getElementById('appointmentForm').addEventListener('submit', (e) => handleAppointmentBooking(e, symptomId));
 }
 
+// Fill the slot picker with the earliest free slots for this symptom record's urgency
+async function loadAvailableSlots(symptomId) {
+    const select = document.getElementById('slotChoice');
+    let slots = [];
+    try {
+        const response = await fetch(`http://localhost:5000/api/appointments/availability?symptomId=${encodeURIComponent(symptomId)}&limit=8`, { headers: await authHeaders() });
+        if (response.ok) {
+            slots = (await response.json()).slots || [];
+        }
+    } catch (error) {
+        console.error('Error loading available slots:', error);
+    }
+    select.innerHTML = '<option value="">Request a preferred date and time instead</option>' + slots.map(slot => {
+        const when = new Date(slot.slotStart).toLocaleString([], { weekday: 'short', month: 'short', day: 'numeric', hour: '2-digit', minute: '2-digit' });
+        return `<option value="${slot.clinicianId}|${slot.slotStart}">${when} with ${slot.clinicianName} (${slot.specialty})</option>`;
+    }).join('');
+    select.addEventListener('change', () => {
+        // A picked slot replaces the free-form preferred date and time
+        const picked = Boolean(select.value);
+        document.getElementById('preferredDate').required = !picked;
+        document.getElementById('preferredTime').required = !picked;
+    });
+}
+
 // Close appointment modal
 function closeAppointmentModal() {
     const modal = document.getElementById('appointmentModal');
@@ -755,10 +794,16 @@ async function handleAppointmentBooking(e, symptomId) {
             urgency: document.getElementById('urgency').value,
             notes: document.getElementById('notes').value
         };
+        const slotChoice = document.getElementById('slotChoice').value;
+        if (slotChoice) {
+            const [clinicianId, slotStart] = slotChoice.split('|');
+            formData.clinicianId = clinicianId;
+            formData.slotStart = slotStart;
+        }
 
         const response = await fetch('http://localhost:5000/api/book-appointment', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
+            headers: await authHeaders({ 'Content-Type': 'application/json' }),
             body: JSON.stringify(formData)
         });
 
@@ -787,6 +832,10 @@ async function handleAppointmentBooking(e, symptomId) {
                     successDiv.remove();
                 }
             }, 5000);
+        } else if (response.status === 409) {
+            // The slot was taken meanwhile, or clashes with another appointment
+            showError((await response.json()).error);
+            loadAvailableSlots(symptomId);
         } else {
             showError('Failed to book appointment. Please try again.');
         }
@@ -8,6 +8,13 @@ if (!firebase.apps.length) {
     firebase.initializeApp(firebaseConfig);
 }
 
+// Attach the signed-in user's Firebase ID token to backend requests
+async function authHeaders(extra = {}) {
+    const user = firebase.auth().currentUser;
+    const token = user ? await user.getIdToken() : '';
+    return { ...extra, 'Authorization': `Bearer ${token}` };
+}
+
 // DOM Elements
 const startRecordingBtn = document.getElementById('startRecording');
 const recordingStatus = document.getElementById('recordingStatus');
@@ -65,16 +72,6 @@ async function initAudioContext() {
     return audioContext;
 }
 
-// Convert blob to base64
-function blobToBase64(blob) {
-    return new Promise((resolve, reject) => {
-        const reader = new FileReader();
-        reader.onload = () => resolve(reader.result);
-        reader.onerror = reject;
-        reader.readAsDataURL(blob);
-    });
-}
-
 // Visualize audio
 function visualize() {
     if (!isRecording || !analyser) return;
@@ -172,19 +169,11 @@ async function storeRecordingAndTranscribe(audioBlob) {
             throw new Error('User not authenticated');
         }
         showLoading();
-        // TODO: Convert audioBlob to PCM 16kHz chunks (currently webm/opus, needs conversion for AssemblyAI)
-        // For now, just read as a single chunk (not real streaming)
-        const base64Audio = await blobToBase64(audioBlob);
-        const audioChunks = [base64Audio];
-        // Send to backend for streaming transcription
-        const response = await fetch('http://localhost:5000/api/transcribe', {
+        // Send the recording as a raw binary body; the backend sniffs the container itself
+        const response = await fetch('http://localhost:5000/api/transcribe/upload', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({
-                userId: user.uid,
-                audio_chunks: audioChunks,
-                meta: { filename: 'voice-input', timestamp: Date.now() }
-            })
+            headers: await authHeaders({ 'Content-Type': audioBlob.type || 'application/octet-stream' }),
+            body: audioBlob
         });
         let transcriptText = '';
         if (response.ok) {
@@ -345,7 +334,7 @@ if (analyzeButton) {
             // Send transcript to backend for Gemini analysis
             const response = await fetch('http://localhost:5000/api/analyze-symptoms', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: await authHeaders({ 'Content-Type': 'application/json' }),
                 body: JSON.stringify({ transcript })
             });
             if (response.ok) {
@@ -394,7 +383,7 @@ async function saveSymptomsToFirestore(transcript, symptoms) {
         
         const response = await fetch('http://localhost:5000/api/save-symptoms', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
+            headers: await authHeaders({ 'Content-Type': 'application/json' }),
             body: JSON.stringify({
                 userId: user.uid,
                 transcript: transcript,
@@ -432,9 +421,9 @@ if (predictButton) {
                 throw new Error('User not authenticated');
             }
 
-            const response = await fetch('http://localhost:5000/api/predict-ailment', {
+            const response = await fetch('http://localhost:5000/api/predict-ailment/stream', {
                 method: 'POST',
-                headers: { 'Content-Type': 'application/json' },
+                headers: await authHeaders({ 'Content-Type': 'application/json' }),
                 body: JSON.stringify({
                     userId: user.uid,
                     symptoms: currentSymptoms,
@@ -443,8 +432,7 @@ if (predictButton) {
             });
 
             if (response.ok) {
-                const prediction = await response.json();
-                displayPredictionResults(prediction);
+                await readPredictionStream(response);
             } else {
                 showError('Failed to predict ailment.');
             }
@@ -456,6 +444,45 @@ if (predictButton) {
     });
 }
 
+// Show each ailment as the server streams it, then the full prediction
+async function readPredictionStream(response) {
+    const conditionsList = document.getElementById('conditionsList');
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+    let shown = 0;
+
+    while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, boundary);
+            buffer = buffer.slice(boundary + 2);
+            const eventName = (rawEvent.match(/^event: (.*)$/m) || [])[1];
+            const data = JSON.parse((rawEvent.match(/^data: (.*)$/m) || [])[1] || 'null');
+
+            if (eventName === 'ailment') {
+                if (shown === 0) {
+                    conditionsList.innerHTML = '';
+                    document.getElementById('analysisResults').classList.remove('hidden');
+                    hideLoading();
+                }
+                const li = document.createElement('li');
+                li.innerHTML = `<strong>${data.name}</strong> (${data.confidence} confidence) - ${data.description}`;
+                conditionsList.appendChild(li);
+                shown += 1;
+            } else if (eventName === 'prediction') {
+                displayPredictionResults(data);
+            } else if (eventName === 'error') {
+                showError('Failed to predict ailment.');
+            }
+        }
+    }
+}
+
 // Display prediction results
 function displayPredictionResults(prediction) {
     const analysisResults = document.getElementById('analysisResults');
@@ -542,7 +569,7 @@ async function generateHealthReportAndRedirect() {
 
         const response = await fetch('http://localhost:5000/api/generate-health-report', {
             method: 'POST',
-            headers: { 'Content-Type': 'application/json' },
+            headers: await authHeaders({ 'Content-Type': 'application/json' }),
             body: JSON.stringify({
                 userId: user.uid,
                 symptomId: currentSymptomId